@@ -1,43 +1,27 @@
 import streamlit as st
-import requests
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import OpenAIEmbeddings
 from langchain_ollama import ChatOllama
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_deepseek import ChatDeepSeek
-from langchain_huggingface import HuggingFaceEmbeddings
 import os
 import json
 from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
-from sqlalchemy import create_engine
-from sqlalchemy.pool import StaticPool
 from sqlalchemy import text
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain.agents import create_agent
-from langchain_community.callbacks import get_openai_callback
-from langchain_core.callbacks import BaseCallbackHandler
 import time
-import pathlib
+import uuid
+import pandas as pd
+from history import HistoryManager
+from usage import empty_totals, process_totals
+from tracing import Tracer, format_waterfall
+from jobs import submit
+from stream_render import StreamRenderer
+from sql_templates import get_stats as get_template_stats
+from model_router import FAST_MODELS, get_stats as get_routing_stats
+from engine import AgentEngine, HISTORY_TURNS, RUN_BUDGET, run_routed
+from llm_scheduler import get_scheduler, set_session as set_llm_session
+from session_registry import get_registry, process_memory
+import warmup
 
 # load_dotenv()
 
-def _download_db():
-    url = "https://drive.google.com/uc?export=download&id=1x0f_hL-69JDG4-gS3d8owyjOjdxpB9Ql"
-    local_path = pathlib.Path("schools.db")
-
-    if local_path.exists():
-        print(f"{local_path} already exists, skipping download.")
-    else:
-        response = requests.get(url)
-        if response.status_code == 200:
-            local_path.write_bytes(response.content)
-            print(f"File downloaded and saved as {local_path}")
-        else:
-            print(f"Failed to download the file. Status code: {response.status_code}")
- 
-
 # -------------------------
 # Authentication utilities
 # -------------------------
@@ -82,6 +66,11 @@ def _load_api_keys_once():
                 os.environ[str(k)] = str(v)
         st.session_state.api_keys_loaded = True
 
+def _is_admin():
+    # Admins ([auth] admins = ["name", ...]) see every session in the memory view
+    admins = st.secrets.get("auth", {}).get("admins", [])
+    return st.session_state.get("user") in list(admins)
+
 def _unload_api_keys():
     """
     Remove any previously loaded API keys from process env on sign-out.
@@ -95,38 +84,20 @@ def sign_out():
     # Clear authentication and app state for a clean logout
     _unload_api_keys() 
     keys_to_clear = [
-        "authenticated", "user", "db", "engine", "model",
-        "embeddings", "vectorstore", "usable_tables",
-        "messages", "token_stats"
+        "authenticated", "user", "messages", "history_summary", "token_stats",
+        "usage_totals", "active_run", "history_pages"
     ]
+    if "active_run" in st.session_state:
+        st.session_state.active_run["job"].cancel()
+    # The session's engine lives in the process registry, not in session state
+    if "session_id" in st.session_state:
+        get_registry().drop(st.session_state.session_id)
     for k in keys_to_clear:
         if k in st.session_state:
             del st.session_state[k]
     st.rerun()
 
 
-# -------------------------
-# Token tracking callback
-# -------------------------
-class TokenCounterCallback(BaseCallbackHandler):
-    def __init__(self):
-        self.input_tokens = 0
-        self.output_tokens = 0
-        self.total_tokens = 0
-    
-    def on_llm_start(self, serialized, prompts, **kwargs):
-        # Approximate token count for input (rough estimation: 1 token ≈ 4 chars)
-        for prompt in prompts:
-            self.input_tokens += len(prompt) // 4
-    
-    def on_llm_end(self, response, **kwargs):
-        # Track output tokens
-        for generation in response.generations:
-            for gen in generation:
-                self.output_tokens += len(gen.text) // 4
-        self.total_tokens = self.input_tokens + self.output_tokens
-
-
 # -------------------------
 # Page config
 # -------------------------
@@ -136,6 +107,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Build the shared DB, embeddings and indexes in the background while the user signs in
+warm = warmup.start(fast_models=FAST_MODELS)
+
 # Title
 st.title("🤖 SQL Database Agent with Semantic Search")
 st.markdown("Ask questions about your database in natural language!")
@@ -164,10 +138,29 @@ with st.sidebar:
     else:
         st.success(f"Signed in as {st.session_state.get('user', 'user')}")
         _load_api_keys_once()  # << ensure keys are loaded for already-authenticated sessions
-        _download_db() # Ensure DB is downloaded
         if st.button("Sign Out"):
             sign_out()
 
+# -------------------------
+# Initialize session state
+# -------------------------
+if "messages" not in st.session_state:
+    st.session_state.messages = []
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+# LLM calls made on this script thread (history summaries) queue under this session
+set_llm_session(st.session_state.session_id)
+
+# Activity and memory accounting; sessions idle past the TTL lose their engine
+sessions = get_registry()
+sessions.touch(
+    st.session_state.session_id,
+    user=st.session_state.get("user", ""),
+    messages=st.session_state.messages,
+    busy="active_run" in st.session_state,
+)
+agent_engine = sessions.engine(st.session_state.session_id)
+
 # -------------------------
 # Sidebar placeholders and config (only visible after login)
 # -------------------------
@@ -192,23 +185,69 @@ with st.sidebar:
         index=1,
         help="Invoke mode is more stable and prevents recursion errors"
     )
+
+    # Conversation history budget
+    history_token_budget = st.number_input(
+        "History token budget",
+        min_value=500,
+        max_value=32000,
+        value=3000,
+        step=500,
+        help="Recent turns are sent verbatim up to this many tokens; older turns are summarised"
+    )
+
+    # Rows of a query result sent back to the model (the user always sees all rows)
+    rows_to_model = st.number_input(
+        "Rows echoed to the model",
+        min_value=0,
+        max_value=1000,
+        value=20,
+        step=5,
+        help="Query results are shown as a table; the model only sees this many rows to summarise"
+    )
+
+    # Answer simple parametric questions from SQL templates without the LLM
+    use_templates = st.checkbox(
+        "Template fast path",
+        value=True,
+        help="Top-N, single-field lookups and counts run vetted SQL directly; other questions go to the agent"
+    )
+
+    # Send simple questions to the provider's fast model, escalating on failure
+    use_model_routing = st.checkbox(
+        "Route simple questions to a fast model",
+        value=True,
+        help="Complex questions and failed fast runs use the selected model"
+    )
     
     st.divider()
     
     # Database info
     st.header("📊 Database Info")
     db_info_ph = st.empty()
-    if "db" in st.session_state:
+    if agent_engine is not None:
         with db_info_ph.container():
             st.success(f"✅ Connected to database")
-            st.info(f"**Dialect:** {st.session_state.db.dialect}")
-            if "usable_tables" in st.session_state:
-                st.info(f"**Tables:** {len(st.session_state.usable_tables)}")
-            else:
-                st.info(f"**Tables:** {len(st.session_state.db.get_usable_table_names())}")
+            st.info(f"**Dialect:** {agent_engine.db.dialect}")
+            st.info(f"**Tables:** {len(agent_engine.usable_tables)}")
+            if agent_engine.partitions:
+                st.info(f"**Data years:** {', '.join(map(str, agent_engine.partitions))}")
     else:
         with sidebar_status.container():
             st.info("Loading Data, please wait...")
+    with st.expander("Warm-up", expanded=not warm.done()):
+        if warm.error is not None:
+            st.error(f"Warm-up failed: {warm.error}")
+        elif warm.done():
+            st.success("Shared resources ready")
+            st.caption(f"Embedding backend: {warm.resources.get('embedding_backend')}")
+        else:
+            st.progress(warm.progress(), text=f"Warming up: {warm.current_stage()}")
+        st.table({
+            "stage": list(warm.stages),
+            "status": [s["status"] for s in warm.stages.values()],
+            "ms": [s["ms"] for s in warm.stages.values()],
+        })
 
     st.divider()
     
@@ -218,458 +257,376 @@ with st.sidebar:
         stats = st.session_state.token_stats
         st.metric("Input Tokens", stats.get("input", 0))
         st.metric("Output Tokens", stats.get("output", 0))
+        st.metric("Cached Tokens", stats.get("cached", 0))
         st.metric("Total Tokens", stats.get("total", 0))
         time_val = stats.get("time_s", None)
         if time_val is not None:
             st.metric("Response Time (s)", f"{time_val:.2f}")
     else:
         st.info("Run a query to see token usage")
+    template_stats = get_template_stats().summary()
+    if template_stats["hits"] or template_stats["misses"]:
+        with st.expander("Template fast path"):
+            st.metric("Hit rate", f"{template_stats['hit_rate']:.0%}")
+            st.table({
+                "path": ["template", "agent"],
+                "answers": [template_stats["template_runs"], template_stats["agent_runs"]],
+                "p50 ms": [template_stats["template_p50_ms"], template_stats["agent_p50_ms"]],
+            })
+    routing_stats = get_routing_stats().summary()
+    if sum(routing_stats["decisions"].values()):
+        with st.expander("Model routing"):
+            st.table({
+                "tier": ["fast", "strong"],
+                "questions": [routing_stats["decisions"]["fast"], routing_stats["decisions"]["strong"]],
+                "tokens": [routing_stats["tokens"]["fast"], routing_stats["tokens"]["strong"]],
+                "p50 ms": [routing_stats["fast_p50_ms"], routing_stats["strong_p50_ms"]],
+            })
+            st.caption(
+                f"Escalations: {routing_stats['escalations']} · "
+                f"tokens of questions the fast model answered: {routing_stats['fast_tier_tokens']}"
+            )
+    scheduler_metrics = get_scheduler().metrics()
+    if scheduler_metrics:
+        with st.expander("LLM scheduler"):
+            st.table({
+                "provider": [m["provider"] for m in scheduler_metrics],
+                "running": [f"{m['in_flight']}/{m['max_concurrent']}" for m in scheduler_metrics],
+                "queued": [m["queued"] for m in scheduler_metrics],
+                "waited": [m["waited"] for m in scheduler_metrics],
+                "wait p95 s": [m["wait_p95_s"] for m in scheduler_metrics],
+                "rejected": [m["rejected_full"] + m["rejected_timeout"] for m in scheduler_metrics],
+                "429s": [m["rate_limited"] for m in scheduler_metrics],
+            })
+            st.download_button("Export metrics", get_scheduler().prometheus_text(),
+                               file_name="llm_scheduler.prom", mime="text/plain")
+    with st.expander("🧮 Memory"):
+        memory = process_memory()
+        own = next((r for r in sessions.snapshot() if r["session"] == st.session_state.session_id[:8]), None)
+        cols = st.columns(2)
+        cols[0].metric("Process RSS (MB)", memory["rss_mb"])
+        cols[1].metric("This session (KB)", own["history_kb"] if own else 0)
+        st.caption(f"Peak RSS {memory['peak_rss_mb']} MB · {memory['threads']} threads · "
+                   f"engines idle for {sessions.idle_ttl / 60:.0f} min are released")
+        if _is_admin():
+            st.table(sessions.snapshot())
+            st.caption(f"{sessions.evicted} engines released so far")
+            if st.button("Release idle engines now"):
+                st.caption(f"Released {sessions.sweep()} engines")
+    if "usage_totals" in st.session_state:
+        with st.expander("Session and process totals"):
+            session_usage = st.session_state.usage_totals
+            all_usage = process_totals()
+            st.table({
+                "scope": ["session", "process"],
+                "LLM calls": [session_usage["calls"], all_usage["calls"]],
+                "input": [session_usage["input"], all_usage["input"]],
+                "output": [session_usage["output"], all_usage["output"]],
+                "cached": [session_usage["cached"], all_usage["cached"]],
+                "total": [session_usage["total"], all_usage["total"]],
+            })
+
+# How often the page polls a background run for new events (redraws are capped by StreamRenderer)
+UI_REFRESH_SECONDS = 0.1
+# Rows of a result table kept in the chat history
+RESULT_ROWS_KEPT = 5000
+# Messages rendered per page of history, and result tables rendered without a toggle
+MESSAGES_PER_PAGE = 20
+RESULT_TABLES_SHOWN = 3
+
+def wait_for_warmup():
+    """Show the warm-up progress until it finishes, then return the shared resources."""
+    progress = st.progress(warm.progress(), text="Warming up...")
+    while not warm.wait(0.25):
+        progress.progress(warm.progress(), text=f"Warming up: {warm.current_stage()}...")
+    progress.empty()
+    return warm.attach()
 
-# -------------------------
-# Initialize session state
-# -------------------------
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+def build_conversation_messages():
+    # Recent turns verbatim within the token budget; older turns are folded
+    # into a rolling summary cached in session state. Error replies are dropped.
+    manager = HistoryManager(
+        model=agent_engine.models["strong"],
+        budget_tokens=history_token_budget,
+    )
+    summary_state = st.session_state.setdefault("history_summary", {"folded": 0, "summary": ""})
+    return manager.build(st.session_state.messages, summary_state)
+
+def watch_run(run):
+    # Render the session's background run, polling its queue until it ends or is stopped
+    job = run["job"]
+    stop_ph = st.empty()
+    if stop_ph.button("⏹ Stop", key=f"stop_{job.id}"):
+        job.cancel()
+    steps_container = None
+    if run["mode"] != "Invoke (Stable)":
+        with st.expander("🧠 Thinking steps", expanded=True):
+            steps_container = st.container()
+    status_ph = st.empty()
+    answer_placeholder = st.empty()
+    renderer = StreamRenderer(
+        steps_container, status_ph, answer_placeholder,
+        expected_tool_calls=RUN_BUDGET["max_llm_calls"],
+        started=run["start_time"],
+    )
+    # A rerun rebuilds the page: replay the steps received so far
+    renderer.feed(job.log)
+    renderer.flush(force=True)
+    while not job.done() and not job.cancelled:
+        renderer.feed(job.drain())
+        renderer.flush()
+        time.sleep(UI_REFRESH_SECONDS)
+    renderer.feed(job.drain())
+    stop_ph.empty()
+    status_ph.empty()
+    answer_placeholder.empty()
+    finish_run(run)
+
+def render_result(result, key):
+    # Rows of the answer's final query as a sortable table with CSV download
+    df = pd.DataFrame(result["rows"], columns=result["columns"])
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    st.download_button(
+        "⬇️ Download CSV",
+        df.to_csv(index=False),
+        file_name="query_result.csv",
+        mime="text/csv",
+        key=key,
+    )
 
-HISTORY_TURNS = 4
+def answer_with_template(question, tracer):
+    # Answer from a vetted SQL template; returns False to hand the question to the agent
+    if not use_templates:
+        return False
+    outcome = agent_engine.try_template(question, tracer, session=st.session_state.session_id)
+    if outcome is None:
+        return False
+    match, statement = outcome["match"], outcome["sql"][0]
+    response_text = outcome["answer"]
+    result = {"columns": outcome["result"]["columns"], "rows": outcome["result"]["rows"][:RESULT_ROWS_KEPT]}
+    token_info = {"input": 0, "output": 0, "cached": 0, "total": 0, "calls": 0, "time_s": round(outcome["elapsed_s"], 2)}
+    with st.chat_message("assistant"):
+        st.markdown(response_text)
+        render_result(result, key=f"csv_{len(st.session_state.messages)}")
+        with st.expander("⚡ Answered by SQL template"):
+            st.caption(
+                f"Intent: {match['intent']} · confidence {match['confidence']:.2f} · "
+                f"{outcome['elapsed_s'] * 1000:.0f} ms, no LLM calls"
+            )
+            st.code(statement["sql"], language="sql")
+            st.json(match["params"])
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": response_text,
+        "token_info": token_info,
+        "result": result,
+    })
+    st.session_state.token_stats = token_info
+    return True
+
+def finish_run(run):
+    # Close out a finished, failed or cancelled run: logs, usage, response and details
+    st.session_state.pop("active_run", None)
+    outcome = agent_engine.finish(run)
+    tracer = run["tracer"]
+    elapsed_s = outcome["elapsed_s"]
+
+    if outcome["status"] == "error":
+        error_msg = f"❌ Error: {outcome['error']}"
+        st.error(error_msg)
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": error_msg
+        })
+        return
 
-def build_conversation_messages():
-    # Clean history for the agent (only role + content)
-    return [
-        {"role": m["role"], "content": m["content"]}
-        for m in st.session_state.messages
-        if m.get("role") in ("user", "assistant") and m.get("content")
-    ]
+    response_text = outcome["answer"]
+    run_usage = outcome["usage"]
+    input_tokens = run_usage["input"]
+    output_tokens = run_usage["output"]
+    total_tokens = run_usage["total"]
+    decision = run["decision"]
 
-def _truncate(text, max_chars=1200):
-    try:
-        s = str(text)
-    except Exception:
-        s = repr(text)
-    return s if len(s) <= max_chars else s[:max_chars] + " ... [truncated]"
-
-# Normalize any stream item into a message for stream_mode="messages"
-def _as_msg(step):
-    try:
-        from langchain_core.messages import BaseMessage
-    except Exception:
-        BaseMessage = object
-    if isinstance(step, tuple) and step:
-        return step[0]
-    if isinstance(step, dict) and "messages" in step:
-        return step["messages"][-1]
-    return step
-
-# Extract tool call name and args regardless of provider shape
-def _tc_name_args(tc):
-    try:
-        if isinstance(tc, dict):
-            if "function" in tc:
-                fn = tc["function"] or {}
-                return fn.get("name", ""), fn.get("arguments", {})
-            return (
-                tc.get("name") or tc.get("type") or "",
-                tc.get("args") or tc.get("arguments") or tc.get("input") or {},
+    # Display response
+    if response_text:
+        st.markdown(response_text)
+    else:
+        st.warning("⚠️ No response generated. The query may have exceeded the run budget.")
+        response_text = "Query processing stopped - may need simplification or database contains complex data."
+
+    # Rows of the final successful query, straight from the database
+    result = None
+    if outcome["result"] is not None:
+        result = {"columns": outcome["result"]["columns"], "rows": outcome["result"]["rows"][:RESULT_ROWS_KEPT]}
+        render_result(result, key=f"csv_{len(st.session_state.messages)}")
+
+    # Display token info
+    token_info = {
+        "input": input_tokens,
+        "output": output_tokens,
+        "cached": run_usage["cached"],
+        "total": total_tokens,
+        "calls": run_usage["calls"],
+        "time_s": round(elapsed_s, 2),
+    }
+
+    with st.expander("📊 Token Usage"):
+        cols = st.columns(4)
+        cols[0].metric("Input Tokens", input_tokens)
+        cols[1].metric("Output Tokens", output_tokens)
+        cols[2].metric("Cached Tokens", run_usage["cached"])
+        cols[3].metric("Total Tokens", total_tokens)
+        st.dataframe(outcome["calls"], use_container_width=True)
+
+    # Timing expander
+    route = run["route"]
+    with st.expander("⏱️ Timing"):
+        st.metric("Response Time (s)", f"{elapsed_s:.2f}")
+        retrieval_path = "lexical fast path" if route["fast_path"] else "hybrid (lexical + embeddings)"
+        st.caption(f"Retrieval: {retrieval_path}")
+        if run["attempts"]:
+            attempts = " → ".join(
+                f"{a['model']} ({a['tier']}, {a['ms']:.0f} ms{'' if a['ok'] else ', failed'})"
+                for a in run["attempts"]
             )
-        name = getattr(tc, "name", None) or getattr(tc, "type", "") or ""
-        args = (
-            getattr(tc, "args", None)
-            or getattr(tc, "arguments", None)
-            or getattr(tc, "input", None)
-            or {}
+            score = f" · complexity score {decision['score']}" if decision["score"] is not None else ""
+            st.caption(f"Model: {attempts}{score}")
+        cache_stats = agent_engine.embeddings.cache.stats()
+        st.caption(
+            f"Query embedding cache: {cache_stats['hits']} hits, "
+            f"{cache_stats['misses']} misses, {cache_stats['size']} entries"
         )
-        return name, args
-    except Exception:
-        return "", {}
+        st.table({
+            "stage": list(route["timings"].keys()),
+            "ms": [round(v, 2) for v in route["timings"].values()],
+        })
+        st.caption("Trace waterfall (retrieval, LLM calls, tool calls, SQL)")
+        st.code(format_waterfall(tracer.spans), language="text")
+
+    # Show relevant tables
+    with st.expander("🔍 Relevant Tables (via Embeddings)"):
+        st.write(", ".join(route["tables"]))
+        st.text(run["relevant_columns"])
+
+    # Add to messages
+    message = {
+        "role": "assistant",
+        "content": response_text,
+        "token_info": token_info
+    }
+    if result is not None:
+        message["result"] = result
+    st.session_state.messages.append(message)
+
+    # Update session state token stats
+    st.session_state.token_stats = token_info
 
 # -------------------------
 # DB and model initialization (post-login)
 # -------------------------
-if "db" not in st.session_state:
+if agent_engine is None:
     # Run initialization with a spinner shown in the sidebar
     with db_info_ph.container():
         with sidebar_status.container():
             with st.spinner("Loading Data, please wait..."):
                 try:
-                    # Initialize database
-                    engine = create_engine(
-                        "sqlite:///schools.db",
-                        connect_args={"check_same_thread": False, "detect_types": 0},
-                        poolclass=StaticPool,
-                    )
-                    st.session_state.engine = engine
-                    st.session_state.db = SQLDatabase(engine=engine)
-                    # Exclude helper table from user-facing operations
-                    st.session_state.usable_tables = [
-                        t for t in st.session_state.db.get_usable_table_names()
-                        if t.lower() != "schema_information"
-                    ]
-                
-                    # Initialize model
-                    if model_choice == "DeepSeek":
-                        st.session_state.model = ChatDeepSeek(model="deepseek-chat")
-                    elif model_choice == "OpenAI GPT-4":
-                        st.session_state.model = ChatOpenAI(model="gpt-4")
-                    # elif model_choice == "Ollama":
-                    #     st.session_state.model = ChatOllama(
-                    #         model="qwen2.5-coder:3b",
-                    #         base_url="http://localhost:11434"
-                    #     )
-                    else:  # Google Gemini
-                        st.session_state.model = ChatGoogleGenerativeAI(model="gemini-2.0-flash-exp")
+                    # Shared indexes and model come from the process warm-up (warmup.py),
+                    # usually finished while the user was signing in
+                    shared = wait_for_warmup()
+                    # Database connection, models and SQL templates of this session on top
+                    # of the shared indexes; one engine per session, so cancelling a run
+                    # only interrupts this session's statements. It is kept in the session
+                    # registry, which closes it once the session has been idle for a while
+                    agent_engine = AgentEngine.from_warmup(shared, model_choice)
+                    sessions.set_engine(st.session_state.session_id, agent_engine)
+                    for warning in warm.warnings:
+                        st.warning(warning)
                     
-                    # Initialize embeddings
-                    st.session_state.embeddings = HuggingFaceEmbeddings(
-                        model_name="all-MiniLM-L6-v2"
-                    )
-                    
-                    def load_schema_info(engine):
-                        info = {}
-                        try:
-                            with engine.connect() as conn:
-                                res = conn.execute(
-                                    text("SELECT table_name, column_name, description FROM schema_information")
-                                )
-                                for table_name, column_name, description in res:
-                                    info.setdefault(table_name, []).append((column_name, description))
-                        except Exception:
-                            # If table doesn't exist or is unreadable, silently fallback
-                            pass
-                        return info
-                    
-                    # Create schema documents enriched with column descriptions
-                    def create_schema_documents(db, usable_tables, schema_info):
-                        docs = []
-                        for table in usable_tables:
-                            try:
-                                table_info = db.get_table_info([table])
-                                desc_lines = ""
-                                if table in schema_info:
-                                    parts = [f"- {col}: {desc}" for col, desc in schema_info[table] if desc]
-                                    if parts:
-                                        desc_lines = "Column descriptions:\n" + "\n".join(parts)
-
-                                content_parts = [f"Table: {table}", table_info]
-                                if desc_lines:
-                                    content_parts.append(desc_lines)
-                                page_content = "\n\n".join(content_parts)
-
-                                doc = Document(
-                                    page_content=page_content,
-                                    metadata={"table_name": table, "type": "schema"}
-                                )
-                                docs.append(doc)
-                            except Exception as e:
-                                st.warning(f"Could not process table {table}: {e}")
-                                continue
-                        return docs
-                    
-                    schema_info = load_schema_info(st.session_state.engine)
-                    schema_docs = create_schema_documents(
-                        st.session_state.db,
-                        st.session_state.usable_tables,
-                        schema_info
-                    )
-                    st.session_state.vectorstore = FAISS.from_documents(
-                        schema_docs,
-                        st.session_state.embeddings
-                    )
-                    
-                    st.success(f"✅ Initialized {len(schema_docs)} table embeddings")
+                    st.success(f"✅ Initialized {shared['schema_doc_count']} table embeddings")
                 
                 except Exception as e:
                     st.error(f"❌ Error initializing: {str(e)}")
                     st.stop()
                 # After the spinner closes, show success status in the sidebar
                 st.success("Data Loaded Successfully")
-                st.info(f"**Dialect:** {st.session_state.db.dialect}")
-                st.info(f"**Tables:** {len(st.session_state.usable_tables) if 'usable_tables' in st.session_state else len(st.session_state.db.get_usable_table_names())}")
+                st.info(f"**Dialect:** {agent_engine.db.dialect}")
+                st.info(f"**Tables:** {len(agent_engine.usable_tables)}")
+                if agent_engine.partitions:
+                    st.info(f"**Data years:** {', '.join(map(str, agent_engine.partitions))}")
 
 # -------------------------
 # Display chat messages
 # -------------------------
-for message in st.session_state.messages:
+# Only the latest page of the conversation is rendered on each rerun; older
+# messages are paged in on request, and older result tables behind a toggle
+messages = st.session_state.messages
+shown = min(len(messages), MESSAGES_PER_PAGE * st.session_state.get("history_pages", 1))
+if shown < len(messages):
+    if st.button(f"⬆️ Show earlier messages ({len(messages) - shown} hidden)"):
+        st.session_state.history_pages = st.session_state.get("history_pages", 1) + 1
+        st.rerun()
+with_results = [i for i, m in enumerate(messages) if "result" in m]
+recent_results = set(with_results[-RESULT_TABLES_SHOWN:])
+for i in range(len(messages) - shown, len(messages)):
+    message = messages[i]
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if "result" in message:
+            rows = len(message["result"]["rows"])
+            if i in recent_results or st.toggle(f"Show result table ({rows} rows)", key=f"show_{i}"):
+                render_result(message["result"], key=f"csv_{i}")
         if "token_info" in message:
-            with st.expander("📊 Token Usage"):
-                cols = st.columns(3)
-                cols[0].metric("Input", message["token_info"]["input"])
-                cols[1].metric("Output", message["token_info"]["output"])
-                cols[2].metric("Total", message["token_info"]["total"])
+            info = message["token_info"]
+            st.caption(
+                f"📊 {info['input']} input · {info['output']} output · {info['total']} total tokens"
+                + (f" · {info['time_s']}s" if info.get("time_s") is not None else "")
+            )
 
 # -------------------------
 # Chat input and agent logic
 # -------------------------
 if question := st.chat_input("Ask a question about the database..."):
+    if "active_run" in st.session_state:
+        # A new question supersedes the run still in flight
+        st.session_state.active_run["job"].cancel()
+        with st.chat_message("assistant"):
+            finish_run(st.session_state.active_run)
+
     # Add user message
     st.session_state.messages.append({"role": "user", "content": question})
     with st.chat_message("user"):
         st.markdown(question)
 
-    # Build retrieval query using recent user turns + current question
-    past_user_utts = [m["content"] for m in st.session_state.messages if m["role"] == "user"][-(HISTORY_TURNS-1):]
-    retrieval_query = " ".join(past_user_utts + [question])
-    
-    # Get relevant tables using embeddings
-    relevant_docs = st.session_state.vectorstore.similarity_search(retrieval_query, k=3)
-    relevant_tables = [doc.metadata["table_name"] for doc in relevant_docs]
-    
-    # Create system prompt
-    system_prompt = """
-You are an agent designed to interact with a SQL database.
-Given an input question, create a syntactically correct {dialect} query to run,
-then look at the results of the query and return the answer.
-
-CRITICAL INSTRUCTIONS:
-1. First, use sql_db_list_tables to see available tables
-2. Then use sql_db_schema to get the schema of relevant tables
-3. Write and execute ONE SQL query using sql_db_query
-4. Return the answer based on the query results
-5. If the query fails, try ONCE more with a corrected query, then stop
-6. NEVER loop endlessly - if you can't solve it in 2 query attempts, explain the issue
-
-IMPORTANT NOTES:
-- Date columns may be stored as TEXT in DD-MM-YYYY format. Treat them as strings.
-- Unless the user specifies a number, limit results to {top_k} rows
-- Never query for all columns - only ask for relevant ones
-- DO NOT make DML statements (INSERT, UPDATE, DELETE, DROP)
-- Order results by a relevant column when appropriate
-
-SEMANTIC HINT: The most relevant tables for this query are likely: {relevant_tables}
-Start by examining these tables first.
-
-All available tables: {all_tables}
-""".format(
-        dialect=st.session_state.db.dialect,
-        top_k=5,
-        relevant_tables=", ".join(relevant_tables),
-        all_tables=st.session_state.usable_tables if "usable_tables" in st.session_state
-        else st.session_state.db.get_usable_table_names(),
-    )
-    
-    # Create toolkit and agent
-    toolkit = SQLDatabaseToolkit(
-        db=st.session_state.db,
-        llm=st.session_state.model
-    )
-    tools = toolkit.get_tools()
-    
-    agent = create_agent(
-        st.session_state.model,
-        tools,
-        system_prompt=system_prompt,
-    )
+    tracer = Tracer(question=question, user=st.session_state.get("user", ""))
+    # Simple parametric questions are answered from SQL templates, the rest by the agent
+    if not answer_with_template(question, tracer):
+        # Build retrieval query from recent user turns (the current question is the last one)
+        past_user_utts = [m["content"] for m in st.session_state.messages if m["role"] == "user"][-(HISTORY_TURNS-1):]
+        retrieval_query = " ".join(past_user_utts)
+        route, relevant_columns = agent_engine.retrieve(retrieval_query, past_user_utts, tracer)
+
+        # Recent turns verbatim, older turns as a summary appended to the system prompt
+        conversation_messages, history_summary = build_conversation_messages()
+
+        # Prompt, tools, agents (fast / strong), query log, supervisor and usage collector
+        run = agent_engine.prepare(
+            question, route, relevant_columns, conversation_messages, tracer,
+            history_summary=history_summary,
+            mode=agent_mode,
+            rows_to_model=rows_to_model,
+            use_routing=use_model_routing,
+            session=st.session_state.session_id,
+            usage_totals=st.session_state.setdefault("usage_totals", empty_totals()),
+            model_label=model_choice,
+        )
+        # Run the agent on the worker pool; the page renders its steps below
+        with tracer.activate():
+            run["job"] = submit(lambda job: run_routed(job, run), session=st.session_state.session_id)
+        st.session_state.active_run = run
 
-    # Include full chat history (user + assistant) for context
-    conversation_messages = build_conversation_messages()
-    
-    # Generate response with token tracking
+if "active_run" in st.session_state:
     with st.chat_message("assistant"):
-        with st.spinner("🤔 Thinking..."):
-            try:
-                # Initialize token counter
-                token_callback = TokenCounterCallback()
-                
-                # Configuration with increased recursion limit
-                config = {
-                    "recursion_limit": 50,  # Increased from default 25
-                    "callbacks": [token_callback]
-                }
-
-                # Track execution time
-                start_time = time.perf_counter()
-                
-                # Choose between streaming and invoke mode based on sidebar selection
-                if agent_mode == "Invoke (Stable)":
-                    # Use invoke for more stable execution
-                    if model_choice == "OpenAI GPT-4":
-                        with get_openai_callback() as cb:
-                            result = agent.invoke(
-                                {"messages": conversation_messages},
-                                config=config
-                            )
-                            response_text = result["messages"][-1].content
-                            input_tokens = cb.prompt_tokens
-                            output_tokens = cb.completion_tokens
-                            total_tokens = cb.total_tokens
-                    else:
-                        result = agent.invoke(
-                            {"messages": conversation_messages},
-                            config=config
-                        )
-                        response_text = result["messages"][-1].content
-                        input_tokens = token_callback.input_tokens
-                        output_tokens = token_callback.output_tokens
-                        total_tokens = token_callback.total_tokens
-                
-                else:  # Stream (Real-time) mode
-                    # Use streaming mode for real-time updates
-                    if model_choice == "OpenAI GPT-4":
-                        with get_openai_callback() as cb:
-                            response_text = ""
-                            step_count = 0
-                            max_steps = 1000
-                            with st.expander("🧠 Thinking steps", expanded=True):
-                                steps_container = st.container()
-                                step_counter_ph = st.empty()
-                                step_progress = st.progress(0)
-                            answer_placeholder = st.empty()
- 
-                            for step in agent.stream(
-                                {"messages": conversation_messages},
-                                stream_mode="messages",  # stream individual messages
-                                config=config
-                            ):
-                                step_count += 1
-                                if step_count > max_steps:
-                                    st.warning(f"⚠️ Stopped after {max_steps} steps to prevent timeout")
-                                    break
- 
-                                # Update step counter and progress bar
-                                percent = min(int(step_count / max_steps * 100), 100)
-                                step_counter_ph.markdown(f"Step {step_count} of {max_steps}")
-                                step_progress.progress(percent)
-  
-                                msg = _as_msg(step)
- 
-                                # Tool calls from the AI
-                                tool_calls = getattr(msg, "tool_calls", None)
-                                if tool_calls:
-                                    for tc in tool_calls:
-                                        name, args = _tc_name_args(tc)
-                                        with steps_container:
-                                            st.markdown(f"Step {step_count} • Calling tool: {name}")
-                                            if name == "sql_db_query":
-                                                sql = args if isinstance(args, str) else (args.get("query") if isinstance(args, dict) else args)
-                                                st.code(_truncate(sql), language="sql")
-                                            else:
-                                                st.code(_truncate(args), language="json")
-                                    continue
- 
-                                # Tool result messages
-                                if getattr(msg, "type", "") == "tool":
-                                    name = getattr(msg, "name", "")
-                                    with steps_container:
-                                        st.markdown(f"Step {step_count} ✓ Tool finished: {name}")
-                                        st.code(_truncate(getattr(msg, "content", "")), language="text")
-                                    continue
- 
-                                # Final assistant content
-                                if getattr(msg, "type", "") == "ai":
-                                    content = getattr(msg, "content", "")
-                                    if content:
-                                        response_text = content
-                                        answer_placeholder.markdown(response_text)
-                            
-                            input_tokens = cb.prompt_tokens
-                            output_tokens = cb.completion_tokens
-                            total_tokens = cb.total_tokens
-                    else:
-                        response_text = ""
-                        step_count = 0
-                        max_steps = 1000
-                        with st.expander("🧠 Thinking steps", expanded=True):
-                            steps_container = st.container()
-                            step_counter_ph = st.empty()
-                            step_progress = st.progress(0)
-                        answer_placeholder = st.empty()
- 
-                        for step in agent.stream(
-                            {"messages": conversation_messages},
-                            stream_mode="messages",
-                            config=config
-                        ):
-                            step_count += 1
-                            if step_count > max_steps:
-                                st.warning(f"⚠️ Stopped after {max_steps} steps to prevent timeout")
-                                break
- 
-                            # Update step counter and progress bar
-                            percent = min(int(step_count / max_steps * 100), 100)
-                            step_counter_ph.markdown(f"Step {step_count} of {max_steps}")
-                            step_progress.progress(percent)
-  
-                            msg = _as_msg(step)
- 
-                            tool_calls = getattr(msg, "tool_calls", None)
-                            if tool_calls:
-                                for tc in tool_calls:
-                                    name, args = _tc_name_args(tc)
-                                    with steps_container:
-                                        st.markdown(f"Step {step_count} • Calling tool: {name}")
-                                        if name == "sql_db_query":
-                                            sql = args if isinstance(args, str) else (args.get("query") if isinstance(args, dict) else args)
-                                            st.code(_truncate(sql), language="sql")
-                                        else:
-                                            st.code(_truncate(args), language="json")
-                                continue
- 
-                            if getattr(msg, "type", "") == "tool":
-                                name = getattr(msg, "name", "")
-                                with steps_container:
-                                    st.markdown(f"Step {step_count} ✓ Tool finished: {name}")
-                                    st.code(_truncate(getattr(msg, "content", "")), language="text")
-                                continue
- 
-                            if getattr(msg, "type", "") == "ai":
-                                content = getattr(msg, "content", "")
-                                if content:
-                                    response_text = content
-                                    answer_placeholder.markdown(response_text)
-                        
-                        input_tokens = token_callback.input_tokens
-                        output_tokens = token_callback.output_tokens
-                        total_tokens = token_callback.total_tokens
-                        
-                elapsed_s = time.perf_counter() - start_time
-                
-                # Display response
-                if response_text:
-                    st.markdown(response_text)
-                else:
-                    st.warning("⚠️ No response generated. The query may have exceeded the step limit.")
-                    response_text = "Query processing stopped - may need simplification or database contains complex data."
-                
-                # Display token info
-                token_info = {
-                    "input": input_tokens,
-                    "output": output_tokens,
-                    "total": total_tokens,
-                    "time_s": round(elapsed_s, 2),
-                }
-                
-                with st.expander("📊 Token Usage"):
-                    cols = st.columns(3)
-                    cols[0].metric("Input Tokens", input_tokens)
-                    cols[1].metric("Output Tokens", output_tokens)
-                    cols[2].metric("Total Tokens", total_tokens)
-
-                # Timing expander
-                with st.expander("⏱️ Timing"):
-                    st.metric("Response Time (s)", f"{elapsed_s:.2f}")
-                
-                # Show relevant tables
-                with st.expander("🔍 Relevant Tables (via Embeddings)"):
-                    st.write(", ".join(relevant_tables))
-                
-                # Add to messages
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": response_text,
-                    "token_info": token_info
-                })
-                
-                # Update session state token stats
-                st.session_state.token_stats = token_info
-                
-            except Exception as e:
-                error_msg = f"❌ Error: {str(e)}"
-                st.error(error_msg)
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_msg
-                })
+        watch_run(st.session_state.active_run)
 
 # Footer
 st.divider()
@@ -0,0 +1,216 @@
+"""
+Batch question runner: answers a JSONL file of questions without the UI.
+
+    python batch.py questions.jsonl -o answers.jsonl [--workers 8]
+        [--provider "OpenAI GPT-4"] [--rpm "OpenAI GPT-4=300,DeepSeek=60"] [--retries 2]
+
+Each input line is {"question": ...} with optional "id", "provider" and
+"history" (earlier user questions of the same conversation). Each output line
+is the engine's outcome (answer, status, executed SQL, result rows, token
+usage, per-stage timings, model attempts) plus id, provider, tries and
+elapsed seconds; lines are written as questions finish.
+
+Questions run on a bounded thread pool. LLM requests go through the
+process-wide scheduler (llm_scheduler), configured with --workers calls in
+flight and the --rpm token bucket per provider, so throughput grows with
+--workers until the provider limit is reached; errored questions are retried
+with exponential backoff.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import warmup
+from engine import AgentEngine, INVOKE_MODE, ROWS_TO_MODEL, STREAM_MODE
+from llm_scheduler import PROVIDER_LIMITS, get_scheduler
+from model_router import FAST_MODELS
+
+# Default requests per minute per provider; override with --rpm
+PROVIDER_RPM = {provider: limits["rpm"] for provider, limits in PROVIDER_LIMITS.items()}
+# Batch questions wait for the rate limit instead of failing like an interactive session would
+QUEUE_WAIT_SECONDS = 3600
+DEFAULT_PROVIDER = "OpenAI GPT-4"
+
+
+def parse_rpm(spec):
+    """'OpenAI GPT-4=300,DeepSeek=60' -> {"OpenAI GPT-4": 300.0, "DeepSeek": 60.0}"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, value = part.rpartition("=")
+        limits[name.strip()] = float(value)
+    return limits
+
+
+def read_questions(path):
+    """Input items; an unknown "provider" is recorded as the item's "input_error"."""
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item.setdefault("id", n)
+            provider = item.get("provider")
+            if provider and provider not in warmup.PROVIDER_KEYS:
+                item["input_error"] = f"unknown provider {provider!r}; choose from {sorted(warmup.PROVIDER_KEYS)}"
+            yield item
+
+
+class BatchRunner:
+    """
+    Answer questions concurrently with one AgentEngine per provider.
+    rpm: {provider: requests per minute}; engines share the warm-up's indexes.
+    """
+
+    def __init__(self, shared, rpm=None, workers=8, retries=2, mode=INVOKE_MODE, use_templates=True,
+                 use_routing=True, rows_to_model=ROWS_TO_MODEL, backoff=2.0, session="batch"):
+        self.shared = shared
+        self.rpm = {**PROVIDER_RPM, **(rpm or {})}
+        self.workers = workers
+        self.retries = retries
+        self.mode = mode
+        self.use_templates = use_templates
+        self.use_routing = use_routing
+        self.rows_to_model = rows_to_model
+        self.backoff = backoff
+        self.session = session
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def engine(self, provider):
+        """Engine for provider, created on first use; sets the provider's scheduler limits."""
+        with self._lock:
+            if provider not in self._engines:
+                # One bucket per provider, shared by its fast and strong models
+                get_scheduler().configure(
+                    provider,
+                    max_concurrent=max(1, self.workers),
+                    rpm=self.rpm.get(provider, 60),
+                    max_queue=max(64, self.workers * 4),
+                    max_wait=QUEUE_WAIT_SECONDS,
+                )
+                self._engines[provider] = AgentEngine.from_warmup(self.shared, provider, pooled=True)
+            return self._engines[provider]
+
+    def answer(self, item, provider):
+        """Answer one input item, retrying errors; returns the output record."""
+        started = time.perf_counter()
+        if item.get("input_error"):
+            return self._record(item, provider, 0, started,
+                                {"question": item.get("question"), "status": "error", "error": item["input_error"]})
+        for attempt in range(self.retries + 1):
+            try:
+                engine = self.engine(provider)
+                outcome = engine.ask(
+                    item["question"],
+                    history=item.get("history") or (),
+                    mode=self.mode,
+                    use_templates=self.use_templates,
+                    use_routing=self.use_routing,
+                    rows_to_model=self.rows_to_model,
+                    session=self.session,
+                )
+            except Exception as e:
+                # Failures before the agent starts (engine, retrieval, tool setup)
+                outcome = {"question": item["question"], "status": "error", "error": str(e)}
+            if outcome["status"] != "error" or attempt == self.retries:
+                break
+            delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+            print(f"[{item['id']}] attempt {attempt + 1} failed ({outcome['error']}); retrying in {delay:.1f}s",
+                  file=sys.stderr)
+            time.sleep(delay)
+        outcome.pop("match", None)
+        return self._record(item, provider, attempt + 1, started, outcome)
+
+    @staticmethod
+    def _record(item, provider, tries, started, outcome):
+        return {
+            "id": item["id"],
+            "provider": provider,
+            "tries": tries,
+            "batch_elapsed_s": round(time.perf_counter() - started, 3),
+            **outcome,
+        }
+
+    def run(self, items, out, default_provider=DEFAULT_PROVIDER):
+        """Answer items, writing one JSON line per question to out; returns a summary dict."""
+        write_lock = threading.Lock()
+        # Keep at most two questions queued per worker so huge inputs are not read up front
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        summary = {"questions": 0, "status": {}, "tokens": 0, "latencies": []}
+        started = time.perf_counter()
+
+        def work(item):
+            provider = item.get("provider") or default_provider
+            try:
+                try:
+                    record = self.answer(item, provider)
+                except Exception as e:
+                    # Nothing reads the futures: every question has to end up in the output
+                    record = self._record(item, provider, 0, time.perf_counter(),
+                                          {"question": item.get("question"), "status": "error", "error": str(e)})
+                with write_lock:
+                    out.write(json.dumps(record, default=str) + "\n")
+                    out.flush()
+                    summary["questions"] += 1
+                    summary["status"][record["status"]] = summary["status"].get(record["status"], 0) + 1
+                    summary["tokens"] += (record.get("usage") or {}).get("total", 0)
+                    summary["latencies"].append(record["batch_elapsed_s"])
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch") as pool:
+            for item in items:
+                slots.acquire()
+                pool.submit(work, item)
+
+        elapsed = time.perf_counter() - started
+        latencies = sorted(summary.pop("latencies"))
+        summary["elapsed_s"] = round(elapsed, 2)
+        summary["questions_per_s"] = round(summary["questions"] / elapsed, 3) if elapsed else None
+        summary["p50_s"] = latencies[len(latencies) // 2] if latencies else None
+        summary["p95_s"] = latencies[int(len(latencies) * 0.95)] if latencies else None
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the SQL agent.")
+    parser.add_argument("input", help="JSONL with one {\"question\": ...} per line")
+    parser.add_argument("-o", "--output", default="-", help="output JSONL (default: stdout)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--provider", default=DEFAULT_PROVIDER, choices=sorted(PROVIDER_RPM))
+    parser.add_argument("--rpm", default="", help="requests per minute per provider, e.g. 'DeepSeek=60'")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--stream", action="store_true", help="run agents in stream mode")
+    parser.add_argument("--no-templates", action="store_true", help="always use the agent")
+    parser.add_argument("--no-routing", action="store_true", help="always use the strong model")
+    parser.add_argument("--rows-to-model", type=int, default=ROWS_TO_MODEL)
+    args = parser.parse_args()
+
+    warm = warmup.start(fast_models=FAST_MODELS)
+    shared = warm.attach()
+    runner = BatchRunner(
+        shared,
+        rpm=parse_rpm(args.rpm),
+        workers=args.workers,
+        retries=args.retries,
+        mode=STREAM_MODE if args.stream else INVOKE_MODE,
+        use_templates=not args.no_templates,
+        use_routing=not args.no_routing,
+        rows_to_model=args.rows_to_model,
+    )
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        summary = runner.run(read_questions(args.input), out, default_provider=args.provider)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,520 @@
+"""
+Offline end-to-end benchmark of the question pipeline.
+
+Runs the real AgentEngine (templates, retrieval, prompt and agent
+construction, tools, SQL, usage and tracing, stream rendering) against a
+small generated fixture database, with ScriptedChatModel standing in for the
+LLM: it replays predefined tool calls and answers per question, so no
+provider is called and every run makes the same calls. What is left is the
+cost of our own hot path, which makes regressions visible:
+
+    python bench_agent.py [--repeat 20] [--stream] [--llm-latency-ms 0]
+        [--save baseline.json] [--baseline baseline.json --tolerance 0.25]
+
+Reported per scenario, over --repeat runs after --warmup discarded runs:
+- total p50 / p95 / max ms of the whole question
+- llm_calls, tool_calls, sql: calls made (identical on every run)
+- retrieval_ms, prepare_ms (prompt, tools, agents), llm_ms, tool_ms, sql_ms,
+  render_ms (StreamRenderer over the job's events): p50 per stage
+- alloc_kb: peak Python allocation during the question (--tracemalloc)
+
+--check-templates runs TEMPLATE_CHECKS instead: questions the SQL templates
+must answer with a given intent, or decline (None) and leave to the agent;
+mismatches exit with 1.
+
+--baseline compares against a --save'd run: p50 totals slower by more than
+--tolerance, or changed call counts, path or status, fail with exit code 1.
+Everything (fixture, query log, traces, schema cache) lives in a temporary
+directory unless --workdir is given.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+import zlib
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FIXTURE_ROWS = 500
+DEFAULT_PROVIDER = "OpenAI GPT-4"
+
+# Values of the categorical columns the tools and templates care about
+FIXTURE_VALUES = {
+    "STABBR": ["CA", "NY", "TX", "MA", "FL", "OH", "WA", "IL"],
+    "CITY": ["Boston", "Austin", "Los Angeles", "Columbus", "Seattle", "Chicago"],
+    "CONTROL": [1, 2, 3],
+    "REGION": list(range(10)),
+    "LOCALE": [11, 12, 13, 21, 22, 31, 41],
+    "PREDDEG": [0, 1, 2, 3, 4],
+    "HIGHDEG": [0, 1, 2, 3, 4],
+    "RELAFFIL": ["-1", "22", "30", "66", "71"],
+    "ACCREDAGENCY": ["WASC Senior College and University Commission", "Middle States Commission on Higher Education",
+                     "Southern Association of Colleges and Schools"],
+    "HBCU": [0, 0, 0, 1],
+}
+TEXT_COLUMNS = {"INSTNM", "OPEID", "OPEID6", "ZIP", "ADDR", "ACCREDCODE", "INSTURL", "NPCURL", "LOCALE2",
+                "T4APPROVALDATE", "SCH_DEG", "PRGMOFR"}
+
+ANSWER = (
+    "The query returned {what}. The rows are shown in the table below; the first rows stand out "
+    "clearly from the rest, and the differences between them are modest once cost of attendance "
+    "and aid are taken into account."
+)
+
+# Scripted runs: each step is a tool call {"tool", "args"} or the final {"answer"}
+SCENARIOS = [
+    {
+        "name": "list+query",
+        "question": "Which colleges in California have the lowest in-state tuition?",
+        "steps": [
+            {"tool": "sql_db_list_tables", "args": {"tool_input": ""}},
+            {"tool": "sql_db_query", "args": {"query": (
+                "SELECT m.INSTNM, c.TUITIONFEE_IN FROM school_main m JOIN school_costs c ON m.UNITID = c.UNITID "
+                "WHERE m.STABBR = 'CA' ORDER BY CAST(c.TUITIONFEE_IN AS REAL) LIMIT 5")}},
+            {"answer": ANSWER.format(what="the five cheapest Californian colleges")},
+        ],
+    },
+    {
+        "name": "schema+query",
+        "question": "What is the average SAT score at schools that admit fewer than 20% of applicants?",
+        "steps": [
+            {"tool": "sql_db_schema", "args": {"table_names": "school_admissions"}},
+            {"tool": "sql_db_query", "args": {"query": (
+                "SELECT AVG(CAST(SAT_AVG AS REAL)) AS avg_sat, COUNT(*) AS schools FROM school_admissions "
+                "WHERE CAST(ADM_RATE AS REAL) < 0.2")}},
+            {"answer": ANSWER.format(what="the average SAT score of selective schools")},
+        ],
+    },
+    {
+        "name": "retry",
+        "question": "What is the median debt of graduates in each state?",
+        "steps": [
+            {"tool": "sql_db_query", "args": {"query": (
+                "SELECT m.STABBR, AVG(d.GRAD_DEBT_MEDIAN) FROM school_main m JOIN school_student_debt d "
+                "ON m.UNITID = d.UNITID GROUP BY m.STABBR")}},
+            {"tool": "sql_db_query", "args": {"query": (
+                "SELECT m.STABBR, AVG(CAST(d.GRAD_DEBT_MDN AS REAL)) AS debt FROM school_main m "
+                "JOIN school_student_debt d ON m.UNITID = d.UNITID GROUP BY m.STABBR ORDER BY debt DESC")}},
+            {"answer": ANSWER.format(what="the median graduate debt per state")},
+        ],
+    },
+    {
+        "name": "lookup+query",
+        "question": "How many Catholic colleges are there in each region?",
+        "steps": [
+            {"tool": "lookup_column_values", "args": {"column": "RELAFFIL", "search": "catholic"}},
+            {"tool": "sql_db_query", "args": {"query": (
+                "SELECT m.REGION, COUNT(*) AS colleges FROM school_main m JOIN school_characteristics ch "
+                "ON m.UNITID = ch.UNITID WHERE ch.RELAFFIL = '30' GROUP BY m.REGION ORDER BY colleges DESC")}},
+            {"answer": ANSWER.format(what="the number of Catholic colleges per region")},
+        ],
+    },
+    {
+        "name": "join3",
+        "question": "Do colleges with higher costs lead to higher earnings ten years after entry?",
+        "steps": [
+            {"tool": "sql_db_query", "args": {"query": (
+                "SELECT m.INSTNM, c.COSTT4_A, e.MD_EARN_WNE_P10 FROM school_main m "
+                "JOIN school_costs c ON m.UNITID = c.UNITID JOIN school_earnings_p10 e ON m.UNITID = e.UNITID "
+                "ORDER BY CAST(e.MD_EARN_WNE_P10 AS REAL) DESC LIMIT 10")}},
+            {"answer": ANSWER.format(what="cost and ten-year earnings of the top earning colleges")},
+        ],
+    },
+    {
+        "name": "template",
+        "question": "How many colleges are in Texas?",
+        "steps": [
+            {"tool": "sql_db_query", "args": {"query": "SELECT COUNT(*) FROM school_main WHERE STABBR = 'TX'"}},
+            {"answer": ANSWER.format(what="the number of colleges in Texas")},
+        ],
+    },
+]
+
+# (question, intent the template matcher must return, None: must go to the agent)
+TEMPLATE_CHECKS = [
+    ("Top 5 schools with the highest in-state tuition in California", "top_n"),
+    ("Which colleges have the highest tuition?", "top_n"),
+    ("Highest faculty salary", "top_n"),
+    ("How many colleges are in Texas?", "count"),
+    ("How many public colleges are there by state?", "count"),
+    # Conditions the top-N template cannot express
+    ("Which colleges have the highest tuition and acceptance rate below 10%?", None),
+    ("Highest tuition among women-only schools", None),
+    ("Which state has the most colleges?", None),
+    # Negations
+    ("Highest tuition excluding California", None),
+    ("Highest tuition schools that are not public", None),
+    ("How many colleges are not in Texas?", None),
+]
+
+
+def _rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)], 2)
+
+
+def build_fixture(path, rows=FIXTURE_ROWS, seed=7):
+    """Create a schools.db with the real schema and rows rows of deterministic data per table."""
+    import db_setup
+    from schema_index import HELPER_TABLES
+    from value_dictionary import write_values_table
+
+    if os.path.exists(path):
+        os.remove(path)
+    db_setup.create_database_and_tables(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    names = [r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+    tables = [t for t in names if t.lower() not in HELPER_TABLES]
+    for table in tables:
+        columns = [(c[1], c[2].upper()) for c in cur.execute(f"PRAGMA table_info({table})")]
+        records = []
+        for i in range(1, rows + 1):
+            record = []
+            for name, type_ in columns:
+                if name == "UNITID":
+                    record.append(100000 + i)
+                elif name in FIXTURE_VALUES:
+                    record.append(rng.choice(FIXTURE_VALUES[name]))
+                elif name == "INSTNM":
+                    record.append(f"{rng.choice(['North', 'South', 'East', 'West'])} College {i}")
+                elif name in TEXT_COLUMNS or name.startswith("CIPTITLE"):
+                    record.append(f"{name.lower()}-{i}")
+                elif "RATE" in name or type_.startswith("DOUBLE"):
+                    record.append(round(rng.random(), 4))
+                elif type_.startswith("BIGINT"):
+                    record.append(rng.randint(0, 60000))
+                else:
+                    record.append(str(rng.randint(500, 80000)))
+            records.append(record)
+        placeholders = ", ".join("?" * len(columns))
+        cur.executemany(f"INSERT INTO {table} VALUES ({placeholders})", records)
+    conn.commit()
+    conn.close()
+    write_values_table(path, tables)
+    return path
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model that replays a script per question instead of calling a provider.
+    scripts: {question: [{"tool", "args"} | {"answer"}, ...]}; the step is the number of
+    AI messages since the last user message, so one instance serves concurrent runs.
+    latency_ms is slept per call to simulate a provider.
+    """
+
+    scripts: dict = {}
+    latency_ms: float = 0.0
+    model_name: str = "scripted"
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _step(self, messages):
+        step = 0
+        question = ""
+        for m in reversed(messages):
+            if m.type == "human":
+                question = m.text
+                break
+            step += m.type == "ai"
+        script = self.scripts.get(question.strip())
+        if script is None:
+            return question, step, {"answer": "I have no script for this question."}
+        if step >= len(script):
+            return question, step, {"answer": "The script ran out of steps."}
+        return question, step, script[step]
+
+    def _usage(self, messages, output):
+        # Deterministic token counts (~4 characters per token)
+        prompt = sum(len(m.text) for m in messages)
+        return {"input_tokens": prompt // 4 + 1, "output_tokens": len(output) // 4 + 1,
+                "total_tokens": prompt // 4 + len(output) // 4 + 2}
+
+    def _message(self, messages):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        question, step, item = self._step(messages)
+        if "answer" in item:
+            return AIMessage(content=item["answer"], usage_metadata=self._usage(messages, item["answer"]))
+        call_id = f"call_{zlib.crc32(question.encode()):08x}_{step}"
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": item["tool"], "args": item["args"], "id": call_id, "type": "tool_call"}],
+            usage_metadata=self._usage(messages, json.dumps(item["args"])),
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._message(messages)
+        if message.tool_calls:
+            tc = message.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": 0}],
+                usage_metadata=message.usage_metadata,
+            ))
+            return
+        words = message.content.split(" ")
+        for n, word in enumerate(words):
+            last = n == len(words) - 1
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=word if last else word + " ",
+                usage_metadata=message.usage_metadata if last else None,
+            ))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class _Null:
+    # Stand-in for Streamlit containers: every element call is a no-op
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+
+def make_engine(db_path, provider=DEFAULT_PROVIDER, scenarios=SCENARIOS, latency_ms=0.0, templates=True):
+    """Warm up the shared resources on db_path and build an AgentEngine with scripted models."""
+    import warmup
+    from engine import AgentEngine
+    from model_router import FAST_MODELS
+
+    shared = warmup.start(db_path=db_path).attach()
+    scripts = {s["question"]: s["steps"] for s in scenarios}
+    models = {
+        "strong": ScriptedChatModel(scripts=scripts, latency_ms=latency_ms, model_name="scripted-strong"),
+        "fast": ScriptedChatModel(scripts=scripts, latency_ms=latency_ms, model_name="scripted-fast")
+        if FAST_MODELS.get(provider) else None,
+    }
+    engine = AgentEngine.from_warmup(shared, provider, db_path=db_path, templates=templates, models=models)
+    return engine, shared
+
+
+def run_question(engine, question, mode, use_templates=True, measure_memory=False):
+    """
+    Answer one question the way the app does (template, retrieve, prepare, run, finish)
+    and return its measurements.
+    """
+    from engine import HISTORY_TURNS, run_routed
+    from jobs import run as run_job
+    from stream_render import StreamRenderer
+    from tracing import Tracer
+
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    tracer = Tracer(question=question, path=None)
+    prepare_ms = render_ms = 0.0
+    outcome = engine.try_template(question, tracer) if use_templates else None
+    if outcome is None:
+        turns = [question][-(HISTORY_TURNS - 1):]
+        route, relevant_columns = engine.retrieve(" ".join(turns + [question]), turns, tracer)
+        t0 = time.perf_counter()
+        run = engine.prepare(question, route, relevant_columns, [{"role": "user", "content": question}], tracer,
+                             mode=mode)
+        prepare_ms = (time.perf_counter() - t0) * 1000
+        with tracer.activate():
+            run["job"] = run_job(lambda job: run_routed(job, run), name="bench")
+        # The app renders the events as they arrive; replay them once here
+        t0 = time.perf_counter()
+        renderer = StreamRenderer(_Null(), _Null(), _Null(), started=started)
+        renderer.feed(run["job"].drain())
+        renderer.flush(force=True)
+        render_ms = (time.perf_counter() - t0) * 1000
+        outcome = engine.finish(run)
+    total_ms = (time.perf_counter() - started) * 1000
+    peak = None
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    timings = outcome["timings"]
+    return {
+        "path": outcome["path"],
+        "status": outcome["status"],
+        "error": outcome["error"],
+        "total_ms": total_ms,
+        "llm_calls": outcome["usage"]["calls"],
+        "tool_calls": sum(1 for s in tracer.spans if s["kind"] == "tool"),
+        "sql": len(outcome["sql"]),
+        "retrieval_ms": timings.get("retrieval", 0.0),
+        "prepare_ms": prepare_ms,
+        "llm_ms": timings.get("llm", 0.0),
+        "tool_ms": timings.get("tool", 0.0),
+        "sql_ms": timings.get("sql", 0.0),
+        "render_ms": render_ms,
+        "alloc_kb": peak / 1024 if peak is not None else None,
+    }
+
+
+def summarize(name, runs):
+    """Aggregate the runs of one scenario into a result row."""
+    last = runs[-1]
+    totals = [r["total_ms"] for r in runs]
+    row = {
+        "scenario": name,
+        "path": last["path"],
+        "status": last["status"],
+        "runs": len(runs),
+        "p50_ms": _percentile(totals, 0.5),
+        "p95_ms": _percentile(totals, 0.95),
+        "max_ms": round(max(totals), 2),
+        "llm_calls": last["llm_calls"],
+        "tool_calls": last["tool_calls"],
+        "sql": last["sql"],
+    }
+    for stage in ("retrieval_ms", "prepare_ms", "llm_ms", "tool_ms", "sql_ms", "render_ms"):
+        row[stage] = _percentile([r[stage] for r in runs], 0.5)
+    allocs = [r["alloc_kb"] for r in runs if r["alloc_kb"] is not None]
+    row["alloc_kb"] = round(max(allocs), 1) if allocs else None
+    if last["error"]:
+        row["error"] = last["error"]
+    return row
+
+
+def compare(report, baseline, tolerance=0.25, min_delta_ms=2.0):
+    """Regressions of report against a baseline report, as messages."""
+    problems = []
+    before = {r["scenario"]: r for r in baseline["scenarios"]}
+    for row in report["scenarios"]:
+        old = before.get(row["scenario"])
+        if old is None:
+            continue
+        for key in ("path", "status", "llm_calls", "tool_calls", "sql"):
+            if row[key] != old[key]:
+                problems.append(f"{row['scenario']}: {key} changed {old[key]} -> {row[key]}")
+        slower = row["p50_ms"] - old["p50_ms"]
+        if slower > min_delta_ms and row["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            problems.append(f"{row['scenario']}: p50 {old['p50_ms']} ms -> {row['p50_ms']} ms")
+    return problems
+
+
+def print_report(report):
+    cols = ["scenario", "path", "status", "p50_ms", "p95_ms", "max_ms", "llm_calls", "tool_calls", "sql",
+            "retrieval_ms", "prepare_ms", "llm_ms", "tool_ms", "sql_ms", "render_ms", "alloc_kb"]
+    print("  ".join(f"{c:>12}" for c in cols))
+    for row in report["scenarios"]:
+        print("  ".join(f"{str(row.get(c)):>12}" for c in cols))
+        if row.get("error"):
+            print(f"{'':>12}  error: {row['error']}")
+    print(f"\nsetup {report['setup_s']} s (fixture {report['fixture_s']} s), "
+          f"embeddings {report['embedding_backend']}, mode {report['mode']}, "
+          f"rss {report['rss_before_mb']} -> {report['rss_mb']} MB")
+
+
+def check_templates(engine, checks=TEMPLATE_CHECKS):
+    """Match each check question; returns the number of wrong intents."""
+    failures = 0
+    for question, expected in checks:
+        match = engine.template_matcher.match(question)
+        intent = match["intent"] if match else None
+        failures += intent != expected
+        detail = f" ({match['summary']})" if match else ""
+        print(f"{'ok  ' if intent == expected else 'FAIL'} {question!r}: {intent}, expected {expected}{detail}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the agent pipeline.")
+    parser.add_argument("--repeat", type=int, default=20, help="measured runs per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="discarded runs per scenario")
+    parser.add_argument("--rows", type=int, default=FIXTURE_ROWS, help="fixture rows per table")
+    parser.add_argument("--stream", action="store_true", help="run agents in stream mode")
+    parser.add_argument("--no-templates", action="store_true", help="always use the agent")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per LLM call")
+    parser.add_argument("--backend", default="hashing", help="EMBEDDING_BACKEND for the run")
+    parser.add_argument("--tracemalloc", action="store_true", help="record peak allocations (slower)")
+    parser.add_argument("--workdir", help="directory for the fixture and logs (default: temporary)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--save", help="write the report to this file")
+    parser.add_argument("--baseline", help="report to compare against; regressions exit with 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown (fraction)")
+    parser.add_argument("--check-templates", action="store_true", help="run TEMPLATE_CHECKS and exit")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_agent-")
+    os.makedirs(workdir, exist_ok=True)
+    # Read at import time: keep the app's logs, traces and caches out of the benchmark
+    os.environ["EMBEDDING_BACKEND"] = args.backend
+    os.environ["QUERY_LOG_PATH"] = os.path.join(workdir, "query_log.db")
+    os.environ["TRACE_PATH"] = os.path.join(workdir, "traces.jsonl")
+    os.environ["SCHEMA_CACHE_DIR"] = os.path.join(workdir, ".schema_cache")
+    os.environ.pop("EMBEDDING_CACHE_PATH", None)
+    # Hashing vectors can score below zero; FAISS warns on every search
+    warnings.filterwarnings("ignore", message="Relevance scores must be between 0 and 1")
+
+    from engine import INVOKE_MODE, STREAM_MODE
+
+    rss_before = _rss_mb()
+    t0 = time.perf_counter()
+    db_path = build_fixture(os.path.join(workdir, "schools.db"), rows=args.rows)
+    fixture_s = time.perf_counter() - t0
+    engine, shared = make_engine(db_path, latency_ms=args.llm_latency_ms, templates=not args.no_templates)
+    setup_s = time.perf_counter() - t0
+    if args.check_templates:
+        sys.exit(1 if check_templates(engine) else 0)
+
+    mode = STREAM_MODE if args.stream else INVOKE_MODE
+    runs = {s["name"]: [] for s in SCENARIOS}
+    for n in range(args.warmup + args.repeat):
+        for scenario in SCENARIOS:
+            measured = run_question(engine, scenario["question"], mode, use_templates=not args.no_templates,
+                                    measure_memory=args.tracemalloc)
+            if n >= args.warmup:
+                runs[scenario["name"]].append(measured)
+
+    report = {
+        "mode": mode,
+        "templates": not args.no_templates,
+        "repeat": args.repeat,
+        "rows": args.rows,
+        "llm_latency_ms": args.llm_latency_ms,
+        "embedding_backend": shared["embedding_backend"],
+        "fixture_s": round(fixture_s, 2),
+        "setup_s": round(setup_s, 2),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_mb": round(_rss_mb(), 1),
+        "scenarios": [summarize(name, r) for name, r in runs.items()],
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(report, json.load(f), tolerance=args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Compare embedding backends on startup time, memory and table retrieval.
+
+Each backend runs in its own subprocess so import time and RSS are not shared:
+
+    python bench_embeddings.py [--db schools.db] [--backends huggingface,fastembed,hashing]
+
+Reported per backend:
+- import_s:  importing and constructing the backend
+- first_s:   first embedding (model load / session warm-up)
+- index_s:   building the column index over schema_information
+- query_ms:  p50 latency of one query embedding + column search
+- rss_mb:    peak resident memory of the process (rss_before_mb: before the backend)
+- recall@1 / recall@3 / mrr: table ranking from the column index alone
+  (rank_tables_by_columns, no BM25) on EVAL_QUESTIONS
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+# (question, table expected among the top ranked tables)
+EVAL_QUESTIONS = [
+    ("Which colleges are hardest to get into?", "school_admissions"),
+    ("Average SAT math score of admitted students", "school_admissions"),
+    ("How much does it cost to attend per year?", "school_costs"),
+    ("Out-of-state tuition at public universities in Ohio", "school_costs"),
+    ("Which schools pay their professors the most?", "school_faculty"),
+    ("Student to teacher ratio", "school_faculty"),
+    ("What share of freshmen come back for their second year?", "school_retention_rates"),
+    ("Graduation rate within six years", "school_completion_rates"),
+    ("How much do graduates borrow in loans?", "school_student_debt"),
+    ("Median debt of students who dropped out", "school_student_debt"),
+    ("Are former students paying back their loans after three years?", "school_repayment_rates"),
+    ("How much do alumni earn ten years after enrolling?", "school_earnings_p10"),
+    ("Median salary six years after entry", "school_earnings_p6"),
+    ("Net price for families earning under 30k", "school_financial_aid"),
+    ("Percentage of students receiving Pell grants", "school_financial_aid"),
+    ("Racial makeup of the undergraduate student body", "school_student_demographics"),
+    ("How many undergraduates are enrolled?", "school_student_demographics"),
+    ("Which schools award the most engineering degrees?", "school_academics_cip"),
+    ("Share of degrees in computer science", "school_academics_cip"),
+    ("Historically black colleges", "school_characteristics"),
+    ("Highest degree offered and Carnegie classification", "school_characteristics"),
+    ("Schools located in Boston", "school_main"),
+    ("Website and address of the university", "school_main"),
+    ("Which accreditor accredits the school?", "school_main"),
+]
+
+DEFAULT_BACKENDS = ["huggingface", "fastembed", "hashing"]
+
+
+def _rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, db_path):
+    """Measure one backend in the current process; returns a result dict."""
+    # Shared imports (langchain, FAISS, sqlalchemy) are not charged to the backend
+    from sqlalchemy import create_engine
+    from embedding_backends import make_embeddings
+    from schema_index import HELPER_TABLES, build_column_index, load_schema_info, rank_tables_by_columns
+
+    out = {"backend": backend, "rss_before_mb": round(_rss_mb(), 1)}
+    t0 = time.perf_counter()
+    embeddings, used = make_embeddings(backend)
+    out["used"] = used
+    out["import_s"] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    embeddings.embed_query("warm-up")
+    out["first_s"] = round(time.perf_counter() - t0, 3)
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    schema_info = load_schema_info(engine)
+    tables = [t for t in schema_info if t.lower() not in HELPER_TABLES]
+    t0 = time.perf_counter()
+    index = build_column_index(tables, schema_info, embeddings)
+    out["index_s"] = round(time.perf_counter() - t0, 3)
+
+    hits1 = hits3 = 0
+    rr = 0.0
+    latencies = []
+    for question, expected in EVAL_QUESTIONS:
+        t0 = time.perf_counter()
+        ranked = [r["table"] for r in rank_tables_by_columns(index, question, k_tables=len(tables))]
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if expected in ranked:
+            pos = ranked.index(expected)
+            hits1 += pos == 0
+            hits3 += pos < 3
+            rr += 1.0 / (pos + 1)
+    n = len(EVAL_QUESTIONS)
+    latencies.sort()
+    out["query_ms"] = round(latencies[len(latencies) // 2], 2)
+    out["recall@1"] = round(hits1 / n, 3)
+    out["recall@3"] = round(hits3 / n, 3)
+    out["mrr"] = round(rr / n, 3)
+    out["rss_mb"] = round(_rss_mb(), 1)
+    return out
+
+
+def print_table(results):
+    cols = ["backend", "used", "import_s", "first_s", "index_s", "query_ms", "rss_before_mb", "rss_mb",
+            "recall@1", "recall@3", "mrr"]
+    print("  ".join(f"{c:>13}" for c in cols))
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:>13}  error: {r['error']}")
+            continue
+        print("  ".join(f"{str(r.get(c)):>13}" for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends for schema retrieval.")
+    parser.add_argument("--db", default="schools.db")
+    parser.add_argument("--backends", default=",".join(DEFAULT_BACKENDS))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.db)))
+        return
+
+    results = []
+    for backend in args.backends.split(","):
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", backend, "--db", args.db],
+            capture_output=True, text=True,
+        )
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            results.append({"backend": backend, "error": (proc.stderr.strip().splitlines() or ["failed"])[-1]})
+            continue
+        results.append(json.loads(lines[-1]))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
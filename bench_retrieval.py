@@ -0,0 +1,233 @@
+"""
+Retrieval quality and latency of the table routing variants.
+
+The tables retrieval puts first decide what the agent looks at; a miss costs
+extra sql_db_list_tables / sql_db_schema round-trips. This harness scores
+each variant on RETRIEVAL_QUESTIONS, a labelled set of questions with the
+school_* tables needed to answer them:
+
+    python bench_retrieval.py [--db schools.db] [--backend hashing] [--k 1,3,5]
+        [--variants table_docs,hybrid] [--dataset questions.jsonl] [--misses]
+
+Variants (all over the same embeddings and indexes the app builds):
+- table_docs:   similarity_search over one document per table (DDL, sample rows,
+                column descriptions), the original retrieval
+- column_docs:  column-level FAISS index, tables ranked by their best columns
+- lexical:      BM25 over the column catalog alone (no embedding)
+- vector_fused: table_docs and column_docs fused by reciprocal rank
+- hybrid:       TableRouter.route(), as used by the app: lexical fast path when
+                decisive, otherwise lexical + both vector rankings fused
+- hybrid_fused: TableRouter with the fast path disabled (always fuses)
+
+Reported per variant:
+- recall@k: share of a question's expected tables among the top k, averaged
+- all@3:    questions whose expected tables are all in the top 3
+- mrr:      mean reciprocal rank of the first expected table
+- p50_ms / p95_ms: latency of one query (embedding included, no query cache)
+- fast_path: share of questions the hybrid router answered lexically
+
+--dataset reads {"question": ..., "tables": [...]} lines instead of the built-in set.
+"""
+import argparse
+import json
+import time
+import warnings
+
+# (question, tables needed to answer it)
+RETRIEVAL_QUESTIONS = [
+    ("Which colleges are hardest to get into?", ["school_admissions"]),
+    ("Average SAT math score of admitted students", ["school_admissions"]),
+    ("Schools with an ACT composite above 30", ["school_admissions"]),
+    ("What is the acceptance rate at MIT?", ["school_main", "school_admissions"]),
+    ("Do test-optional schools admit more applicants?", ["school_admissions"]),
+    ("How much does it cost to attend per year?", ["school_costs"]),
+    ("Out-of-state tuition at public universities in Ohio", ["school_costs", "school_main"]),
+    ("Cheapest room and board on campus", ["school_costs"]),
+    ("Which schools spend the most on instruction per student?", ["school_costs"]),
+    ("Which schools pay their professors the most?", ["school_faculty"]),
+    ("Student to teacher ratio", ["school_faculty"]),
+    ("Share of full-time faculty at community colleges", ["school_faculty", "school_characteristics"]),
+    ("What share of freshmen come back for their second year?", ["school_retention_rates"]),
+    ("Retention of part-time students at four-year schools", ["school_retention_rates"]),
+    ("Graduation rate within six years", ["school_completion_rates"]),
+    ("Which schools graduate most students on time in four years?", ["school_completion_rates"]),
+    ("Outcomes of part-time transfer students after eight years", ["school_completion_rates"]),
+    ("How much do graduates borrow in loans?", ["school_student_debt"]),
+    ("Median debt of students who dropped out", ["school_student_debt"]),
+    ("Debt of first-generation students compared to others", ["school_student_debt"]),
+    ("Are former students paying back their loans after three years?", ["school_repayment_rates"]),
+    ("Three-year cohort default rate", ["school_repayment_rates"]),
+    ("Repayment rate of students who did not complete", ["school_repayment_rates"]),
+    ("How much do alumni earn ten years after enrolling?", ["school_earnings_p10"]),
+    ("Median salary six years after entry", ["school_earnings_p6"]),
+    ("Share of students earning more than 25k eight years after entry", ["school_earnings_p8"]),
+    ("Net price for families earning under 30k", ["school_financial_aid"]),
+    ("Percentage of students receiving Pell grants", ["school_financial_aid"]),
+    ("Share of undergraduates with federal loans", ["school_financial_aid"]),
+    ("Racial makeup of the undergraduate student body", ["school_student_demographics"]),
+    ("How many undergraduates are enrolled?", ["school_student_demographics"]),
+    ("Share of students older than 25", ["school_student_demographics"]),
+    ("Number of graduate students", ["school_student_demographics"]),
+    ("Which schools award the most engineering degrees?", ["school_academics_cip"]),
+    ("Share of degrees in computer science", ["school_academics_cip"]),
+    ("Schools offering nursing programs", ["school_academics_cip"]),
+    ("Historically black colleges", ["school_characteristics"]),
+    ("Highest degree offered and Carnegie classification", ["school_characteristics"]),
+    ("Women-only colleges with a religious affiliation", ["school_characteristics"]),
+    ("Hispanic-serving institutions that offer bachelor's degrees", ["school_characteristics"]),
+    ("Schools located in Boston", ["school_main"]),
+    ("Website and address of the university", ["school_main"]),
+    ("Which accreditor accredits the school?", ["school_main"]),
+    ("How many private nonprofit colleges are in each state?", ["school_main"]),
+    ("Colleges in rural areas of the Southeast", ["school_main"]),
+    ("Tuition of colleges in California with admission rates under 10%",
+     ["school_costs", "school_main", "school_admissions"]),
+    ("Do schools with higher faculty salaries have better graduation rates?",
+     ["school_faculty", "school_completion_rates"]),
+    ("Earnings ten years after entry versus median debt",
+     ["school_earnings_p10", "school_student_debt"]),
+    ("Net price and Pell share at HBCUs", ["school_financial_aid", "school_characteristics"]),
+    ("Retention and graduation rates of public universities in Texas",
+     ["school_retention_rates", "school_completion_rates", "school_main"]),
+]
+
+DEFAULT_KS = [1, 3, 5]
+VARIANTS = ["table_docs", "column_docs", "lexical", "vector_fused", "hybrid", "hybrid_fused"]
+
+
+def read_dataset(path):
+    with open(path, encoding="utf-8") as f:
+        return [(item["question"], list(item["tables"])) for item in map(json.loads, filter(str.strip, f))]
+
+
+def build_indexes(db_path, backend):
+    """Embeddings, indexes and routers built the same way as the app's warm-up."""
+    from langchain_community.utilities import SQLDatabase
+    from langchain_community.vectorstores import FAISS
+    from sqlalchemy import create_engine
+
+    from embedding_backends import make_embeddings
+    from schema_index import HELPER_TABLES, build_column_index, create_schema_documents, load_schema_info
+    from table_router import TableRouter
+    from value_dictionary import create_value_documents, load_value_dictionary
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    db = SQLDatabase(engine)
+    tables = [t for t in db.get_usable_table_names() if t.lower() not in HELPER_TABLES]
+    schema_info = load_schema_info(engine)
+    value_docs = create_value_documents(load_value_dictionary(engine, tables), schema_info)
+    # Uncached: every query pays for its embedding, as a new question does
+    embeddings, used = make_embeddings(backend)
+    vectorstore = FAISS.from_documents(create_schema_documents(db, tables, schema_info), embeddings)
+    column_index = build_column_index(tables, schema_info, embeddings, extra_docs=value_docs)
+    router_args = dict(vectorstore=vectorstore, column_index=column_index, embeddings=embeddings,
+                       extra_docs=value_docs)
+    return {
+        "tables": tables,
+        "backend": used,
+        "embeddings": embeddings,
+        "vectorstore": vectorstore,
+        "column_index": column_index,
+        "router": TableRouter(tables, schema_info, **router_args),
+        "router_fused": TableRouter(tables, schema_info, decisive_score=float("inf"), **router_args),
+    }
+
+
+def rank(variant, ctx, question, k):
+    """Ranked table names (at most k) of one variant; the second value flags the lexical fast path."""
+    from schema_index import fuse_rankings, rank_tables_by_columns
+
+    if variant == "table_docs":
+        return [d.metadata["table_name"] for d in ctx["vectorstore"].similarity_search(question, k=k)], False
+    if variant == "column_docs":
+        return [r["table"] for r in rank_tables_by_columns(ctx["column_index"], question, k_tables=k)], False
+    if variant == "lexical":
+        return [r["table"] for r in ctx["router"].lexical_rank(question, k_tables=k)], True
+    if variant == "vector_fused":
+        embedding = ctx["embeddings"].embed_query(question)
+        columns = rank_tables_by_columns(ctx["column_index"], question, k_tables=k, embedding=embedding)
+        docs = ctx["vectorstore"].similarity_search_by_vector(embedding, k=k)
+        return fuse_rankings([r["table"] for r in columns], [d.metadata["table_name"] for d in docs], limit=k), False
+    if variant in ("hybrid", "hybrid_fused"):
+        route = ctx["router" if variant == "hybrid" else "router_fused"].route(question, k=k)
+        return route["tables"], route["fast_path"]
+    raise ValueError(f"Unknown variant {variant!r}; choose from {VARIANTS}")
+
+
+def evaluate(variant, ctx, questions, ks=DEFAULT_KS):
+    """Score one variant; returns (result row, [(question, expected, ranked) misses at k=3])."""
+    max_k = max(ks)
+    recall = {k: 0.0 for k in ks}
+    complete = rr = fast = 0
+    latencies = []
+    misses = []
+    for question, expected in questions:
+        t0 = time.perf_counter()
+        ranked, fast_path = rank(variant, ctx, question, max_k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        fast += fast_path
+        for k in ks:
+            recall[k] += len(set(expected) & set(ranked[:k])) / len(expected)
+        complete += set(expected) <= set(ranked[:3])
+        positions = [ranked.index(t) for t in expected if t in ranked]
+        rr += 1.0 / (min(positions) + 1) if positions else 0.0
+        if not set(expected) <= set(ranked[:3]):
+            misses.append((question, expected, ranked[:3]))
+    n = len(questions)
+    latencies.sort()
+    row = {"variant": variant}
+    row.update({f"recall@{k}": round(recall[k] / n, 3) for k in ks})
+    row["all@3"] = round(complete / n, 3)
+    row["mrr"] = round(rr / n, 3)
+    row["p50_ms"] = round(latencies[n // 2], 2)
+    row["p95_ms"] = round(latencies[min(int(n * 0.95), n - 1)], 2)
+    row["fast_path"] = round(fast / n, 3)
+    return row, misses
+
+
+def print_table(results, ks):
+    cols = ["variant"] + [f"recall@{k}" for k in ks] + ["all@3", "mrr", "p50_ms", "p95_ms", "fast_path"]
+    print("  ".join(f"{c:>12}" for c in cols))
+    for r in results:
+        print("  ".join(f"{str(r.get(c)):>12}" for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark table retrieval quality and latency.")
+    parser.add_argument("--db", default="schools.db")
+    parser.add_argument("--backend", default=None, help="embedding backend (default: EMBEDDING_BACKEND)")
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--k", default=",".join(map(str, DEFAULT_KS)), help="cut-offs for recall@k")
+    parser.add_argument("--dataset", help="JSONL of {\"question\", \"tables\"} (default: built-in set)")
+    parser.add_argument("--misses", action="store_true", help="list questions missed in the top 3")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # Non-normalised embedders score below zero; FAISS warns on every search
+    warnings.filterwarnings("ignore", message="Relevance scores must be between 0 and 1")
+    questions = read_dataset(args.dataset) if args.dataset else RETRIEVAL_QUESTIONS
+    ks = sorted(int(k) for k in args.k.split(","))
+    t0 = time.perf_counter()
+    ctx = build_indexes(args.db, args.backend)
+    build_s = time.perf_counter() - t0
+    # First query loads lazily initialised model state
+    ctx["embeddings"].embed_query("warm-up")
+
+    results = []
+    for variant in args.variants.split(","):
+        row, misses = evaluate(variant, ctx, questions, ks)
+        results.append(row)
+        if args.misses and not args.json:
+            for question, expected, ranked in misses:
+                print(f"[{variant}] {question}\n    expected {expected}, got {ranked}")
+    if args.json:
+        print(json.dumps({"backend": ctx["backend"], "questions": len(questions), "build_s": round(build_s, 2),
+                          "results": results}, indent=2))
+        return
+    print(f"{len(questions)} questions, {len(ctx['tables'])} tables, embeddings {ctx['backend']}, "
+          f"indexes built in {build_s:.2f} s\n")
+    print_table(results, ks)
+
+
+if __name__ == "__main__":
+    main()
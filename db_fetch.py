@@ -0,0 +1,276 @@
+"""
+Verified, resumable download of the schools database.
+
+ensure_db() is safe to call on every Streamlit rerun: the first call in the
+process does the work behind a lock, later calls return its result.
+
+- the body is streamed in chunks to <path>.part, never held in memory
+- an interrupted download resumes with a Range request (If-Range on the ETag,
+  so a changed file restarts from scratch)
+- the result must start with the SQLite header, open as a database, match the
+  expected size and, when known, the expected SHA-256 (DB_SHA256 or a JSON
+  manifest {"sha256", "size", "url"} at DB_MANIFEST_URL)
+- only a verified file replaces <path>, with os.replace
+- ETag / Last-Modified / SHA-256 are kept in <path>.meta.json; an existing DB is
+  refreshed with a conditional GET, or skipped when the manifest hash matches
+- an existing DB that is not a valid SQLite file is downloaded again
+
+Fetch ahead of time with:
+
+    python db_fetch.py [--url URL] [--path schools.db] [--sha256 HEX] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+DB_URL = os.environ.get(
+    "DB_URL", "https://drive.google.com/uc?export=download&id=1x0f_hL-69JDG4-gS3d8owyjOjdxpB9Ql"
+)
+DB_PATH = os.environ.get("DB_PATH", "schools.db")
+
+CHUNK_SIZE = 1 << 20
+TIMEOUT = (10, 60)  # connect, read
+RETRIES = 3
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+class DownloadError(Exception):
+    """The database could not be fetched or failed verification."""
+
+
+# path -> result of the first ensure_db() call in this process
+_results = {}
+_lock = threading.Lock()
+
+
+def _meta_path(path):
+    return path + ".meta.json"
+
+
+def load_meta(path):
+    try:
+        with open(_meta_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_meta(path, meta):
+    tmp = _meta_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, _meta_path(path))
+
+
+def _discard(part):
+    for p in (part, _meta_path(part)):
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def check_sqlite(path):
+    """Raise DownloadError unless path is a readable SQLite database."""
+    with open(path, "rb") as f:
+        header = f.read(len(SQLITE_HEADER))
+    if header != SQLITE_HEADER:
+        # Typically an HTML error or confirmation page served with status 200
+        raise DownloadError(f"{path} is not a SQLite database (starts with {header[:16]!r})")
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise DownloadError(f"{path} is not a readable SQLite database: {e}")
+
+
+def fetch_manifest(url, session=requests):
+    resp = session.get(url, timeout=TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _download(url, path, meta, session, expected_size=None):
+    """
+    Stream url into path + ".part", resuming a previous partial download.
+    Returns (status, headers): status is 304 when the server says meta is current.
+    """
+    part = path + ".part"
+    part_meta = load_meta(part)
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {}
+    if offset and part_meta.get("url") == url:
+        headers["Range"] = f"bytes={offset}-"
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+    else:
+        offset = 0
+    if os.path.exists(path):
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+        if resp.status_code == 304:
+            return 304, resp.headers
+        if resp.status_code == 416:
+            # The partial file is already complete (or bigger than the remote one)
+            os.remove(part)
+            raise DownloadError("stale partial download discarded")
+        resp.raise_for_status()
+        # Anything but 206 is the full body: the server ignored the range or the file changed
+        mode = "ab" if resp.status_code == 206 and offset else "wb"
+        if mode == "wb":
+            offset = 0
+        _save_meta(part, {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        })
+        length = resp.headers.get("Content-Length")
+        total = offset + int(length) if length is not None else expected_size
+        written = offset
+        with open(part, mode) as f:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if total is not None and written != total:
+            raise DownloadError(f"incomplete download: {written} of {total} bytes")
+        return resp.status_code, resp.headers
+
+
+def ensure_db(url=DB_URL, path=DB_PATH, sha256=None, manifest_url=None, force=False, session=None):
+    """
+    Make sure path holds a verified copy of url; runs once per process per path.
+
+    Returns {"path", "action", "bytes", "seconds", "error"}; action is one of
+    downloaded, not_modified, kept or failed. A failed refresh keeps a valid
+    existing file (action "kept" with error set).
+    """
+    path = os.fspath(path)
+    with _lock:
+        if path in _results and not force:
+            return _results[path]
+        result = _ensure(url, path, sha256, manifest_url, force, session or requests.Session())
+        # A failure is retried on the next call instead of sticking for the process lifetime
+        if result["action"] != "failed":
+            _results[path] = result
+        return result
+
+
+def _ensure(url, path, sha256, manifest_url, force, session):
+    started = time.perf_counter()
+    sha256 = sha256 or os.environ.get("DB_SHA256") or None
+    manifest_url = manifest_url or os.environ.get("DB_MANIFEST_URL") or None
+    meta = load_meta(path)
+    expected_size = None
+    result = {"path": path, "action": None, "bytes": 0, "seconds": 0.0, "error": None}
+
+    existing_ok = False
+    if os.path.exists(path):
+        try:
+            check_sqlite(path)
+            existing_ok = True
+        except DownloadError as e:
+            print(f"Existing database rejected, downloading again: {e}")
+
+    try:
+        if manifest_url:
+            manifest = fetch_manifest(manifest_url, session)
+            sha256 = manifest.get("sha256") or sha256
+            expected_size = manifest.get("size")
+            url = manifest.get("url") or url
+        if existing_ok and not force:
+            if sha256 and meta.get("sha256") == sha256:
+                result["action"] = "not_modified"
+                return result
+            if not (sha256 or meta.get("etag") or meta.get("last_modified")):
+                # Nothing to compare against: a valid file is trusted as before
+                result["action"] = "kept"
+                return result
+
+        last_error = None
+        for attempt in range(RETRIES):
+            try:
+                status, headers = _download(url, path, meta if existing_ok and not force else {}, session,
+                                            expected_size)
+                break
+            except (requests.RequestException, DownloadError) as e:
+                last_error = e
+                print(f"Database download attempt {attempt + 1} failed: {e}")
+                time.sleep(min(2 ** attempt, 10))
+        else:
+            raise DownloadError(f"download failed after {RETRIES} attempts: {last_error}")
+
+        if status == 304:
+            result["action"] = "not_modified"
+            return result
+
+        part = path + ".part"
+        digest = file_sha256(part)
+        try:
+            if sha256 and digest != sha256.lower():
+                raise DownloadError(f"checksum mismatch: expected {sha256}, got {digest}")
+            check_sqlite(part)
+        except DownloadError:
+            # Corrupt content will not get better by resuming it
+            _discard(part)
+            raise
+        result["bytes"] = os.path.getsize(part)
+        os.replace(part, path)
+        _discard(part)
+        _save_meta(path, {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "sha256": digest,
+            "size": result["bytes"],
+            "fetched": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        })
+        result["action"] = "downloaded"
+        print(f"Database downloaded and verified: {path} ({result['bytes']} bytes, sha256 {digest[:12]})")
+    except (requests.RequestException, DownloadError, ValueError, OSError) as e:
+        result["error"] = str(e)
+        result["action"] = "kept" if existing_ok else "failed"
+        print(f"Database refresh failed ({'keeping existing file' if existing_ok else 'no database'}): {e}")
+    finally:
+        result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and verify the schools database.")
+    parser.add_argument("--url", default=DB_URL)
+    parser.add_argument("--path", default=DB_PATH)
+    parser.add_argument("--sha256", default=None)
+    parser.add_argument("--manifest-url", default=None)
+    parser.add_argument("--force", action="store_true", help="download even if the local copy is current")
+    args = parser.parse_args()
+    result = ensure_db(args.url, args.path, sha256=args.sha256, manifest_url=args.manifest_url, force=args.force)
+    print(json.dumps(result, indent=2))
+    raise SystemExit(0 if result["action"] != "failed" else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -564,23 +564,64 @@ def fix_date_columns_in_db():
         conn.commit()
 
 
+def build_partition(csv_file_path, year, directory=None):
+    """
+    Builds partitions/schools_<year>.db from one year's Scorecard CSV, with the same
+    school_* tables and values table as schools.db. Returns the partition path.
+    """
+    import os
+    from partitions import PARTITION_DIR, partition_path
+    from value_dictionary import write_values_table
+
+    directory = directory or PARTITION_DIR
+    os.makedirs(directory, exist_ok=True)
+    db_name = partition_path(year, directory)
+    delete_db(db_name)
+    create_database_and_tables(db_name)
+    load_csv_data(csv_file_path, db_name)
+    write_values_table(db_name, school_table_names(db_name))
+    return db_name
+
+def school_table_names(db_name="schools.db"):
+    with sqlite3.connect(db_name) as conn:
+        return [
+            r[0] for r in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'school_%'"
+            )
+        ]
+
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build schools.db, or one data year's partition.")
+    parser.add_argument("--year", type=int, help="build partitions/schools_<year>.db instead of schools.db")
+    parser.add_argument("--csv", default="schools_main.csv", help="Scorecard CSV to load")
+    parser.add_argument("--partition-dir", default=None, help="directory of the year partitions")
+    args = parser.parse_args()
+
     # --- Configuration ---
     DATABASE_NAME = "schools.db"
     # IMPORTANT: Replace 'your_schools_data.csv' with the actual name of your CSV file.
-    CSV_FILE_PATH = "schools_main.csv"
+    CSV_FILE_PATH = args.csv
+    if args.year:
+        DATABASE_NAME = build_partition(CSV_FILE_PATH, args.year, args.partition_dir)
+        print(f"Built partition {DATABASE_NAME}")
+
+    else:
+        # Clean up any existing database file
+        delete_db(DATABASE_NAME)
 
-    # Clean up any existing database file
-    delete_db(DATABASE_NAME)
+        # 1. Create the database and tables
+        create_database_and_tables(DATABASE_NAME)
 
-    # 1. Create the database and tables
-    create_database_and_tables(DATABASE_NAME)
+        # 2. Load data from the CSV file into the tables
+        load_csv_data(CSV_FILE_PATH, DATABASE_NAME)
 
-    # 2. Load data from the CSV file into the tables
-    load_csv_data(CSV_FILE_PATH, DATABASE_NAME)
+        # # 3. Fix date columns in the database
+        # fix_date_columns_in_db() 
 
-    # # 3. Fix date columns in the database
-    # fix_date_columns_in_db() 
+        # 4. Precompute distinct values of low-cardinality columns for the agent
+        from value_dictionary import write_values_table
+        write_values_table(DATABASE_NAME, school_table_names(DATABASE_NAME))
 
     conn = sqlite3.connect(DATABASE_NAME)
     cursor = conn.cursor()
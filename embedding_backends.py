@@ -0,0 +1,124 @@
+"""
+Pluggable embedding backends for the schema indexes and query retrieval.
+
+The backend is picked with EMBEDDING_BACKEND:
+- huggingface: all-MiniLM-L6-v2 through sentence-transformers (imports torch)
+- fastembed:   the same model as a quantized ONNX build on onnxruntime, no torch
+- hashing:     HashingEmbeddings, a feature-hashing embedder with no model
+               download or native dependency
+- auto (default): fastembed if it is installed, otherwise huggingface
+
+A backend whose package is missing falls back to hashing with a warning.
+New backends are added with register_backend(name, factory). Compare them
+with bench_embeddings.py.
+"""
+import hashlib
+import math
+import os
+import re
+
+from langchain_core.embeddings import Embeddings
+
+from table_router import tokenize
+
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "auto")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-features embedder: stemmed words, word bigrams and
+    character trigrams are hashed into dim signed buckets, weighted 1 + log(tf)
+    and L2-normalised. Vectors only depend on the text, so they are stable
+    across processes and safe to cache.
+    """
+
+    def __init__(self, dim=768, ngram=3, bigram_weight=0.5, ngram_weight=0.5):
+        self.dim = dim
+        self.ngram = ngram
+        self.bigram_weight = bigram_weight
+        self.ngram_weight = ngram_weight
+        self.model_name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = tokenize(text)
+        feats = {}
+
+        def add(feature, weight):
+            feats[feature] = feats.get(feature, 0.0) + weight
+
+        for w in words:
+            add("w:" + w, 1.0)
+        for a, b in zip(words, words[1:]):
+            add(f"b:{a} {b}", self.bigram_weight)
+        # Character n-grams let "admission" / "admitted" or "tuition" / "tuitionfee" overlap
+        for w in _WORD_RE.findall((text or "").lower()):
+            padded = f"#{w}#"
+            for i in range(len(padded) - self.ngram + 1):
+                add("c:" + padded[i:i + self.ngram], self.ngram_weight)
+        return feats
+
+    def _embed(self, text):
+        vec = [0.0] * self.dim
+        for feature, tf in self._features(text).items():
+            h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            weight = 1.0 + math.log(tf) if tf >= 1 else tf
+            vec[(h >> 1) % self.dim] += weight if h & 1 else -weight
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return [x / norm for x in vec]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _huggingface():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def _fastembed():
+    from langchain_community.embeddings import FastEmbedEmbeddings
+    return FastEmbedEmbeddings(model_name=f"sentence-transformers/{EMBEDDING_MODEL}")
+
+
+def _hashing():
+    return HashingEmbeddings()
+
+
+BACKENDS = {
+    "huggingface": _huggingface,
+    "fastembed": _fastembed,
+    "hashing": _hashing,
+}
+
+
+def register_backend(name, factory):
+    """Add a backend: factory() returns a langchain Embeddings instance."""
+    BACKENDS[name] = factory
+
+
+def _fastembed_installed():
+    try:
+        import fastembed  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_embeddings(backend=None):
+    """Instantiate the configured backend; returns (embeddings, backend name used)."""
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "auto":
+        backend = "fastembed" if _fastembed_installed() else "huggingface"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; choose from {sorted(BACKENDS)}")
+    try:
+        return BACKENDS[backend](), backend
+    except ImportError as e:
+        print(f"Embedding backend {backend} is not available ({e}); using hashing embeddings")
+        return _hashing(), "hashing"
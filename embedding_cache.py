@@ -0,0 +1,145 @@
+"""
+Process-wide LRU cache of query embeddings.
+
+Retrieval queries repeat most of their text between turns and Streamlit
+reruns embed identical strings again, so query vectors are cached per
+(model, text). The cache is shared by every session in the process and can
+optionally be persisted to a JSON file across restarts.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+# Set to a file path to persist cached query embeddings across restarts
+CACHE_PATH_ENV = "EMBEDDING_CACHE_PATH"
+DEFAULT_MAXSIZE = 4096
+
+
+class EmbeddingLRUCache:
+    """Thread-safe bounded LRU of text -> vector, optionally backed by a JSON file."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, path=None, save_every=32):
+        self.maxsize = maxsize
+        self.path = path
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        if path:
+            self.load()
+
+    def get(self, key):
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key, vec):
+        with self._lock:
+            self._data[key] = list(vec)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._unsaved += 1
+            should_save = self.path and self._unsaved >= self.save_every
+        if should_save:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for key, vec in entries[-self.maxsize:]:
+                self._data[key] = vec
+
+    def save(self):
+        """Write the cache atomically (temp file + rename)."""
+        if not self.path:
+            return
+        with self._lock:
+            entries = list(self._data.items())
+            self._unsaved = 0
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save embedding cache to {self.path}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+_process_cache = None
+_process_cache_lock = threading.Lock()
+
+
+def get_process_cache():
+    """Return the cache shared by all sessions in this process."""
+    global _process_cache
+    with _process_cache_lock:
+        if _process_cache is None:
+            _process_cache = EmbeddingLRUCache(path=os.environ.get(CACHE_PATH_ENV) or None)
+        return _process_cache
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves embed_query from an EmbeddingLRUCache.
+    Document embedding is passed through unchanged.
+    """
+
+    def __init__(self, embeddings, cache=None):
+        self.embeddings = embeddings
+        self.cache = cache or get_process_cache()
+        self.model_key = (
+            getattr(embeddings, "model_name", None)
+            or getattr(embeddings, "model", None)
+            or type(embeddings).__name__
+        )
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = f"{self.model_key}\x1f{text}"
+        vec = self.cache.get(key)
+        if vec is None:
+            vec = self.embeddings.embed_query(text)
+            self.cache.put(key, vec)
+        return vec
+
+    def embed_turns(self, turns, decay=0.5):
+        """
+        Embed each turn once (cached) and combine them into one query vector.
+        The latest turn has weight 1 and each older turn is multiplied by decay.
+        """
+        turns = [t for t in turns if t]
+        if not turns:
+            return None
+        vectors = [self.embed_query(t) for t in turns]
+        dim = len(vectors[0])
+        combined = [0.0] * dim
+        weight = 1.0
+        for vec in reversed(vectors):
+            for i in range(dim):
+                combined[i] += weight * vec[i]
+            weight *= decay
+        norm = sum(x * x for x in combined) ** 0.5
+        if norm:
+            combined = [x / norm for x in combined]
+        return combined
@@ -0,0 +1,530 @@
+"""
+Headless question-answering pipeline: retrieval -> prompt -> agent -> usage.
+
+AgentEngine holds one database connection, the shared retrieval indexes and
+the models, and answers a question without Streamlit:
+
+    engine = AgentEngine.from_warmup(warmup.start().attach(), "OpenAI GPT-4")
+    outcome = engine.ask("Which colleges in Ohio have the lowest tuition?")
+
+The app uses the same steps one by one (try_template, retrieve, prepare,
+run on the worker pool, finish) so it can render progress in between; the
+batch runner (batch.py) calls ask() from its own worker threads.
+
+finish() returns an outcome dict: answer, status, path (template / agent),
+executed SQL, result rows, token usage, per-stage timings and model attempts.
+"""
+import time
+
+from langchain.agents import create_agent
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from jobs import JobCancelled, run as run_job, watch_engine
+from model_router import FAST_MODELS, classify, run_failed, get_stats as get_routing_stats
+from partitions import attach_partitions, discover_partitions, prompt_note
+from preflight import Preflight
+from query_log import get_query_log
+from schema_cache import cached_sql_database
+from schema_index import format_pruned_columns
+from sql_templates import IntentMatcher, get_stats as get_template_stats
+from sql_tools import QUERY_TOOL_NAME, ResultCapture, make_query_tool
+from supervisor import RunSupervisor, RunStopped
+from tracing import Tracer, TracingCallback, instrument_engine
+from usage import UsageCollector
+from value_dictionary import make_lookup_tool
+from warmup import chat_model
+
+# Per-question limits enforced by the run supervisor, also while tokens stream
+# (recursion_limit stays as a backstop)
+RUN_BUDGET = {"max_llm_calls": 12, "max_tokens": 60000, "max_seconds": 120}
+RECURSION_LIMIT = 50
+# Recent user turns folded into the retrieval query
+HISTORY_TURNS = 4
+# Embed each recent user turn once (cached) and combine the vectors instead of
+# embedding the concatenated retrieval query string
+COMBINE_TURN_EMBEDDINGS = True
+# Rows of the final query echoed to the model by default
+ROWS_TO_MODEL = 20
+
+INVOKE_MODE = "Invoke (Stable)"
+STREAM_MODE = "Stream (Real-time)"
+
+SYSTEM_PROMPT = """
+You are an agent designed to interact with a SQL database.
+Given an input question, create a syntactically correct {dialect} query to run,
+then look at the results of the query and return the answer.
+
+CRITICAL INSTRUCTIONS:
+1. First, use sql_db_list_tables to see available tables
+2. Use the relevant columns listed below; call sql_db_schema only if they are not enough
+3. Write and execute ONE SQL query using sql_db_query
+4. Reply with a short summary of the query results (2-3 sentences)
+5. If the query fails, try ONCE more with a corrected query, then stop
+6. NEVER loop endlessly - if you can't solve it in 2 query attempts, explain the issue
+
+IMPORTANT NOTES:
+- Date columns may be stored as TEXT in DD-MM-YYYY format. Treat them as strings.
+- Unless the user specifies a number, limit results to {top_k} rows
+- Never query for all columns - only ask for relevant ones
+- The rows of your final query are shown to the user as a table automatically.
+  Do not repeat them as a list or markdown table; summarise what they show
+- To resolve categorical values or codes (STABBR, CONTROL, REGION, LOCALE, PREDDEG, RELAFFIL,
+  ACCREDAGENCY, ...) use lookup_column_values instead of SELECT DISTINCT queries
+- DO NOT make DML statements (INSERT, UPDATE, DELETE, DROP)
+- Order results by a relevant column when appropriate
+
+SEMANTIC HINT: The most relevant tables for this query are likely: {relevant_tables}
+Start by examining these tables first. Tables join on UNITID.
+
+Relevant columns (column: description):
+{relevant_columns}
+
+All available tables: {all_tables}
+"""
+
+
+def build_system_prompt(dialect, relevant_tables, relevant_columns, all_tables, history_summary=None, top_k=5,
+                        years_note=""):
+    prompt = SYSTEM_PROMPT.format(
+        dialect=dialect,
+        top_k=top_k,
+        relevant_tables=", ".join(relevant_tables),
+        relevant_columns=relevant_columns,
+        all_tables=all_tables,
+    )
+    if years_note:
+        prompt += f"\n{years_note}"
+    if history_summary:
+        prompt += f"\nSUMMARY OF EARLIER CONVERSATION:\n{history_summary}\n"
+    return prompt
+
+
+def _truncate(text, max_chars=1200):
+    try:
+        s = str(text)
+    except Exception:
+        s = repr(text)
+    return s if len(s) <= max_chars else s[:max_chars] + " ... [truncated]"
+
+
+# Normalize any stream item into a message for stream_mode="messages"
+def _as_msg(step):
+    if isinstance(step, tuple) and step:
+        return step[0]
+    if isinstance(step, dict) and "messages" in step:
+        return step["messages"][-1]
+    return step
+
+
+# Extract tool call name and args regardless of provider shape
+def _tc_name_args(tc):
+    try:
+        if isinstance(tc, dict):
+            if "function" in tc:
+                fn = tc["function"] or {}
+                return fn.get("name", ""), fn.get("arguments", {})
+            return (
+                tc.get("name") or tc.get("type") or "",
+                tc.get("args") or tc.get("arguments") or tc.get("input") or {},
+            )
+        name = getattr(tc, "name", None) or getattr(tc, "type", "") or ""
+        args = (
+            getattr(tc, "args", None)
+            or getattr(tc, "arguments", None)
+            or getattr(tc, "input", None)
+            or {}
+        )
+        return name, args
+    except Exception:
+        return "", {}
+
+
+def model_name(model):
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def run_agent(job, agent, messages, config, mode, supervisor):
+    # Runs on a worker thread: no Streamlit calls here, steps go through job.emit
+    config = {**config, "callbacks": config["callbacks"] + [job.callback()]}
+    try:
+        if mode == INVOKE_MODE:
+            result = agent.invoke({"messages": messages}, config=config)
+            return result["messages"][-1].content
+
+        # "messages" carries token chunks for live display; "updates" carries each
+        # node's complete messages (tool calls, tool results, final answer)
+        response_text = ""
+        for stream_mode, data in agent.stream(
+            {"messages": messages},
+            stream_mode=["messages", "updates"],
+            config=config
+        ):
+            if stream_mode == "messages":
+                msg = _as_msg(data)
+                if getattr(msg, "type", "") in ("ai", "AIMessageChunk") and msg.text:
+                    job.emit("token", id=msg.id, text=msg.text)
+                continue
+
+            for update in data.values():
+                if not isinstance(update, dict):
+                    continue
+                for msg in update.get("messages", []):
+                    if getattr(msg, "type", "") == "tool":
+                        job.emit("tool_result", name=getattr(msg, "name", ""), content=_truncate(msg.content))
+                    elif getattr(msg, "type", "") == "ai":
+                        if msg.tool_calls:
+                            for tc in msg.tool_calls:
+                                name, args = _tc_name_args(tc)
+                                job.emit("tool_call", id=msg.id, name=name, args=args)
+                        elif msg.text:
+                            response_text = msg.text
+                            job.emit("answer", id=msg.id, text=response_text)
+        return response_text
+    except RunStopped:
+        # Supervisor ended the run: keep the best partial answer and the reason
+        return supervisor.partial_answer()
+
+
+def run_routed(job, run):
+    # Runs on a worker thread: the fast model first for simple questions, the strong
+    # model for complex ones and whenever the fast run fails
+    tiers = ["fast", "strong"] if run["decision"]["tier"] == "fast" else ["strong"]
+    usage_collector = run["usage_collector"]
+    response_text = ""
+    for tier in tiers:
+        if run["attempts"]:
+            # The escalated run starts with fresh loop detection
+            run["supervisor"] = RunSupervisor(usage=usage_collector, **run["budget"])
+        supervisor = run["supervisor"]
+        config = {
+            "recursion_limit": RECURSION_LIMIT,
+            "callbacks": [usage_collector, TracingCallback(run["tracer"]), supervisor]
+        }
+        calls_before = len(usage_collector.calls)
+        started = time.perf_counter()
+        error = None
+        try:
+            response_text = run_agent(job, run["agents"][tier], run["messages"], config, run["mode"], supervisor)
+            failed = run_failed(response_text, supervisor)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            if tier == tiers[-1]:
+                raise
+            failed, error = True, e
+        run["attempts"].append({
+            "tier": tier,
+            "model": model_name(run["models"][tier]),
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+            "tokens": sum(c["total"] for c in usage_collector.calls[calls_before:]),
+            "ok": not failed,
+        })
+        if not failed or tier == tiers[-1]:
+            return response_text
+        run["result_capture"].reset()
+        job.emit(
+            "escalate",
+            model=model_name(run["models"]["strong"]),
+            reason=str(error) if error else (supervisor.stop_reason or "no usable answer"),
+        )
+    return response_text
+
+
+def stage_timings(tracer):
+    """Milliseconds spent per span kind (retrieval, llm, tool, sql, template) in a trace."""
+    totals = {}
+    for span in tracer.spans:
+        if span["kind"] == "root" or span["duration_ms"] is None:
+            continue
+        totals[span["kind"]] = round(totals.get(span["kind"], 0.0) + span["duration_ms"], 1)
+    return totals
+
+
+def _statement(record):
+    # Executed statement without its rows
+    return {k: record[k] for k in ("sql", "ok", "row_count", "elapsed_ms", "error")}
+
+
+class AgentEngine:
+    """
+    One database connection, the shared retrieval indexes and the models.
+    shared: resources from warmup.Warmup.attach(); models: {"strong": model, "fast": model or None}.
+    """
+
+    def __init__(self, sql_engine, db, shared, models, provider="", template_matcher=None, partitions=None):
+        self.sql_engine = sql_engine
+        self.db = db
+        self.usable_tables = shared["usable_tables"]
+        self.value_dictionary = shared["value_dictionary"]
+        self.embeddings = shared["embeddings"]
+        self.column_index = shared["column_index"]
+        self.router = shared["router"]
+        self.models = models
+        self.provider = provider
+        self.template_matcher = template_matcher
+        # {year: path} of the per-year partitions attached on demand
+        self.partitions = partitions or {}
+
+    @classmethod
+    def from_warmup(cls, shared, provider, db_path="schools.db", pooled=False, templates=True, models=None,
+                    partitions=None, **model_kwargs):
+        """
+        Build an engine on the warm-up's shared resources.
+        pooled: a regular connection pool for concurrent callers (batch) instead of the
+        single StaticPool connection a UI session uses.
+        models: {"strong", "fast"} to use instead of the provider's clients (bench_agent.py).
+        partitions: {year: path} of year partitions (default: discover_partitions()).
+        model_kwargs are passed to new chat clients (e.g. temperature).
+        """
+        connect_args = {"check_same_thread": False, "detect_types": 0}
+        if pooled:
+            sql_engine = create_engine(f"sqlite:///{db_path}", connect_args=connect_args)
+        else:
+            sql_engine = create_engine(f"sqlite:///{db_path}", connect_args=connect_args, poolclass=StaticPool)
+        # Record a trace span per SQL statement while a question is traced
+        instrument_engine(sql_engine)
+        # Let cancelled runs interrupt their SQL statements
+        watch_engine(sql_engine)
+        # ATTACH year partitions when a statement refers to them
+        partitions = discover_partitions() if partitions is None else partitions
+        attach_partitions(sql_engine, partitions)
+        # Reflected metadata and table info come from the on-disk schema cache
+        db = cached_sql_database(sql_engine, db_path)
+        if models is None:
+            fast_name = FAST_MODELS.get(provider)
+            models = {
+                "strong": chat_model(provider, **model_kwargs),
+                "fast": chat_model(provider, fast_name, **model_kwargs) if fast_name else None,
+            }
+        matcher = None
+        if templates:
+            # SQL templates for simple parametric questions
+            matcher = IntentMatcher(sql_engine, shared["schema_info"], shared["value_dictionary"],
+                                    shared["column_index"])
+        return cls(sql_engine, db, shared, models, provider=provider, template_matcher=matcher,
+                   partitions=partitions)
+
+    # Template path
+    def try_template(self, question, tracer, session=None):
+        """
+        Answer from a vetted SQL template; returns an outcome dict, or None to hand
+        the question to the agent.
+        """
+        if self.template_matcher is None:
+            return None
+        start_time = time.perf_counter()
+        with tracer.activate(), tracer.span("template", "template"):
+            match = self.template_matcher.match(question)
+            record = None
+            if match is not None and match["confidence"] >= self.template_matcher.min_confidence:
+                record = self.template_matcher.run(match)
+        stats = get_template_stats()
+        if record is None or not record["ok"] or not record["rows"]:
+            stats.count(hit=False)
+            return None
+        stats.count(hit=True)
+        elapsed_s = time.perf_counter() - start_time
+        tracer.finish()
+
+        query_log = get_query_log()
+        question_id = query_log.start_question(
+            question, match["tables"], session=session, model=f"template:{match['intent']}"
+        )
+        query_log.log_statement(question_id, record)
+        query_log.finish_question(question_id, True, round(elapsed_s * 1000, 1))
+        stats.record("template", round(elapsed_s * 1000, 1))
+
+        response_text = match["summary"]
+        if match["intent"] == "lookup" and len(record["rows"]) == 1:
+            row = record["rows"][0]
+            response_text += f"\n\n**{row[0]}**: {row[-1]}"
+        return {
+            "question": question,
+            "answer": response_text,
+            "status": "ok",
+            "path": "template",
+            "error": None,
+            "match": match,
+            "tables": match["tables"],
+            "sql": [_statement(record)],
+            "result": {"columns": record["columns"], "rows": record["rows"]},
+            "usage": {"input": 0, "output": 0, "cached": 0, "total": 0, "calls": 0},
+            "calls": [],
+            "attempts": [],
+            "decision": None,
+            "timings": stage_timings(tracer),
+            "elapsed_s": round(elapsed_s, 3),
+        }
+
+    # Agent path
+    def retrieve(self, retrieval_query, turns=None, tracer=None):
+        """
+        Route a question to its relevant tables; returns (route, relevant_columns text).
+        turns: recent user turns, embedded one by one and combined when COMBINE_TURN_EMBEDDINGS.
+        """
+        # Lexical fast path when decisive, otherwise fused with table-level and
+        # column-level embedding search
+        embed_fn = None
+        if COMBINE_TURN_EMBEDDINGS and turns:
+            embed_fn = lambda: self.embeddings.embed_turns(turns)
+        tracer = tracer or Tracer(question=retrieval_query)
+        with tracer.activate(), tracer.span("retrieval", "retrieval") as retrieval_span:
+            route = self.router.route(retrieval_query, k=3, embed_fn=embed_fn)
+        # Retrieval stages run sequentially; lay them out under the retrieval span
+        stage_start = tracer.get_span(retrieval_span)["start_ms"]
+        for stage, ms in route["timings"].items():
+            if stage == "total":
+                continue
+            tracer.record(stage, "retrieval", stage_start, ms, parent_id=retrieval_span)
+            stage_start += ms
+        return route, format_pruned_columns(route["ranked_columns"], route["tables"])
+
+    def prepare(self, question, route, relevant_columns, messages, tracer, history_summary=None,
+                mode=INVOKE_MODE, rows_to_model=ROWS_TO_MODEL, use_routing=True, session=None,
+                usage_totals=None, model_label=None, budget=None):
+        """
+        Build the agents, tools and bookkeeping for one question; returns the run dict
+        that run_routed() executes and finish() closes.
+        messages: conversation messages ending with the question.
+        """
+        relevant_tables = route["tables"]
+        system_prompt = build_system_prompt(
+            self.db.dialect, relevant_tables, relevant_columns, self.usable_tables, history_summary,
+            years_note=prompt_note(self.partitions, question),
+        )
+        toolkit = SQLDatabaseToolkit(db=self.db, llm=self.models["strong"])
+        # Simple questions go to the fast model first, when the provider has one
+        if use_routing and self.models.get("fast") is not None:
+            decision = classify(question, route)
+        else:
+            decision = {"tier": "strong", "score": None, "signals": {}}
+        models = {"strong": self.models["strong"]}
+        if decision["tier"] == "fast":
+            models["fast"] = self.models["fast"]
+
+        # Log the question and every statement the agent executes
+        query_log = get_query_log()
+        question_id = query_log.start_question(
+            question, relevant_tables, session=session,
+            model=f"{model_label or self.provider} ({decision['tier']})",
+        )
+        # Our sql_db_query runs statements itself so executions can be logged
+        tools = [t for t in toolkit.get_tools() if t.name != QUERY_TOOL_NAME]
+        # Plan check before execution: expensive plans are hinted back, rejected or indexed
+        preflight = Preflight(
+            self.sql_engine,
+            on_decision=lambda check: query_log.log_plan(question_id, check),
+        )
+        # Rows of the final successful query are rendered directly, not re-typed by the model
+        result_capture = ResultCapture()
+        statements = []
+        tools.append(make_query_tool(
+            self.sql_engine,
+            before=[preflight],
+            after=[
+                lambda record: query_log.log_statement(question_id, record),
+                lambda record: statements.append(_statement(record)),
+                result_capture,
+            ],
+            max_rows=rows_to_model,
+        ))
+        tools.append(make_lookup_tool(self.value_dictionary))
+
+        agents = {
+            tier: create_agent(model, tools, system_prompt=system_prompt)
+            for tier, model in models.items()
+        }
+        budget = budget or RUN_BUDGET
+        # Collect real per-call usage (provider metadata, tiktoken fallback)
+        usage_collector = UsageCollector(session_totals=usage_totals)
+        return {
+            "question": question,
+            "mode": mode,
+            "messages": messages,
+            "agents": agents,
+            "models": models,
+            "decision": decision,
+            "attempts": [],
+            "tracer": tracer,
+            "budget": budget,
+            # Stops loops (repeated tool calls, retried failing queries) and enforces budgets
+            "supervisor": RunSupervisor(usage=usage_collector, **budget),
+            "usage_collector": usage_collector,
+            "question_id": question_id,
+            "result_capture": result_capture,
+            "statements": statements,
+            "route": route,
+            "relevant_columns": relevant_columns,
+            "start_time": time.perf_counter(),
+        }
+
+    def finish(self, run):
+        """Close out a run whose job has ended: trace, query log, stats; returns the outcome dict."""
+        job, tracer, supervisor = run["job"], run["tracer"], run["supervisor"]
+        query_log = get_query_log()
+        elapsed_s = time.perf_counter() - run["start_time"]
+        outcome = {
+            "question": run["question"],
+            "answer": None,
+            "status": None,
+            "path": "agent",
+            "error": None,
+            "tables": run["route"]["tables"],
+            "sql": list(run["statements"]),
+            "result": None,
+            "usage": run["usage_collector"].totals(),
+            "calls": list(run["usage_collector"].calls),
+            "attempts": run["attempts"],
+            "decision": run["decision"],
+            "timings": {},
+            "elapsed_s": round(elapsed_s, 3),
+        }
+        if job.status == "error":
+            tracer.finish(status="error")
+            query_log.finish_question(run["question_id"], False, None)
+            outcome.update(status="error", error=str(job.error), timings=stage_timings(tracer))
+            return outcome
+
+        if job.cancelled:
+            response_text = supervisor.partial_answer("cancelled by user")
+            status = "cancelled"
+        else:
+            response_text = job.result
+            status = "stopped" if supervisor.stop_reason else "ok"
+        tracer.finish(status)
+        query_log.finish_question(run["question_id"], bool(response_text) and status == "ok",
+                                  round(elapsed_s * 1000, 1))
+        get_template_stats().record("agent", round(elapsed_s * 1000, 1))
+        if run["decision"]["score"] is not None:
+            get_routing_stats().record(run["decision"], run["attempts"])
+
+        record = run["result_capture"].record
+        if record is not None:
+            outcome["result"] = {"columns": record["columns"], "rows": record["rows"]}
+        outcome.update(answer=response_text, status=status, timings=stage_timings(tracer))
+        outcome["timings"]["retrieval_stages"] = {k: round(v, 2) for k, v in run["route"]["timings"].items()}
+        return outcome
+
+    def ask(self, question, history=(), mode=INVOKE_MODE, use_templates=True, use_routing=True,
+            rows_to_model=ROWS_TO_MODEL, session=None, budget=None, tracer=None):
+        """
+        Answer one question synchronously in the calling thread; returns the outcome dict.
+        history: earlier user questions of the same conversation, oldest first.
+        """
+        tracer = tracer or Tracer(question=question, user=session or "")
+        if use_templates:
+            outcome = self.try_template(question, tracer, session=session)
+            if outcome is not None:
+                return outcome
+        # Same retrieval query the app builds from the conversation
+        past_user_utts = (list(history) + [question])[-(HISTORY_TURNS - 1):]
+        route, relevant_columns = self.retrieve(" ".join(past_user_utts), past_user_utts, tracer)
+        run = self.prepare(
+            question, route, relevant_columns, [{"role": "user", "content": question}], tracer,
+            mode=mode, rows_to_model=rows_to_model, use_routing=use_routing, session=session, budget=budget,
+        )
+        with tracer.activate():
+            run["job"] = run_job(lambda job: run_routed(job, run), name="ask", session=session)
+        return self.finish(run)
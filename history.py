@@ -0,0 +1,132 @@
+"""
+Token-budgeted conversation history.
+
+The most recent turns are sent to the agent verbatim as long as they fit in a
+token budget (counted with tiktoken). Older turns are folded into a rolling
+summary that is computed once per fold and cached in the caller's state, so
+prompt size stays bounded however long the session runs.
+"""
+from langchain_core.messages import HumanMessage, SystemMessage
+
+ERROR_PREFIX = "❌ Error:"
+# Rows of an answer's result table kept in its history entry, for follow-up questions
+RESULT_PREVIEW_ROWS = 5
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # tiktoken missing or its BPE file unavailable offline
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken's cl100k_base, falling back to ~4 chars per token."""
+    enc = _get_encoding()
+    if not enc:
+        return len(text or "") // 4
+    return len(enc.encode(text or "", disallowed_special=()))
+
+
+def _result_preview(result):
+    rows = result["rows"][:RESULT_PREVIEW_ROWS]
+    more = len(result["rows"]) - len(rows)
+    lines = [" | ".join(result["columns"])] + [" | ".join(str(v) for v in r) for r in rows]
+    if more > 0:
+        lines.append(f"... {more} more rows")
+    return "\n\nResult table shown to the user:\n" + "\n".join(lines)
+
+
+def clean_history(messages):
+    """
+    Keep user/assistant messages with content, dropping error replies.
+    Answers carrying a result table get a short preview of it appended.
+    """
+    return [
+        {"role": m["role"], "content": m["content"] + (_result_preview(m["result"]) if m.get("result") else "")}
+        for m in messages
+        if m.get("role") in ("user", "assistant")
+        and m.get("content")
+        and not str(m["content"]).startswith(ERROR_PREFIX)
+    ]
+
+
+class HistoryManager:
+    """
+    Build the agent's message history within a token budget.
+
+    state is a dict owned by the caller (e.g. in st.session_state) holding
+    {"folded": number of cleaned messages already summarised, "summary": text}.
+    """
+
+    def __init__(self, model=None, budget_tokens=3000, summary_max_tokens=300):
+        self.model = model
+        self.budget_tokens = budget_tokens
+        self.summary_max_tokens = summary_max_tokens
+
+    def split(self, history):
+        """Return the index where the verbatim tail starts (the latest message is always kept)."""
+        used = 0
+        start = len(history)
+        for i in range(len(history) - 1, -1, -1):
+            cost = count_tokens(history[i]["content"]) + 4  # role/format overhead
+            if start < len(history) and used + cost > self.budget_tokens:
+                break
+            used += cost
+            start = i
+        # Start the verbatim tail on a user turn so the agent never sees a dangling answer
+        while start < len(history) - 1 and history[start]["role"] != "user":
+            start += 1
+        return start
+
+    def build(self, messages, state):
+        """
+        Return (verbatim messages, summary text or "") for the given chat history.
+        state is updated in place when more turns are folded into the summary.
+        """
+        history = clean_history(messages)
+        start = max(self.split(history), min(state.get("folded", 0), len(history) - 1))
+        folded = state.get("folded", 0)
+        if start > folded:
+            state["summary"] = self.summarize(state.get("summary", ""), history[folded:start])
+            state["folded"] = start
+        return history[start:], state.get("summary", "")
+
+    def summarize(self, previous_summary, turns):
+        """Fold turns into the previous summary, using the model when available."""
+        transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+        if self.model is not None:
+            try:
+                prompt = (
+                    "Update the running summary of a conversation between a user and a SQL "
+                    "database assistant. Keep the facts needed for follow-up questions: the "
+                    "entities, filters, tables and numbers discussed. Be concise "
+                    f"(under {self.summary_max_tokens} tokens).\n\n"
+                    f"Current summary:\n{previous_summary or '(none)'}\n\n"
+                    f"New turns:\n{transcript}"
+                )
+                response = self.model.invoke([
+                    SystemMessage(content="You summarise conversations."),
+                    HumanMessage(content=prompt),
+                ])
+                summary = str(getattr(response, "content", "") or "").strip()
+                if summary:
+                    return summary
+            except Exception as e:
+                print(f"History summarisation failed, using extractive summary: {e}")
+        return self._extractive_summary(previous_summary, turns)
+
+    def _extractive_summary(self, previous_summary, turns):
+        # Keep the user questions, newest last, trimmed to the summary budget
+        lines = [previous_summary] if previous_summary else []
+        lines += [f"- User asked: {t['content']}" for t in turns if t["role"] == "user"]
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
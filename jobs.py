@@ -0,0 +1,205 @@
+"""
+Background execution of agent runs.
+
+Agent runs are submitted to a process-wide thread pool (AGENT_WORKERS threads)
+so the Streamlit script never blocks on them and a rerun does not abandon a run.
+Each run gets a Job handle kept in the session: the worker pushes intermediate
+steps onto the job's queue, the script drains them and renders.
+
+Job.cancel() aborts in-flight work:
+- LLM: CancelCallback raises JobCancelled at the next callback (start of an LLM
+  or tool call, every streamed token); a non-streaming request in flight is
+  finished by the provider but its result is discarded
+- SQL: statements running on engines installed with watch_engine are
+  interrupted through sqlite3 Connection.interrupt(), and no new ones start
+  (interrupting a connection with no statement running is a no-op)
+"""
+import contextvars
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import BaseCallbackHandler
+from sqlalchemy import event
+
+AGENT_WORKERS = int(os.environ.get("AGENT_WORKERS", "8"))
+
+# Job running in the current context (propagates to tool threads)
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job has been cancelled."""
+
+
+def current_job():
+    return _current_job.get()
+
+
+def get_executor():
+    """Process-wide worker pool shared by all sessions."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=AGENT_WORKERS, thread_name_prefix="agent")
+        return _executor
+
+
+class Job:
+    """
+    Handle for one background run.
+    status: pending, running, done, error or cancelled; result / error are set when it ends.
+    """
+
+    def __init__(self, name="agent", session=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.session = session
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.events = queue.Queue()
+        # Every event drained so far, so a rerun can replay the run's steps
+        self.log = []
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    # Worker side
+    def emit(self, kind, **data):
+        self.events.put({"kind": kind, "ts": time.time(), **data})
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled("cancelled by user")
+
+    def callback(self):
+        return CancelCallback(self)
+
+    def _run(self, fn):
+        token = _current_job.set(self)
+        self.status = "running"
+        try:
+            self.result = fn(self)
+            self.status = "cancelled" if self._cancel.is_set() else "done"
+        except JobCancelled:
+            self.status = "cancelled"
+        except Exception as e:
+            self.status = "cancelled" if self._cancel.is_set() else "error"
+            self.error = e
+        finally:
+            _current_job.reset(token)
+            with self._lock:
+                self._connections.clear()
+            self.finished = time.time()
+            self._done.set()
+
+    # SQL connections used by this job (see watch_engine)
+    def _attach(self, dbapi_conn):
+        with self._lock:
+            self._connections.add(dbapi_conn)
+
+    # Script side
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Request cancellation and interrupt any SQL statement the job is running."""
+        self._cancel.set()
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.interrupt()
+            except Exception as e:
+                print(f"Could not interrupt SQL statement: {e}")
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def drain(self):
+        """Move queued events to the log and return them."""
+        new = []
+        while True:
+            try:
+                new.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        self.log.extend(new)
+        return new
+
+
+def submit(fn, name="agent", session=None):
+    """
+    Run fn(job) on the worker pool and return its Job.
+    The caller's context (e.g. the active tracer) is copied into the worker.
+    """
+    job = Job(name=name, session=session)
+    ctx = contextvars.copy_context()
+    get_executor().submit(ctx.run, job._run, fn)
+    return job
+
+
+def run(fn, name="agent", session=None):
+    """Run fn(job) in the calling thread (e.g. a batch worker) and return its finished Job."""
+    job = Job(name=name, session=session)
+    job._run(fn)
+    return job
+
+
+class CancelCallback(BaseCallbackHandler):
+    """Stops a run at the next LLM / tool event once its job is cancelled."""
+
+    raise_error = True
+
+    def __init__(self, job):
+        self.job = job
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.job.check()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.job.check()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.job.check()
+
+    def on_llm_end(self, response, **kwargs):
+        self.job.check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.job.check()
+
+    def on_tool_end(self, output, **kwargs):
+        self.job.check()
+
+
+def watch_engine(engine):
+    """Install cursor hooks so cancelled jobs stop issuing SQL and running statements are interrupted."""
+    if getattr(engine, "_jobs_installed", False):
+        return engine
+
+    # Connections stay attached until the job ends: SQLite does most of the work while
+    # rows are fetched, after after_cursor_execute has fired
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        job = current_job()
+        if job is not None:
+            job.check()
+            job._attach(conn.connection.driver_connection)
+
+    engine._jobs_installed = True
+    return engine
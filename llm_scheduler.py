@@ -0,0 +1,322 @@
+"""
+Process-wide scheduler for chat-model requests.
+
+Every chat client opened by warmup.chat_model() carries a SchedulerGate
+callback, so each LLM call (agent steps, the SQL query checker, history
+summaries) asks the scheduler for a slot before the request is sent and
+hands it back when the call ends or fails. Per provider:
+- concurrency:  at most max_concurrent calls in flight
+- rate:         a token bucket of rpm requests per minute (burst tokens)
+- fairness:     waiting calls are granted round-robin across sessions, so a
+                session with many queued calls gets one turn per round and a
+                looping agent cannot starve everyone else
+- backpressure: at most max_queue calls wait; beyond that, or after max_wait
+                seconds, a call is rejected with SchedulerBusy
+- a 429 from the provider pauses its bucket for COOLDOWN_SECONDS, so calls
+  queue here instead of retrying into the limit
+
+A call that has to wait emits "queued" / "scheduled" job events, shown in the
+run's status line. metrics() and prometheus_text() export queue depth, wait
+times, rejections and rate-limit responses per provider.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from jobs import current_job
+
+# Defaults per provider; unknown providers get DEFAULT_LIMITS
+PROVIDER_LIMITS = {
+    "DeepSeek": {"max_concurrent": 4, "rpm": 60},
+    "OpenAI GPT-4": {"max_concurrent": 8, "rpm": 500},
+    "Google Gemini": {"max_concurrent": 4, "rpm": 60},
+}
+DEFAULT_LIMITS = {"max_concurrent": 4, "rpm": 60}
+MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "64"))
+MAX_WAIT_SECONDS = float(os.environ.get("LLM_MAX_WAIT_SECONDS", "60"))
+COOLDOWN_SECONDS = 10.0
+
+# Session of calls made outside a job (e.g. history summaries on the script thread)
+_current_session = contextvars.ContextVar("llm_session", default=None)
+
+
+def set_session(session):
+    _current_session.set(session)
+
+
+class SchedulerBusy(RuntimeError):
+    """A call was rejected: the provider's queue is full or the call waited too long."""
+
+
+class _Ticket:
+    __slots__ = ("session", "granted")
+
+    def __init__(self, session):
+        self.session = session
+        self.granted = False
+
+
+class ProviderScheduler:
+    """Slots, token bucket and fair queue of one provider."""
+
+    def __init__(self, provider, max_concurrent, rpm, burst=None, max_queue=MAX_QUEUE,
+                 max_wait=MAX_WAIT_SECONDS, window=1000):
+        self.provider = provider
+        self.max_concurrent = max_concurrent
+        self.rate = rpm / 60.0
+        self.capacity = float(burst or max_concurrent)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tokens = self.capacity
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        # session -> waiting tickets; rotation holds the sessions with waiting tickets, next first
+        self.queues = {}
+        self.rotation = deque()
+        self.counts = {"granted": 0, "waited": 0, "rejected_full": 0, "rejected_timeout": 0, "rate_limited": 0}
+        self.max_depth = 0
+        self.waits = deque(maxlen=window)
+        self._refilled = time.monotonic()
+        self._cond = threading.Condition()
+
+    def configure(self, max_concurrent=None, rpm=None, burst=None, max_queue=None, max_wait=None):
+        with self._cond:
+            if max_concurrent is not None:
+                self.max_concurrent = max_concurrent
+            if rpm is not None:
+                self.rate = rpm / 60.0
+            if burst is not None or max_concurrent is not None:
+                self.capacity = float(burst or self.max_concurrent)
+                self.tokens = min(self.tokens, self.capacity)
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if max_wait is not None:
+                self.max_wait = max_wait
+            self._dispatch(time.monotonic())
+
+    # Called with self._cond held
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _dispatch(self, now):
+        self._refill(now)
+        granted = False
+        while (self.rotation and self.in_flight < self.max_concurrent and self.tokens >= 1
+               and now >= self.paused_until):
+            session = self.rotation.popleft()
+            queue = self.queues[session]
+            queue.popleft().granted = True
+            if queue:
+                # Back of the line: one grant per session per round
+                self.rotation.append(session)
+            else:
+                del self.queues[session]
+            self.in_flight += 1
+            self.tokens -= 1
+            self.waiting -= 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _next_wakeup(self, now):
+        delays = []
+        if now < self.paused_until:
+            delays.append(self.paused_until - now)
+        if self.tokens < 1 and self.rate > 0:
+            delays.append((1 - self.tokens) / self.rate)
+        return max(min(delays), 0.01) if delays else None
+
+    def _remove(self, ticket):
+        queue = self.queues.get(ticket.session)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self.queues[ticket.session]
+            self.rotation.remove(ticket.session)
+        self.waiting -= 1
+
+    def acquire(self, session, on_wait=None, check=None):
+        """
+        Block until a call of session may start; returns the seconds waited.
+        on_wait(queued, in_flight) is called when the call has to wait; check() is
+        called while waiting and may raise to abandon the call (e.g. a cancelled job).
+        Raises SchedulerBusy when the queue is full or max_wait passes.
+        """
+        started = time.monotonic()
+        with self._cond:
+            if self.waiting >= self.max_queue:
+                self.counts["rejected_full"] += 1
+                raise SchedulerBusy(f"{self.provider}: {self.waiting} LLM calls already queued, try again shortly")
+            ticket = _Ticket(session)
+            if session not in self.queues:
+                self.queues[session] = deque()
+                self.rotation.append(session)
+            self.queues[session].append(ticket)
+            self.waiting += 1
+            self.max_depth = max(self.max_depth, self.waiting)
+            self._dispatch(started)
+            if not ticket.granted:
+                self.counts["waited"] += 1
+                if on_wait:
+                    on_wait(self.waiting, self.in_flight)
+            while not ticket.granted:
+                now = time.monotonic()
+                remaining = self.max_wait - (now - started)
+                if remaining <= 0:
+                    self._remove(ticket)
+                    self.counts["rejected_timeout"] += 1
+                    raise SchedulerBusy(f"{self.provider}: no LLM slot within {self.max_wait:g}s, try again shortly")
+                if check is not None:
+                    try:
+                        check()
+                    except BaseException:
+                        self._remove(ticket)
+                        raise
+                # Wake for a token, the end of a pause, or at least once a second for check()
+                self._cond.wait(min(self._next_wakeup(now) or 1.0, remaining, 1.0))
+                self._dispatch(time.monotonic())
+            waited = time.monotonic() - started
+            self.counts["granted"] += 1
+            self.waits.append(waited)
+        return waited
+
+    def release(self):
+        with self._cond:
+            self.in_flight = max(self.in_flight - 1, 0)
+            self._dispatch(time.monotonic())
+
+    def pause(self, seconds=COOLDOWN_SECONDS):
+        """Hold new grants for seconds after the provider answered 429."""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.counts["rate_limited"] += 1
+
+    def snapshot(self):
+        with self._cond:
+            waits = sorted(self.waits)
+            return {
+                "provider": self.provider,
+                "in_flight": self.in_flight,
+                "queued": self.waiting,
+                "max_queued": self.max_depth,
+                "sessions_waiting": len(self.rotation),
+                "max_concurrent": self.max_concurrent,
+                "rpm": round(self.rate * 60, 1),
+                "paused_s": round(max(self.paused_until - time.monotonic(), 0.0), 1),
+                **self.counts,
+                "wait_p50_s": round(waits[len(waits) // 2], 3) if waits else None,
+                "wait_p95_s": round(waits[int(len(waits) * 0.95)], 3) if waits else None,
+                "wait_max_s": round(waits[-1], 3) if waits else None,
+            }
+
+
+class LLMScheduler:
+    """ProviderScheduler per provider, created on first use with PROVIDER_LIMITS."""
+
+    def __init__(self):
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def provider(self, name):
+        with self._lock:
+            if name not in self._providers:
+                self._providers[name] = ProviderScheduler(name, **PROVIDER_LIMITS.get(name, DEFAULT_LIMITS))
+            return self._providers[name]
+
+    def configure(self, name, **limits):
+        """Change a provider's limits (max_concurrent, rpm, burst, max_queue, max_wait)."""
+        self.provider(name).configure(**limits)
+
+    def metrics(self):
+        with self._lock:
+            providers = list(self._providers.values())
+        return [p.snapshot() for p in providers]
+
+    def prometheus_text(self):
+        """Metrics in the Prometheus text exposition format."""
+        gauges = ["in_flight", "queued", "max_queued", "sessions_waiting", "paused_s"]
+        counters = ["granted", "waited", "rejected_full", "rejected_timeout", "rate_limited"]
+        lines = []
+        snapshots = self.metrics()
+        for name in gauges:
+            lines.append(f"# TYPE llm_scheduler_{name} gauge")
+            lines += [f'llm_scheduler_{name}{{provider="{s["provider"]}"}} {s[name]}' for s in snapshots]
+        for name in counters:
+            lines.append(f"# TYPE llm_scheduler_{name}_total counter")
+            lines += [f'llm_scheduler_{name}_total{{provider="{s["provider"]}"}} {s[name]}' for s in snapshots]
+        lines.append("# TYPE llm_scheduler_wait_seconds summary")
+        for s in snapshots:
+            for q in ("p50", "p95"):
+                if s[f"wait_{q}_s"] is not None:
+                    quantile = "0.5" if q == "p50" else "0.95"
+                    lines.append(f'llm_scheduler_wait_seconds{{provider="{s["provider"]}",quantile="{quantile}"}} '
+                                 f'{s[f"wait_{q}_s"]}')
+        return "\n".join(lines) + "\n"
+
+
+def _is_rate_limit(error):
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    text = f"{type(error).__name__} {error}".lower()
+    return status == 429 or "ratelimit" in text or "rate limit" in text or "resource_exhausted" in text
+
+
+class SchedulerGate(BaseCallbackHandler):
+    """
+    Chat-model callback that holds each call until the scheduler grants it a slot.
+    Attached to the client itself, so calls made without our run config are gated too.
+    """
+
+    raise_error = True
+
+    def __init__(self, provider, scheduler=None):
+        self.provider = provider
+        self.scheduler = scheduler
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        provider = (self.scheduler or get_scheduler()).provider(self.provider)
+        job = current_job()
+        session = (job.session if job else None) or _current_session.get() or "anonymous"
+        waited_for = []
+
+        def on_wait(queued, in_flight):
+            waited_for.append(queued)
+            if job is not None:
+                job.emit("queued", provider=self.provider, queued=queued, in_flight=in_flight)
+
+        waited = provider.acquire(session, on_wait=on_wait, check=job.check if job else None)
+        with self._lock:
+            self._active[run_id] = provider
+        if waited_for and job is not None:
+            job.emit("scheduled", provider=self.provider, waited_s=round(waited, 2))
+
+    def _release(self, run_id):
+        with self._lock:
+            provider = self._active.pop(run_id, None)
+        if provider is not None:
+            provider.release()
+        return provider
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._release(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        provider = self._release(run_id)
+        if provider is not None and _is_rate_limit(error):
+            provider.pause()
+
+
+_scheduler = LLMScheduler()
+
+
+def get_scheduler():
+    return _scheduler
@@ -0,0 +1,137 @@
+"""
+Complexity-based routing between a fast and a strong model.
+
+classify() scores a question from cheap signals, with no LLM call:
+- how many tables the retrieval router found relevant (close to the best score)
+- join wording ("compare", "versus", "along with", ...)
+- aggregation wording ("average", "per", "distribution", ...)
+- length, several conditions, and references to earlier turns
+
+Simple questions go to the provider's fast model; the rest, and any fast run
+that fails, go to the strong model picked in the sidebar. Decisions, latency
+and tokens per tier are collected per process (get_stats()).
+"""
+import os
+import re
+import threading
+from collections import deque
+
+# Low-latency tool-calling model per provider (None: the provider has no
+# suitable smaller model, every question uses the strong one)
+FAST_MODELS = {
+    "DeepSeek": os.environ.get("FAST_MODEL_DEEPSEEK") or None,
+    "OpenAI GPT-4": os.environ.get("FAST_MODEL_OPENAI", "gpt-4o-mini"),
+    "Google Gemini": os.environ.get("FAST_MODEL_GEMINI", "gemini-2.0-flash-lite"),
+}
+
+# Questions scoring at most this go to the fast model
+SIMPLE_MAX_SCORE = 1.0
+# Tables within this fraction of the best retrieval score count as relevant
+TABLE_SCORE_RATIO = 0.6
+
+_JOIN_RE = re.compile(
+    r"\b(compare|compared|comparison|versus|vs\.?|along with|together with|as well as|"
+    r"relationship|correlat\w*|between|both|and their|combined with)\b"
+)
+_AGGREGATION_RE = re.compile(
+    r"\b(average|avg|mean|median|sum|total|how many|count|number of|per|each|group(?:ed)? by|"
+    r"distribution|percentage|percent|share|ratio|rank(?:ed|ing)?|trend|difference|growth)\b"
+)
+_CONDITION_RE = re.compile(r"\b(and|but|except|excluding|without|not|unless|where|whose|only)\b")
+_FOLLOW_UP_RE = re.compile(r"\b(those|these|them|they|that one|same|previous|above|it)\b")
+
+
+def relevant_table_count(route, ratio=TABLE_SCORE_RATIO):
+    """Tables of a TableRouter.route result scoring within ratio of the best one."""
+    ranked = route.get("ranked_columns") or []
+    if not ranked:
+        return len(route.get("tables") or [])
+    best = max(r["score"] for r in ranked)
+    if best <= 0:
+        return len(ranked)
+    return sum(1 for r in ranked if r["score"] >= best * ratio)
+
+
+def classify(question, route, max_score=SIMPLE_MAX_SCORE):
+    """
+    Return {"tier": "fast" | "strong", "score", "signals"} for a question and its route.
+    """
+    q = question.lower()
+    signals = {
+        "tables": relevant_table_count(route),
+        "join": len(_JOIN_RE.findall(q)),
+        "aggregation": len(_AGGREGATION_RE.findall(q)),
+        "conditions": len(_CONDITION_RE.findall(q)),
+        "words": len(q.split()),
+        "follow_up": bool(_FOLLOW_UP_RE.search(q)),
+    }
+    score = (
+        max(signals["tables"] - 1, 0)
+        + 1.5 * signals["join"]
+        + 0.5 * signals["aggregation"]
+        + 0.5 * max(signals["conditions"] - 1, 0)
+        + (1.0 if signals["words"] > 25 else 0.0)
+        + (1.0 if signals["follow_up"] else 0.0)
+    )
+    return {
+        "tier": "fast" if score <= max_score else "strong",
+        "score": round(score, 2),
+        "signals": signals,
+    }
+
+
+def run_failed(response_text, supervisor):
+    """Whether a run should be retried on the strong model."""
+    if not (response_text or "").strip() or supervisor.stop_reason:
+        return True
+    # Queries failed and none succeeded: the answer is an explanation, not data
+    return supervisor.failed_queries > 0 and supervisor.last_result is None
+
+
+class RoutingStats:
+    """Process-wide routing decisions, escalations, latency and tokens per tier."""
+
+    def __init__(self, window=1000):
+        self.decisions = {"fast": 0, "strong": 0}
+        self.escalations = 0
+        self.tokens = {"fast": 0, "strong": 0}
+        # Tokens the fast model spent on answers it completed without escalating
+        # (the strong model's cost for them is not known)
+        self.fast_tier_tokens = 0
+        self.latency_ms = {"fast": deque(maxlen=window), "strong": deque(maxlen=window)}
+        self._lock = threading.Lock()
+
+    def record(self, decision, attempts):
+        """
+        Record one routed question.
+        attempts: [{"tier", "ms", "tokens", "ok"}] in the order they ran.
+        """
+        with self._lock:
+            self.decisions[decision["tier"]] += 1
+            if len(attempts) > 1:
+                self.escalations += 1
+            for a in attempts:
+                self.tokens[a["tier"]] += a["tokens"]
+                self.latency_ms[a["tier"]].append(a["ms"])
+                if a["tier"] == "fast" and a["ok"]:
+                    self.fast_tier_tokens += a["tokens"]
+
+    def summary(self):
+        with self._lock:
+            out = {
+                "decisions": dict(self.decisions),
+                "escalations": self.escalations,
+                "tokens": dict(self.tokens),
+                "fast_tier_tokens": self.fast_tier_tokens,
+            }
+            for tier, values in self.latency_ms.items():
+                ordered = sorted(values)
+                out[f"{tier}_p50_ms"] = ordered[len(ordered) // 2] if ordered else None
+        return out
+
+
+_stats = RoutingStats()
+
+
+def get_stats():
+    return _stats
@@ -0,0 +1,371 @@
+"""
+Per-year Scorecard partitions, attached to SQLite connections on demand.
+
+Each data year is a separate database file, partitions/schools_<year>.db,
+built by db_setup.py with the same school_* schema as schools.db (which
+stays the current release the app answers from by default):
+
+    python db_setup.py --year 2019 --csv scorecard_2019.csv
+
+Nothing is opened at start-up: discover_partitions() only lists the
+directory. attach_partitions() installs a cursor hook on the app's engine
+that looks at each statement before it runs and:
+- ATTACHes schools_<year>.db as schema y<year> on that connection the first
+  time a statement mentions y<year>.<table>, so a single-year question opens
+  one partition file
+- for <table>_by_year, attaches the years the statement needs and creates a
+  TEMP view SELECT <year> AS DATA_YEAR, * FROM y<year>.<table> UNION ALL ...;
+  filters on UNITID are pushed into each arm, so a cross-year question reads
+  each partition through its UNITID primary key. When the statement limits
+  DATA_YEAR with literals (=, IN, BETWEEN, <, >) and year_span() can show the
+  filter holds for every view it uses, the name is swapped for a view over just
+  those years, so partitions outside the range are never opened
+- gives attached partitions a small page cache (PARTITION_CACHE_KIB), and
+  DETACHes the least recently used ones when SQLite's ATTACH limit is reached,
+  so memory per connection stays flat as years are added
+
+prompt_note() tells the agent which years exist and how to address them.
+
+    python partitions.py [--dir partitions] [--check]
+
+lists the partitions, or with --check runs the year-pruning CHECKS on scratch
+partitions.
+"""
+import os
+import re
+import sqlite3
+import time
+
+from sqlalchemy import event
+
+PARTITION_DIR = os.environ.get("PARTITION_DIR", "partitions")
+# Page cache per attached partition
+PARTITION_CACHE_KIB = 2048
+# SQLite's default SQLITE_MAX_ATTACHED, used when the limit cannot be queried
+DEFAULT_MAX_ATTACHED = 10
+
+_FILE_RE = re.compile(r"^schools_(\d{4})\.db$")
+_SCHEMA_RE = re.compile(r"\by(\d{4})\s*\.", re.IGNORECASE)
+_VIEW_RE = re.compile(r"\b(school_\w+?)_by_year\b", re.IGNORECASE)
+_YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+# Year pruning (year_span) reads only plain inner-join statements; anything else reads every year
+_UNPRUNABLE_RE = re.compile(
+    r"\b(?:OR|NOT|UNION|EXCEPT|INTERSECT|LEFT|RIGHT|FULL|OUTER|NATURAL|USING|WITH)\b|\(\s*SELECT\b",
+    re.IGNORECASE,
+)
+_CLAUSE_WORDS = ("WHERE|JOIN|ON|INNER|CROSS|LEFT|RIGHT|FULL|NATURAL|GROUP|ORDER|LIMIT|HAVING|"
+                 "UNION|EXCEPT|INTERSECT|WINDOW|USING")
+_VIEW_REF_RE = re.compile(
+    rf"\b(school_\w+?_by_year)\b(?!\s*\.)(?:\s+(?:AS\s+)?(?!(?:{_CLAUSE_WORDS})\b)([A-Za-z_]\w*))?",
+    re.IGNORECASE,
+)
+_DATA_YEAR_RE = re.compile(r"(?:\b(\w+)\s*\.\s*)?\bDATA_YEAR\b", re.IGNORECASE)
+_LITERAL_FILTER_RE = re.compile(
+    r"\s*(?:(=|==|>=|<=|>|<)\s*(\d+)|IN\s*\(\s*(\d+(?:\s*,\s*\d+)*)\s*\)|BETWEEN\s+(\d+)\s+AND\s+(\d+))",
+    re.IGNORECASE,
+)
+_YEAR_JOIN_RE = re.compile(r"\s*=\s*(?:(\w+)\s*\.\s*)?(DATA_YEAR)\b", re.IGNORECASE)
+# What may surround a predicate on DATA_YEAR, and a DATA_YEAR that is only selected or sorted
+_PREDICATE_START_RE = re.compile(r"(?:\bWHERE|\bAND|\bON|\()\s*$", re.IGNORECASE)
+_PREDICATE_END_RE = re.compile(r"\s*(?:$|;|\)|\bAND\b|\bJOIN\b|\bINNER\b|\bCROSS\b|\bWHERE\b|\bGROUP\b|"
+                               r"\bORDER\b|\bLIMIT\b|\bHAVING\b)", re.IGNORECASE)
+_OUTPUT_START_RE = re.compile(r"(?:\bSELECT|,|\bBY|\(|\bDISTINCT)\s*$", re.IGNORECASE)
+_OUTPUT_END_RE = re.compile(r"\s*(?:$|;|,|\)|\bAS\b|\bFROM\b|\bASC\b|\bDESC\b|\bLIMIT\b|\bHAVING\b|"
+                            r"\bORDER\b|\bGROUP\b)", re.IGNORECASE)
+_TREND_RE = re.compile(r"\b(trend|over time|changed?|since|each year|per year|by year|growth|grew)\b", re.IGNORECASE)
+
+
+class PartitionLimitError(RuntimeError):
+    """A statement needs more partitions than SQLite can attach at once."""
+
+
+def partition_path(year, directory=PARTITION_DIR):
+    return os.path.join(directory, f"schools_{year}.db")
+
+
+def discover_partitions(directory=PARTITION_DIR):
+    """{year: path} of the partition files in directory, oldest year first."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return {}
+    years = {}
+    for name in names:
+        m = _FILE_RE.match(name)
+        if m:
+            years[int(m.group(1))] = os.path.join(directory, name)
+    return dict(sorted(years.items()))
+
+
+def schema_name(year):
+    return f"y{year}"
+
+
+def years_in(text, years):
+    """Years of the partitions mentioned in text, in order."""
+    mentioned = {int(y) for y in _YEAR_RE.findall(text or "")}
+    return [y for y in years if y in mentioned]
+
+
+def year_span(statement, years):
+    """
+    Years a statement over the _by_year views can read, from its DATA_YEAR filters;
+    None when that cannot be read safely and every year is needed.
+
+    Only inner joins ANDed together are pruned. Every DATA_YEAR must be a literal
+    comparison (=, <, >, IN (...), BETWEEN), an exact a.DATA_YEAR = b.DATA_YEAR join,
+    or only selected, grouped or sorted. With several views, all of them have to be
+    joined on DATA_YEAR, so one view's filter holds for the others too.
+    """
+    if _UNPRUNABLE_RE.search(statement):
+        return None
+    aliases = {}
+    for table, alias in _VIEW_REF_RE.findall(statement):
+        alias = (alias or table).lower()
+        if alias in aliases:
+            return None
+        aliases[alias] = alias
+    if not aliases:
+        return None
+
+    def resolve(qualifier):
+        if qualifier:
+            return qualifier.lower() if qualifier.lower() in aliases else None
+        # Unqualified DATA_YEAR is only unambiguous with one view
+        return next(iter(aliases)) if len(aliases) == 1 else None
+
+    def find(alias):
+        while aliases[alias] != alias:
+            alias = aliases[alias]
+        return alias
+
+    span = set(years)
+    constrained = False
+    joined = set()
+    for m in _DATA_YEAR_RE.finditer(statement):
+        if m.start() in joined:
+            continue
+        alias = resolve(m.group(1))
+        if alias is None:
+            return None
+        before, rest = statement[:m.start()], statement[m.end():]
+        literal = _LITERAL_FILTER_RE.match(rest)
+        join = _YEAR_JOIN_RE.match(rest)
+        if literal and _PREDICATE_START_RE.search(before) and _PREDICATE_END_RE.match(rest, literal.end()):
+            op, value, in_list, low, high = literal.groups()
+            if op:
+                v = int(value)
+                keep = {
+                    "=": lambda y: y == v, "==": lambda y: y == v, ">=": lambda y: y >= v,
+                    "<=": lambda y: y <= v, ">": lambda y: y > v, "<": lambda y: y < v,
+                }[op]
+            elif in_list:
+                keep = {int(i) for i in in_list.split(",")}.__contains__
+            else:
+                keep = lambda y, lo=int(low), hi=int(high): lo <= y <= hi
+            span = {y for y in span if keep(y)}
+            constrained = True
+        elif join and _PREDICATE_START_RE.search(before) and _PREDICATE_END_RE.match(rest, join.end()):
+            other = resolve(join.group(1))
+            if other is None:
+                return None
+            aliases[find(alias)] = find(other)
+            # The other side's DATA_YEAR is part of this predicate
+            joined.add(m.end() + join.start(1 if join.group(1) else 2))
+        elif not (_OUTPUT_START_RE.search(before) and _OUTPUT_END_RE.match(rest)):
+            # Arithmetic, !=, <>, IS, LIKE, a literal on the left, ...
+            return None
+    if not constrained or len({find(a) for a in list(aliases)}) > 1:
+        return None
+    return [y for y in years if y in span]
+
+
+def _max_attached(dbapi_conn):
+    try:
+        return dbapi_conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    except (AttributeError, sqlite3.Error):
+        return DEFAULT_MAX_ATTACHED
+
+
+def _attached(dbapi_conn):
+    return {row[1] for row in dbapi_conn.execute("PRAGMA database_list")}
+
+
+def _ensure_attached(dbapi_conn, state, partitions, years):
+    """ATTACH the given years on dbapi_conn, detaching least recently used ones to make room."""
+    limit = _max_attached(dbapi_conn)
+    if len(years) > limit:
+        raise PartitionLimitError(
+            f"query spans {len(years)} data years but at most {limit} can be attached at once; "
+            f"narrow the year range"
+        )
+    now = time.monotonic()
+    attached = state["attached"]
+    missing = [y for y in years if y not in attached]
+    if not missing:
+        for y in years:
+            attached[y] = now
+        return
+    present = _attached(dbapi_conn)
+    # Anything attached besides main and temp counts against the limit
+    room = limit - len(present - {"main", "temp"})
+    for year in sorted((y for y in attached if y not in years), key=attached.get):
+        if room >= len(missing):
+            break
+        try:
+            dbapi_conn.execute(f"DETACH DATABASE {schema_name(year)}")
+        except sqlite3.Error as e:
+            # In use by an unfinished statement on this connection
+            print(f"Could not detach partition {year}: {e}")
+            continue
+        del attached[year]
+        room += 1
+    for year in missing:
+        schema = schema_name(year)
+        if schema not in present:
+            dbapi_conn.execute(f"ATTACH DATABASE ? AS {schema}", (partitions[year],))
+            dbapi_conn.execute(f"PRAGMA {schema}.cache_size = -{PARTITION_CACHE_KIB}")
+        attached[year] = now
+    for y in years:
+        attached[y] = now
+
+
+def _ensure_view(dbapi_conn, state, table, view, years):
+    """Create the TEMP view named view over table in the given years' partitions that have it."""
+    if view in state["views"]:
+        return
+    years = [
+        y for y in years
+        if dbapi_conn.execute(
+            f"SELECT 1 FROM {schema_name(y)}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+    ]
+    if not years:
+        return
+    arms = " UNION ALL ".join(f'SELECT {y} AS DATA_YEAR, * FROM {schema_name(y)}."{table}"' for y in years)
+    dbapi_conn.execute(f'CREATE TEMP VIEW IF NOT EXISTS "{view}" AS {arms}')
+    state["views"].add(view)
+
+
+def attach_partitions(engine, partitions):
+    """
+    Install the cursor hook that attaches partitions referenced by a statement.
+    partitions: {year: path} from discover_partitions(). Returns the engine.
+    """
+    if getattr(engine, "_partitions_installed", False) or not partitions:
+        return engine
+    partitions = dict(partitions)
+    all_years = list(partitions)
+
+    # retval: the hook may point _by_year names at a view over fewer years
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        schemas = {int(y) for y in _SCHEMA_RE.findall(statement)}
+        tables = {t.lower() for t in _VIEW_RE.findall(statement)}
+        if not schemas and not tables:
+            return statement, parameters
+        span = (year_span(statement, all_years) or all_years) if tables else all_years
+        needed = sorted(set(span if tables else ()) | {y for y in all_years if y in schemas})
+        if not needed:
+            return statement, parameters
+        views = {}
+        for table in tables:
+            views[table] = f"{table}_by_year"
+            if span != all_years:
+                views[table] = f"{table}_{'_'.join(map(str, span))}"
+                statement = re.sub(rf"\b{table}_by_year\b", views[table], statement, flags=re.IGNORECASE)
+        dbapi_conn = conn.connection.driver_connection
+        # conn.info lives as long as the DBAPI connection
+        state = conn.info.setdefault("partitions", {"attached": {}, "views": set()})
+        try:
+            _ensure_attached(dbapi_conn, state, partitions, needed)
+            for table, view in views.items():
+                _ensure_view(dbapi_conn, state, table, view, span)
+        except sqlite3.Error as e:
+            # Let the statement report the missing schema or view as usual
+            print(f"Attaching partitions {needed} failed: {e}")
+        return statement, parameters
+
+    engine._partitions_installed = True
+    return engine
+
+
+def prompt_note(partitions, question=""):
+    """System-prompt section on the year partitions; empty when there are none."""
+    if not partitions:
+        return ""
+    years = list(partitions)
+    first, last = years[0], years[-1]
+    lines = [
+        f"DATA YEARS: Scorecard releases {', '.join(map(str, years))} are available as separate schemas.",
+        "- Unqualified tables (school_costs, ...) are the current release; use them unless a year is asked for",
+        f"- One year: prefix the table with its schema, e.g. y{last}.school_costs JOIN y{last}.school_main USING (UNITID)",
+        "- Several years or trends: use <table>_by_year (e.g. school_costs_by_year), which has a DATA_YEAR "
+        "column; always filter DATA_YEAR to the years needed and join on both UNITID and DATA_YEAR",
+    ]
+    mentioned = years_in(question, years)
+    if len(mentioned) == 1 and not _TREND_RE.search(question or ""):
+        lines.append(f"This question is about {mentioned[0]}: query the y{mentioned[0]} schema only.")
+    elif mentioned:
+        lines.append(f"This question spans data years {', '.join(map(str, mentioned))}: "
+                     f"use the _by_year views with DATA_YEAR IN ({', '.join(map(str, mentioned))}).")
+    elif _TREND_RE.search(question or ""):
+        lines.append(f"For trends use the _by_year views (data years {first}-{last}).")
+    return "\n".join(lines) + "\n"
+
+
+# (statement over scratch partitions 2019-2021 with two schools each, expected row count)
+CHECKS = [
+    ("SELECT c.UNITID FROM school_costs_by_year c JOIN school_costs_by_year p "
+     "ON c.UNITID = p.UNITID AND c.DATA_YEAR = p.DATA_YEAR + 1 WHERE c.DATA_YEAR = 2020", 2),
+    ("SELECT c.UNITID FROM school_costs_by_year c JOIN school_costs_by_year p "
+     "ON c.UNITID = p.UNITID AND c.DATA_YEAR = p.DATA_YEAR WHERE c.DATA_YEAR = 2020", 2),
+    ("SELECT UNITID FROM school_costs_by_year WHERE NOT DATA_YEAR = 2019", 4),
+    ("SELECT UNITID FROM school_costs_by_year WHERE DATA_YEAR <> 2019", 4),
+    ("SELECT UNITID FROM school_costs_by_year WHERE DATA_YEAR IN (2019, 2021)", 4),
+    ("SELECT UNITID FROM school_costs_by_year WHERE DATA_YEAR >= 2020 AND UNITID = 1", 2),
+    ("SELECT UNITID FROM y2021.school_costs", 2),
+]
+
+
+def run_checks():
+    """Run CHECKS against scratch partitions; returns the number of failures."""
+    import tempfile
+
+    from sqlalchemy import create_engine
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for year in (2019, 2020, 2021):
+            with sqlite3.connect(partition_path(year, directory)) as conn:
+                conn.execute("CREATE TABLE school_costs (UNITID BIGINT NOT NULL PRIMARY KEY, TUITIONFEE_IN BIGINT)")
+                conn.executemany("INSERT INTO school_costs VALUES (?, ?)", [(1, year), (2, year + 1)])
+        engine = attach_partitions(create_engine(f"sqlite:///{os.path.join(directory, 'main.db')}"),
+                                   discover_partitions(directory))
+        for statement, expected in CHECKS:
+            with engine.connect() as conn:
+                rows = conn.exec_driver_sql(statement).fetchall()
+            ok = len(rows) == expected
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {len(rows)} rows (expected {expected}, "
+                  f"years {year_span(statement, [2019, 2020, 2021]) or 'all'}): {statement}")
+        engine.dispose()
+    return failures
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="List the year partitions, or check year pruning.")
+    parser.add_argument("--dir", default=PARTITION_DIR)
+    parser.add_argument("--check", action="store_true", help="run the pruning checks on scratch partitions")
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(1 if run_checks() else 0)
+    for year, path in discover_partitions(args.dir).items():
+        print(f"{year}  {os.path.getsize(path) / (1 << 20):8.1f} MB  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+EXPLAIN QUERY PLAN pre-flight for agent-generated SQL.
+
+Before the query tool executes a statement, its plan is inspected for:
+- nested_scan: a full scan inside a join loop with no index (cost grows as rows x rows)
+- auto_index: SQLite building a transient automatic index for a join on every run
+- join_scan: a full scan of a large table that takes part in a join
+- temp_sort: a temp B-tree sort (ORDER BY / GROUP BY / DISTINCT) over a large table
+
+Severe issues (nested_scan, auto_index) are handled by mode (SQL_PREFLIGHT_MODE):
+- off:        no checks
+- hint:       the plan is returned to the agent as a rewrite hint instead of running;
+              submitting the same statement again runs it anyway
+- reject:     the statement is refused with an error
+- auto_index: (dev) the suggested indexes are created, then the statement runs
+Other issues are only logged. Every plan and decision is passed to on_decision.
+"""
+import os
+import re
+import threading
+
+from sqlalchemy import text
+
+from query_plan import explain_query_plan, plan_scans, table_aliases, format_plan
+
+PREFLIGHT_MODE = os.environ.get("SQL_PREFLIGHT_MODE", "hint")
+# Tables with at least this many rows count as large for scan/sort checks
+LARGE_TABLE_ROWS = int(os.environ.get("SQL_PREFLIGHT_LARGE_ROWS", "5000"))
+
+SEVERE_ISSUES = {"nested_scan", "auto_index"}
+
+_AUTO_INDEX_RE = re.compile(r"^SEARCH (\w+) USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \((\w+)")
+_TEMP_BTREE_RE = re.compile(r"^USE TEMP B-TREE FOR (.+)$")
+
+# Row counts per (database url, table), computed once per process
+_row_counts = {}
+_row_counts_lock = threading.Lock()
+
+
+def _join_columns(sql, alias, columns):
+    """Columns of the given alias compared in the statement's predicates."""
+    found = []
+    for col in columns:
+        pattern = rf"\b{re.escape(alias)}\.{re.escape(col)}\b\s*(=|<|>|<=|>=|IN\b)|(=|<|>|<=|>=)\s*{re.escape(alias)}\.{re.escape(col)}\b"
+        if re.search(pattern, sql, re.IGNORECASE):
+            found.append(col)
+    return found
+
+
+class Preflight:
+    """Callable before-hook for sql_tools.make_query_tool."""
+
+    def __init__(self, engine, mode=PREFLIGHT_MODE, large_table_rows=LARGE_TABLE_ROWS, on_decision=None):
+        self.engine = engine
+        self.mode = mode
+        self.large_table_rows = large_table_rows
+        self.on_decision = on_decision
+        self._hinted = set()
+
+    def row_count(self, table):
+        key = (str(self.engine.url), table)
+        with _row_counts_lock:
+            if key in _row_counts:
+                return _row_counts[key]
+        try:
+            with self.engine.connect() as conn:
+                count = conn.execute(text(f'SELECT COUNT(*) FROM "{table}"')).scalar() or 0
+        except Exception:
+            count = 0
+        with _row_counts_lock:
+            _row_counts[key] = count
+        return count
+
+    def _columns(self, table):
+        with self.engine.connect() as conn:
+            return [r[1] for r in conn.exec_driver_sql(f'PRAGMA table_info("{table}")')]
+
+    def analyze(self, sql):
+        """Return {"sql", "plan", "issues", "suggested_indexes"}; plan is None if it cannot be explained."""
+        try:
+            with self.engine.connect() as conn:
+                plan = explain_query_plan(conn, sql)
+        except Exception:
+            # Let execution report syntax / schema errors as usual
+            return {"sql": sql, "plan": None, "issues": [], "suggested_indexes": []}
+
+        aliases = table_aliases(sql)
+        issues, suggestions = [], []
+        scans = [s for s in plan_scans(plan, sql) if not s["covering"]]
+        loop_steps = [
+            row for row in plan
+            if row["detail"].startswith(("SCAN ", "SEARCH ")) and not row["detail"].startswith("SCAN CONSTANT")
+        ]
+        is_join = len(loop_steps) > 1
+
+        outer = loop_steps[0] if loop_steps else None
+        for scan in scans:
+            table = scan["table"]
+            alias = scan["alias"] or table
+            # A scan that is a later loop of the same join runs once per outer row
+            inner = is_join and scan["parent"] == outer["parent"] and scan["id"] != outer["id"]
+            if inner:
+                issues.append({"kind": "nested_scan", "table": table, "detail": scan["detail"]})
+                for col in _join_columns(sql, alias, self._columns(table)):
+                    suggestions.append((table, col))
+            elif is_join and self.row_count(table) >= self.large_table_rows:
+                issues.append({"kind": "join_scan", "table": table, "detail": scan["detail"]})
+
+        for row in plan:
+            m = _AUTO_INDEX_RE.match(row["detail"])
+            if m:
+                table = aliases.get(m.group(1), m.group(1))
+                issues.append({"kind": "auto_index", "table": table, "detail": row["detail"]})
+                suggestions.append((table, m.group(2)))
+            m = _TEMP_BTREE_RE.match(row["detail"])
+            if m and any(self.row_count(s["table"]) >= self.large_table_rows for s in scans):
+                issues.append({"kind": "temp_sort", "table": None, "detail": row["detail"]})
+
+        return {
+            "sql": sql,
+            "plan": plan,
+            "issues": issues,
+            "suggested_indexes": list(dict.fromkeys(suggestions)),
+        }
+
+    def create_indexes(self, suggestions):
+        created = []
+        with self.engine.begin() as conn:
+            for table, col in suggestions:
+                name = f"idx_{table}_{col}".lower()
+                conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}"("{col}")')
+                created.append(name)
+        return created
+
+    def __call__(self, sql):
+        if self.mode == "off":
+            return None
+        check = self.analyze(sql)
+        severe = [i for i in check["issues"] if i["kind"] in SEVERE_ISSUES]
+        message = None
+        if not severe:
+            check["decision"] = "allow"
+        elif self.mode == "reject":
+            check["decision"] = "reject"
+            message = "Error: query rejected by plan check. " + self._explain(check)
+        elif self.mode == "auto_index" and check["suggested_indexes"]:
+            check["decision"] = "indexed"
+            check["created_indexes"] = self.create_indexes(check["suggested_indexes"])
+        elif sql.strip() in self._hinted:
+            check["decision"] = "allow_after_hint"
+        else:
+            check["decision"] = "hint"
+            self._hinted.add(sql.strip())
+            message = (
+                "Query plan check: " + self._explain(check)
+                + "\nRewrite the query if possible, or submit the same query unchanged to run it anyway."
+            )
+        if self.on_decision is not None:
+            try:
+                self.on_decision(check)
+            except Exception as e:
+                print(f"Pre-flight logging failed: {e}")
+        return message
+
+    def _explain(self, check):
+        lines = [f"{i['kind']} on {i['table'] or 'result'} ({i['detail']})" for i in check["issues"]]
+        parts = ["Expensive plan: " + "; ".join(lines), "Plan:\n" + format_plan(check["plan"])]
+        if check["suggested_indexes"]:
+            parts.append(
+                "Join or filter on indexed columns (every table is keyed by UNITID); "
+                "missing indexes: " + ", ".join(f"{t}({c})" for t, c in check["suggested_indexes"])
+            )
+        return "\n".join(parts)
@@ -0,0 +1,272 @@
+"""
+Persistent log of agent questions and the SQL they ran, plus a workload analyzer.
+
+The log is a local SQLite database separate from schools.db (QUERY_LOG_PATH,
+default query_log.db) with one row per question and one row per executed
+statement. Run the analyzer with:
+
+    python query_log.py [--log query_log.db] [--db schools.db] [--top 10]
+
+It reports the hottest tables and columns, the slowest statements with their
+EXPLAIN QUERY PLAN, full-scan offenders and suggested indexes.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from query_plan import explain_query_plan, plan_scans, format_plan
+
+QUERY_LOG_PATH = os.environ.get("QUERY_LOG_PATH", "query_log.db")
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT NOT NULL, session TEXT,
+        question TEXT NOT NULL, retrieved_tables TEXT, model TEXT,
+        ok INTEGER, elapsed_ms REAL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS statements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, question_id INTEGER, ts TEXT NOT NULL,
+        sql TEXT NOT NULL, row_count INTEGER, elapsed_ms REAL, ok INTEGER NOT NULL, error TEXT,
+        FOREIGN KEY (question_id) REFERENCES questions(id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS plans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, question_id INTEGER, ts TEXT NOT NULL,
+        sql TEXT NOT NULL, plan TEXT, issues TEXT, decision TEXT,
+        FOREIGN KEY (question_id) REFERENCES questions(id)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_statements_question ON statements(question_id);",
+]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class QueryLog:
+    """Append-only question/statement log; safe to share between threads."""
+
+    def __init__(self, path=QUERY_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            for stmt in _SCHEMA:
+                conn.execute(stmt)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _write(self, sql, params):
+        with self._lock:
+            conn = self._connect()
+            try:
+                cur = conn.execute(sql, params)
+                conn.commit()
+                return cur.lastrowid
+            finally:
+                conn.close()
+
+    def start_question(self, question, retrieved_tables, session=None, model=None):
+        return self._write(
+            "INSERT INTO questions (ts, session, question, retrieved_tables, model) VALUES (?, ?, ?, ?, ?)",
+            (_now(), session, question, json.dumps(list(retrieved_tables)), model),
+        )
+
+    def log_statement(self, question_id, record):
+        """Log a statement record as produced by sql_tools.run_query."""
+        return self._write(
+            "INSERT INTO statements (question_id, ts, sql, row_count, elapsed_ms, ok, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (question_id, _now(), record["sql"], record.get("row_count"),
+             record.get("elapsed_ms"), int(bool(record.get("ok"))), record.get("error")),
+        )
+
+    def log_plan(self, question_id, check):
+        """Log a pre-flight plan check (see preflight.Preflight.analyze) and its decision."""
+        plan = "\n".join(row["detail"] for row in check.get("plan") or [])
+        return self._write(
+            "INSERT INTO plans (question_id, ts, sql, plan, issues, decision) VALUES (?, ?, ?, ?, ?, ?)",
+            (question_id, _now(), check["sql"], plan, json.dumps(check.get("issues", [])),
+             check.get("decision")),
+        )
+
+    def finish_question(self, question_id, ok, elapsed_ms):
+        self._write(
+            "UPDATE questions SET ok = ?, elapsed_ms = ? WHERE id = ?",
+            (int(bool(ok)), elapsed_ms, question_id),
+        )
+
+
+_query_log = None
+_query_log_lock = threading.Lock()
+
+
+def get_query_log():
+    """Process-wide QueryLog instance."""
+    global _query_log
+    with _query_log_lock:
+        if _query_log is None:
+            _query_log = QueryLog()
+        return _query_log
+
+
+# -------------------------
+# Workload analyzer
+# -------------------------
+_FILTER_RE = r"\b{col}\b\s*(=|<|>|<=|>=|!=|<>|\bLIKE\b|\bIN\b|\bBETWEEN\b|\bIS\b)"
+
+
+def normalize_sql(sql):
+    """Collapse literals and whitespace so statements differing only in constants group together."""
+    s = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    s = re.sub(r"\b\d+(?:\.\d+)?\b", "?", s)
+    return re.sub(r"\s+", " ", s).strip().rstrip(";").lower()
+
+
+def load_catalog(db_path):
+    """{table: [columns]} for the analysed database."""
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        return {t: [c[1] for c in conn.execute(f'PRAGMA table_info("{t}")')] for t in tables}
+    finally:
+        conn.close()
+
+
+def load_indexed_columns(conn):
+    """{(table, column)} for columns that already lead an index (including primary keys)."""
+    indexed = set()
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    for table in tables:
+        for idx in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            first = conn.execute(f'PRAGMA index_info("{idx[1]}")').fetchone()
+            if first:
+                indexed.add((table, first[2]))
+        for col in conn.execute(f'PRAGMA table_info("{table}")'):
+            if col[5] == 1:
+                indexed.add((table, col[1]))
+    return indexed
+
+
+def referenced(sql, names):
+    return [n for n in names if re.search(rf"\b{re.escape(n)}\b", sql, re.IGNORECASE)]
+
+
+def filter_columns(sql, columns):
+    """Columns compared in WHERE / JOIN ON predicates or used for ORDER BY."""
+    found = [c for c in columns if re.search(_FILTER_RE.format(col=re.escape(c)), sql, re.IGNORECASE)]
+    order = re.search(r"\bORDER BY\b(.*?)(\bLIMIT\b|$)", sql, re.IGNORECASE | re.DOTALL)
+    if order:
+        found += [c for c in referenced(order.group(1), columns) if c not in found]
+    return found
+
+
+def analyze(log_path, db_path, top=10):
+    """Build the workload report as a dict (see print_report for the layout)."""
+    catalog = load_catalog(db_path)
+    log = sqlite3.connect(log_path)
+    statements = log.execute(
+        "SELECT sql, elapsed_ms, row_count, ok FROM statements"
+    ).fetchall()
+    log.close()
+
+    table_hits, column_hits = {}, {}
+    groups = {}
+    for sql, elapsed_ms, row_count, ok in statements:
+        for table in referenced(sql, catalog):
+            table_hits[table] = table_hits.get(table, 0) + 1
+            for col in referenced(sql, catalog[table]):
+                key = f"{table}.{col}"
+                column_hits[key] = column_hits.get(key, 0) + 1
+        if not ok:
+            continue
+        g = groups.setdefault(normalize_sql(sql), {"sql": sql, "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        g["count"] += 1
+        g["total_ms"] += elapsed_ms or 0.0
+        g["max_ms"] = max(g["max_ms"], elapsed_ms or 0.0)
+
+    db = sqlite3.connect(db_path)
+    slowest, offenders, suggestions = [], [], {}
+    try:
+        indexed = load_indexed_columns(db)
+        for g in groups.values():
+            try:
+                g["plan"] = explain_query_plan(db, g["sql"])
+            except sqlite3.Error as e:
+                g["plan"] = [{"id": 0, "parent": 0, "detail": f"(plan unavailable: {e})"}]
+            g["avg_ms"] = g["total_ms"] / g["count"]
+            scans = [s for s in plan_scans(g["plan"], g["sql"]) if not s["covering"]]
+            if scans:
+                offenders.append({**g, "scans": [s["table"] for s in scans]})
+            for s in scans:
+                for col in filter_columns(g["sql"], catalog.get(s["table"], [])):
+                    key = (s["table"], col)
+                    if key in indexed:
+                        continue
+                    sug = suggestions.setdefault(key, {"table": s["table"], "column": col, "statements": 0, "cost_ms": 0.0})
+                    sug["statements"] += g["count"]
+                    sug["cost_ms"] += g["total_ms"]
+        slowest = sorted(groups.values(), key=lambda g: g["max_ms"], reverse=True)[:top]
+    finally:
+        db.close()
+
+    log = sqlite3.connect(log_path)
+    decisions = log.execute(
+        "SELECT decision, COUNT(*) FROM plans GROUP BY decision ORDER BY COUNT(*) DESC"
+    ).fetchall()
+    log.close()
+
+    return {
+        "statements": len(statements),
+        "preflight_decisions": decisions,
+        "hot_tables": sorted(table_hits.items(), key=lambda kv: -kv[1])[:top],
+        "hot_columns": sorted(column_hits.items(), key=lambda kv: -kv[1])[:top],
+        "slowest": slowest,
+        "full_scans": sorted(offenders, key=lambda g: g["total_ms"], reverse=True)[:top],
+        "suggested_indexes": sorted(suggestions.values(), key=lambda s: s["cost_ms"], reverse=True)[:top],
+    }
+
+
+def print_report(report):
+    print(f"Statements logged: {report['statements']}\n")
+    print("Hottest tables:")
+    for table, n in report["hot_tables"]:
+        print(f"  {n:6d}  {table}")
+    print("\nHottest columns:")
+    for col, n in report["hot_columns"]:
+        print(f"  {n:6d}  {col}")
+    print("\nSlowest statements:")
+    for g in report["slowest"]:
+        print(f"  max {g['max_ms']:.1f} ms, avg {g['avg_ms']:.1f} ms, x{g['count']}: {g['sql']}")
+        for line in format_plan(g["plan"]).splitlines():
+            print(f"      {line}")
+    print("\nFull-scan offenders:")
+    for g in report["full_scans"]:
+        print(f"  {g['total_ms']:.1f} ms total, x{g['count']}, scans {', '.join(g['scans'])}: {g['sql']}")
+    print("\nPre-flight decisions:")
+    for decision, n in report["preflight_decisions"]:
+        print(f"  {n:6d}  {decision}")
+    print("\nSuggested indexes:")
+    for s in report["suggested_indexes"]:
+        print(
+            f"  CREATE INDEX IF NOT EXISTS idx_{s['table']}_{s['column']} ON {s['table']}({s['column']});"
+            f"  -- {s['statements']} statements, {s['cost_ms']:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the agent query log")
+    parser.add_argument("--log", default=QUERY_LOG_PATH, help="query log database")
+    parser.add_argument("--db", default="schools.db", help="database the statements ran against")
+    parser.add_argument("--top", type=int, default=10, help="rows per section")
+    args = parser.parse_args()
+    print_report(analyze(args.log, args.db, args.top))
@@ -0,0 +1,86 @@
+"""
+Helpers for SQLite EXPLAIN QUERY PLAN output.
+"""
+import re
+
+# "SCAN school_costs", "SCAN school_costs AS c", "SCAN c USING COVERING INDEX ..."
+_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$")
+_SEARCH_RE = re.compile(r"^SEARCH (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$")
+
+
+_FROM_RE = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE)
+_NOT_ALIAS = {
+    "where", "on", "using", "join", "inner", "left", "right", "full", "outer", "cross",
+    "natural", "group", "order", "limit", "having", "union", "except", "intersect", "window",
+}
+
+
+def table_aliases(sql):
+    """Map aliases (and bare table names) used in FROM / JOIN clauses to table names."""
+    aliases = {}
+    for table, alias in _FROM_RE.findall(sql or ""):
+        aliases[table] = table
+        if alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias] = table
+    return aliases
+
+
+def explain_query_plan(conn, sql):
+    """
+    Return the plan as [{"id", "parent", "detail"}] for a DB-API or SQLAlchemy connection.
+    Raises the driver's error when the statement does not compile.
+    """
+    # SQLAlchemy connections take raw SQL through exec_driver_sql, DB-API ones through execute
+    run = getattr(conn, "exec_driver_sql", None) or conn.execute
+    rows = run(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [{"id": r[0], "parent": r[1], "detail": r[-1]} for r in rows]
+
+
+def plan_scans(plan, sql=None):
+    """
+    Full table scans in a plan: [{"id", "parent", "table", "alias", "covering", "detail"}].
+    Scans using a covering index still read every index entry and are flagged as covering.
+    Recent SQLite versions print only the alias of aliased tables; pass sql to resolve it.
+    """
+    aliases = table_aliases(sql)
+    scans = []
+    for row in plan:
+        m = _SCAN_RE.match(row["detail"])
+        if not m or m.group(1).upper() == "CONSTANT":
+            continue
+        rest = m.group(3) or ""
+        name = m.group(1)
+        scans.append({
+            "id": row["id"],
+            "parent": row["parent"],
+            "table": aliases.get(name, name),
+            "alias": m.group(2) or (name if aliases.get(name, name) != name else None),
+            "covering": "COVERING INDEX" in rest,
+            "detail": row["detail"],
+        })
+    return scans
+
+
+def plan_tables(plan, sql=None):
+    """Tables touched by SCAN or SEARCH steps, in plan order."""
+    aliases = table_aliases(sql)
+    tables = []
+    for row in plan:
+        m = _SCAN_RE.match(row["detail"]) or _SEARCH_RE.match(row["detail"])
+        if not m or m.group(1).upper() == "CONSTANT":
+            continue
+        table = aliases.get(m.group(1), m.group(1))
+        if table not in tables:
+            tables.append(table)
+    return tables
+
+
+def format_plan(plan):
+    """Indented text rendering of a plan, like the sqlite3 shell's .eqp output."""
+    depth = {0: -1}
+    lines = []
+    for row in plan:
+        level = depth.get(row["parent"], -1) + 1
+        depth[row["id"]] = level
+        lines.append("  " * level + row["detail"])
+    return "\n".join(lines)
@@ -0,0 +1,135 @@
+"""
+On-disk cache of reflected schema metadata and rendered table info.
+
+SQLDatabase(engine) reflects every table when it is built, and each
+get_table_info([table]) renders the DDL again and runs a sample-rows SELECT.
+The database only changes when a new file is downloaded, so both are cached
+under SCHEMA_CACHE_DIR keyed by the database's SHA-256:
+- the reflected sqlalchemy MetaData (pickled)
+- the get_table_info() string of every table, sample rows included
+
+cached_sql_database() returns a CachedSQLDatabase constructed with the cached
+MetaData and lazy_table_reflection=True, so nothing is reflected up front;
+tables missing from the cache are reflected and rendered on first use and
+written back with save().
+"""
+import os
+import pickle
+import threading
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import MetaData
+
+from db_fetch import file_sha256, load_meta
+
+SCHEMA_CACHE_DIR = os.environ.get("SCHEMA_CACHE_DIR", ".schema_cache")
+# Bump when the cached format or the rendering of table info changes
+CACHE_VERSION = 1
+
+# (path, size, mtime_ns) -> sha256, so a file is hashed at most once per process
+_hashes = {}
+# sha256 -> {"metadata", "table_info", "lock"} shared by the sessions of this process
+_loaded = {}
+_lock = threading.Lock()
+
+
+def db_content_hash(path):
+    """SHA-256 of a database file, taken from the download manifest when it still matches."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        if key in _hashes:
+            return _hashes[key]
+    meta = load_meta(path)
+    if meta.get("sha256") and meta.get("size") == st.st_size:
+        digest = meta["sha256"]
+    else:
+        digest = file_sha256(path)
+    with _lock:
+        _hashes[key] = digest
+    return digest
+
+
+def _cache_file(digest, cache_dir):
+    return os.path.join(cache_dir, f"schema-{digest[:24]}.pickle")
+
+
+def load_entry(digest, cache_dir=SCHEMA_CACHE_DIR):
+    """Cached {"metadata", "table_info", "lock"} for a database hash (empty if not cached yet)."""
+    with _lock:
+        if digest in _loaded:
+            return _loaded[digest]
+    entry = None
+    try:
+        with open(_cache_file(digest, cache_dir), "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") == CACHE_VERSION and data.get("sha256") == digest:
+            entry = {"metadata": data["metadata"], "table_info": data["table_info"], "lock": threading.Lock()}
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Ignoring unreadable schema cache: {e}")
+    if entry is None:
+        entry = {"metadata": MetaData(), "table_info": {}, "lock": threading.Lock()}
+    with _lock:
+        return _loaded.setdefault(digest, entry)
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase whose get_table_info() is served from a per-table cache.
+    Missing tables are reflected lazily by SQLDatabase and rendered once.
+    """
+
+    def __init__(self, engine, entry, digest=None, cache_dir=SCHEMA_CACHE_DIR, **kwargs):
+        super().__init__(engine, metadata=entry["metadata"], lazy_table_reflection=True, **kwargs)
+        self._table_info_cache = entry["table_info"]
+        self._digest = digest
+        self._cache_dir = cache_dir
+        self._dirty = False
+        # Shared with every instance using the same entry: reflection mutates the MetaData
+        self._cache_lock = entry["lock"]
+
+    def get_table_info(self, table_names=None, get_col_comments=False):
+        if get_col_comments:
+            return super().get_table_info(table_names, get_col_comments)
+        names = list(table_names) if table_names is not None else sorted(self.get_usable_table_names())
+        missing = [t for t in names if t not in self._table_info_cache]
+        if missing:
+            # Validates the names and reflects what the metadata lacks, like the base class
+            with self._cache_lock:
+                for table in missing:
+                    self._table_info_cache[table] = super().get_table_info([table])
+                self._dirty = True
+        return "\n\n".join(self._table_info_cache[t] for t in names)
+
+    def save(self):
+        """Write the metadata and table info to disk if anything new was rendered."""
+        if not (self._dirty and self._digest):
+            return False
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = _cache_file(self._digest, self._cache_dir)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with self._cache_lock:
+            data = {
+                "version": CACHE_VERSION,
+                "sha256": self._digest,
+                "metadata": self._metadata,
+                "table_info": dict(self._table_info_cache),
+            }
+            with open(tmp, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            self._dirty = False
+        # Entries of earlier downloads are never read again
+        for name in os.listdir(self._cache_dir):
+            stale = os.path.join(self._cache_dir, name)
+            if name.startswith("schema-") and name.endswith(".pickle") and stale != path:
+                os.remove(stale)
+        return True
+
+
+def cached_sql_database(engine, db_path, cache_dir=SCHEMA_CACHE_DIR, **kwargs):
+    """CachedSQLDatabase for the database file at db_path."""
+    digest = db_content_hash(db_path)
+    return CachedSQLDatabase(engine, load_entry(digest, cache_dir), digest=digest, cache_dir=cache_dir, **kwargs)
@@ -0,0 +1,213 @@
+"""
+Schema retrieval indexes for the SQL agent.
+
+Two FAISS indexes are built over the database schema:
+- a table index, one document per table (DDL, sample rows and column descriptions)
+- a column index, one document per column from schema_information
+
+The column index gives sharper matches for questions about a single field,
+and its scores are aggregated per table to rank tables and prune the column
+list that goes into the prompt.
+"""
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from sqlalchemy import text
+
+# Join key present in every school_* table; always kept in pruned column lists
+KEY_COLUMN = "UNITID"
+
+# Helper tables excluded from user-facing operations
+HELPER_TABLES = {"schema_information", "column_values"}
+
+
+def load_schema_info(engine):
+    """
+    Read schema_information into {table: [column dict, ...]}.
+    Each column dict has column, data_type, description and group keys.
+    """
+    info = {}
+    try:
+        with engine.connect() as conn:
+            res = conn.execute(
+                text(
+                    "SELECT table_name, column_name, data_type, description, group_category "
+                    "FROM schema_information"
+                )
+            )
+            for table_name, column_name, data_type, description, group in res:
+                info.setdefault(table_name, []).append({
+                    "column": column_name,
+                    "data_type": data_type,
+                    "description": description,
+                    "group": group,
+                })
+    except Exception:
+        # If table doesn't exist or is unreadable, silently fallback
+        pass
+    return info
+
+
+def create_schema_documents(db, usable_tables, schema_info, warn=print):
+    """Create one document per table, enriched with column descriptions."""
+    docs = []
+    for table in usable_tables:
+        try:
+            table_info = db.get_table_info([table])
+            desc_lines = ""
+            if table in schema_info:
+                parts = [
+                    f"- {c['column']}: {c['description']}"
+                    for c in schema_info[table] if c["description"]
+                ]
+                if parts:
+                    desc_lines = "Column descriptions:\n" + "\n".join(parts)
+
+            content_parts = [f"Table: {table}", table_info]
+            if desc_lines:
+                content_parts.append(desc_lines)
+            page_content = "\n\n".join(content_parts)
+
+            doc = Document(
+                page_content=page_content,
+                metadata={"table_name": table, "type": "schema"}
+            )
+            docs.append(doc)
+        except Exception as e:
+            warn(f"Could not process table {table}: {e}")
+            continue
+    return docs
+
+
+def create_column_documents(usable_tables, schema_info):
+    """Create one short document per column so each vector stays focused."""
+    docs = []
+    for table in usable_tables:
+        for c in schema_info.get(table, []):
+            page_content = "\n".join([
+                f"Column: {c['column']}",
+                f"Description: {c['description']}",
+                f"Category: {c['group']}",
+                f"Table: {table}",
+            ])
+            docs.append(Document(
+                page_content=page_content,
+                metadata={
+                    "table_name": table,
+                    "column_name": c["column"],
+                    "data_type": c["data_type"],
+                    "description": c["description"],
+                    "group_category": c["group"],
+                    "type": "column",
+                },
+            ))
+    return docs
+
+
+def build_column_index(usable_tables, schema_info, embeddings, extra_docs=None):
+    """
+    Build the column-level FAISS index, or None if there is nothing to index.
+    extra_docs (e.g. categorical value documents) are indexed alongside the columns.
+    """
+    docs = create_column_documents(usable_tables, schema_info) + list(extra_docs or [])
+    if not docs:
+        return None
+    return FAISS.from_documents(docs, embeddings)
+
+
+def search_with_relevance(vectorstore, query, k, embedding=None):
+    """
+    Similarity search returning (doc, relevance) pairs.
+    When the query embedding is already known it is reused instead of re-embedding.
+    """
+    if embedding is None:
+        return vectorstore.similarity_search_with_relevance_scores(query, k=k)
+    relevance_fn = vectorstore._select_relevance_score_fn()
+    return [
+        (doc, relevance_fn(distance))
+        for doc, distance in vectorstore.similarity_search_with_score_by_vector(embedding, k=k)
+    ]
+
+
+def rank_tables_by_columns(column_index, query, k_tables=3, k_columns=40,
+                           max_columns_per_table=8, column_ratio=0.8, embedding=None):
+    """
+    Rank tables by aggregating the scores of their best matching columns.
+
+    A table scores top1 + top2/2 + top3/4 over its column matches, so tables
+    with several relevant columns rank higher without wide tables dominating.
+    Columns scoring at least column_ratio of the table's best column are kept.
+
+    Returns [{"table", "score", "columns": [metadata dict, ...]}], best first.
+    """
+    if column_index is None:
+        return []
+    hits = search_with_relevance(column_index, query, k_columns, embedding=embedding)
+    return aggregate_column_hits(hits, k_tables, max_columns_per_table, column_ratio)
+
+
+def aggregate_column_hits(hits, k_tables=3, max_columns_per_table=8, column_ratio=0.8):
+    """Aggregate (column doc, score) pairs into the ranked table list described above."""
+
+    # A column can match through its column doc and its values doc; keep its best score
+    best_hits = {}
+    for doc, score in hits:
+        if doc.metadata.get("type") not in ("column", "values"):
+            continue
+        key = (doc.metadata["table_name"], doc.metadata["column_name"])
+        if key not in best_hits or score > best_hits[key][0]:
+            best_hits[key] = (score, doc.metadata)
+
+    by_table = {}
+    for (table, _), match in best_hits.items():
+        by_table.setdefault(table, []).append(match)
+
+    ranked = []
+    for table, matches in by_table.items():
+        matches.sort(key=lambda m: m[0], reverse=True)
+        scores = [s for s, _ in matches[:3]]
+        table_score = sum(s / (2 ** i) for i, s in enumerate(scores))
+        best = scores[0]
+        # Non-normalised embedders can yield negative relevance; keep the best column then
+        threshold = best * column_ratio if best > 0 else best
+        columns = [
+            meta for s, meta in matches
+            if s >= threshold
+        ][:max_columns_per_table]
+        ranked.append({"table": table, "score": table_score, "columns": columns})
+
+    ranked.sort(key=lambda r: r["score"], reverse=True)
+    return ranked[:k_tables]
+
+
+def fuse_rankings(*rankings, k=60, limit=3, weights=None):
+    """Reciprocal rank fusion of several ranked table-name lists, optionally weighted."""
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, table in enumerate(ranking):
+            scores[table] = scores.get(table, 0.0) + weight / (k + rank + 1)
+    fused = sorted(scores, key=lambda t: scores[t], reverse=True)
+    return fused[:limit]
+
+
+def format_pruned_columns(ranked_tables, tables):
+    """
+    Render the pruned column list for the given tables as prompt text.
+    Tables without column matches are listed by name only.
+    """
+    columns_by_table = {r["table"]: r["columns"] for r in ranked_tables}
+    lines = []
+    for table in tables:
+        columns = columns_by_table.get(table, [])
+        if not columns:
+            lines.append(f"- {table}")
+            continue
+        parts = [f"{KEY_COLUMN} (join key)"] if all(
+            c["column_name"] != KEY_COLUMN for c in columns
+        ) else []
+        parts += [
+            f"{c['column_name']} {c['data_type']}: {c['description']}"
+            for c in columns
+        ]
+        lines.append(f"- {table}: " + "; ".join(parts))
+    return "\n".join(lines)
@@ -0,0 +1,170 @@
+"""
+Process-wide registry of UI sessions: per-session engines, memory accounting
+and idle eviction.
+
+Streamlit keeps st.session_state for as long as a tab stays connected, so
+objects parked there are never released while a user leaves a tab open.
+Sessions keep only light state in st.session_state (messages, the history
+summary, usage totals); their AgentEngine, with its SQLite connection and
+template matcher, lives here keyed by session id:
+- touch() on every rerun records activity and the session's memory accounting
+- engine() returns the session's engine, or None when one has to be built
+- a sweeper thread drops the engines of sessions idle past SESSION_IDLE_TTL
+  (closing their connections); a returning session builds a new one from the
+  warm-up's shared resources, and sessions gone for twice the TTL are forgotten
+- snapshot() and process_memory() feed the admin view
+"""
+import os
+import resource
+import sys
+import threading
+import time
+
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL_SECONDS", "1800"))
+SWEEP_SECONDS = 60
+
+
+def deep_size(obj, seen=None):
+    """Approximate bytes held by obj and the containers and strings it references."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+def message_bytes(message):
+    """Size of a chat message, computed once and kept on the message ("bytes")."""
+    if "bytes" not in message:
+        message["bytes"] = deep_size(message)
+    return message["bytes"]
+
+
+def process_memory():
+    """Current and peak resident memory of the process in MB."""
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        rss = peak
+    return {"rss_mb": round(rss, 1), "peak_rss_mb": round(peak, 1), "threads": threading.active_count()}
+
+
+class SessionRegistry:
+    """Sessions of this process: {session_id: entry}; entries are plain dicts."""
+
+    def __init__(self, idle_ttl=SESSION_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self.sessions = {}
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def touch(self, session_id, user="", messages=(), busy=False):
+        """Record a rerun of session_id with its current messages; busy: a run is in flight."""
+        accounted = [message_bytes(m) for m in messages]
+        result_rows = sum(len(m["result"]["rows"]) for m in messages if "result" in m)
+        with self._lock:
+            entry = self.sessions.setdefault(session_id, {
+                "session_id": session_id,
+                "created": time.time(),
+                "engine": None,
+                "evictions": 0,
+            })
+            entry.update(
+                user=user,
+                last_seen=time.time(),
+                busy=busy,
+                messages=len(accounted),
+                message_bytes=sum(accounted),
+                result_rows=result_rows,
+            )
+        self._start_sweeper()
+
+    def engine(self, session_id):
+        with self._lock:
+            entry = self.sessions.get(session_id)
+            return entry["engine"] if entry else None
+
+    def set_engine(self, session_id, engine):
+        with self._lock:
+            self.sessions.setdefault(session_id, {
+                "session_id": session_id, "created": time.time(), "last_seen": time.time(),
+                "evictions": 0, "busy": False,
+            })["engine"] = engine
+
+    def drop(self, session_id):
+        """Forget a session (sign-out), closing its connection."""
+        with self._lock:
+            entry = self.sessions.pop(session_id, None)
+        if entry and entry.get("engine") is not None:
+            entry["engine"].sql_engine.dispose()
+
+    def sweep(self, now=None):
+        """Evict engines of idle sessions and forget long-gone ones; returns sessions evicted."""
+        now = now or time.time()
+        released = []
+        with self._lock:
+            for session_id, entry in list(self.sessions.items()):
+                idle = now - entry.get("last_seen", now)
+                if idle > 2 * self.idle_ttl:
+                    released.append(self.sessions.pop(session_id).get("engine"))
+                elif idle > self.idle_ttl and not entry.get("busy") and entry.get("engine") is not None:
+                    released.append(entry["engine"])
+                    entry["engine"] = None
+                    entry["evictions"] += 1
+        engines = [e for e in released if e is not None]
+        for engine in engines:
+            # Closes the session's SQLite connection (and its page cache)
+            engine.sql_engine.dispose()
+        with self._lock:
+            self.evicted += len(engines)
+        return len(engines)
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(SWEEP_SECONDS)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Session sweep failed: {e}")
+
+    def snapshot(self):
+        """Per-session accounting, most recently active first."""
+        now = time.time()
+        with self._lock:
+            rows = [
+                {
+                    "session": e["session_id"][:8],
+                    "user": e.get("user", ""),
+                    "idle_s": round(now - e.get("last_seen", now)),
+                    "messages": e.get("messages", 0),
+                    "history_kb": round(e.get("message_bytes", 0) / 1024, 1),
+                    "result_rows": e.get("result_rows", 0),
+                    "engine": "loaded" if e.get("engine") is not None else "evicted",
+                    "evictions": e["evictions"],
+                }
+                for e in self.sessions.values()
+            ]
+        return sorted(rows, key=lambda r: r["idle_s"])
+
+
+_registry = SessionRegistry()
+
+
+def get_registry():
+    return _registry
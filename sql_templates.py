@@ -0,0 +1,456 @@
+"""
+SQL template fast path for common parametric questions.
+
+IntentMatcher maps a question to one of a few vetted, parametrised SQL
+templates and runs it without the LLM:
+- top_n:  top / bottom N institutions by a numeric field, optionally filtered
+          by state, control or region
+- lookup: one institution's value for a named field
+- count:  number of institutions, optionally filtered and grouped by a
+          categorical field
+
+Fields are resolved with the column index (schema_information descriptions,
+embedding search), filters and group-by columns with the categorical value
+dictionary. Identifiers in the SQL only ever come from the catalog; values are
+bound parameters. A match carries a confidence; below min_confidence, when
+any part of the question is left unexplained (a top-N measure phrase must be
+explained word by word by the resolved column), or when the question negates
+(not, excluding, except, without, other than), the question goes to the agent.
+
+Hit rate and latency of the template path against the agent path are
+collected per process (get_stats()).
+"""
+import re
+import threading
+from collections import deque
+
+from sqlalchemy import text
+
+from schema_index import KEY_COLUMN, search_with_relevance
+from sql_tools import run_query
+from value_dictionary import CODE_LABELS, label_for
+
+MAIN_TABLE = "school_main"
+NAME_COLUMN = "INSTNM"
+
+# Relevance the resolved field needs for a template to be trusted
+MIN_CONFIDENCE = 0.4
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+# Institution name matches accepted for a lookup (more goes to the agent)
+MAX_NAME_MATCHES = 5
+
+NUMERIC_TYPES = {"INTEGER", "BIGINT", "INT", "REAL", "DOUBLE", "FLOAT", "NUMERIC", "DECIMAL"}
+
+_ENTITY_WORDS = {"school", "schools", "college", "colleges", "university", "universities",
+                 "institution", "institutions"}
+_DESC_WORDS = {"top", "highest", "largest", "most", "biggest", "maximum", "greatest", "priciest"}
+_ASC_WORDS = {"lowest", "cheapest", "least", "smallest", "fewest", "bottom", "minimum"}
+_COUNT_RE = re.compile(r"^(?:how many|number of|count(?: of)?)\b")
+_LOOKUP_RE = re.compile(r"^what(?:'s| is| was| are)\s+(?:the\s+)?(?P<field>.+?)\s+(?:of|for|at)\s+(?P<name>.+)$")
+_GROUP_RE = re.compile(r"\b(?:grouped by|broken down by|by|per|for each|in each|each)\s+(?P<group>[a-z][a-z ]*)$")
+# Exclusions no template expresses ("non-profit" is a filter phrase, not a negation)
+_NEGATION_RE = re.compile(r"\b(?:not|no|excluding|exclude|excludes|except|without|other than|outside|"
+                          r"isn't|aren't|doesn't|don't)\b")
+# "most colleges": ranking groups by how many institutions they have
+_COUNT_RANK_RE = re.compile(r"\b(?:most|fewest|least)\s+(?:schools|colleges|universities|institutions)\b")
+# A column has to be found again from each measure word on its own within this many columns
+MAX_WORD_RANK = 5
+# Question words -> the word the Scorecard descriptions use
+_MEASURE_WORDS = {"two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7", "eight": "8",
+                  "ten": "10", "graduation": "completion", "graduate": "completion", "expensive": "cost",
+                  "pricey": "cost", "income": "earnings", "salaries": "earnings", "salary": "earnings"}
+# References to earlier turns need the agent and its history
+_ANAPHORA = {"those", "these", "them", "they", "same", "previous", "above", "ones"}
+_FILLER = {"the", "a", "an", "of", "in", "by", "with", "for", "at", "and", "or", "which", "what",
+           "are", "is", "there", "show", "me", "list", "give", "find", "get", "have", "has",
+           "their", "its", "all", "to", "on", "located", "based", "that", "total", "do", "does"}
+
+# Filters on school_main: phrase -> values of the coded column
+_CONTROL_PHRASES = {
+    "private nonprofit": [2], "private non-profit": [2], "nonprofit": [2], "non-profit": [2],
+    "private for-profit": [3], "for-profit": [3], "for profit": [3], "proprietary": [3],
+    "public": [1], "private": [2, 3],
+}
+_GROUP_SYNONYMS = {"state": "STABBR", "states": "STABBR", "control": "CONTROL", "sector": "CONTROL",
+                   "type": "CONTROL", "region": "REGION", "regions": "REGION", "locale": "LOCALE"}
+
+
+def _words(s):
+    return re.findall(r"[a-z0-9][a-z0-9_'-]*", s.lower())
+
+
+def _q(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def numeric_predicate(ref):
+    """SQL true when ref holds a number; many Scorecard measures are VARCHAR with text markers."""
+    return f"({ref} <> '' AND TRIM({ref}, '0123456789.+-eE') = '')"
+
+
+class IntentMatcher:
+    """
+    Match questions to SQL templates.
+    schema_info / value_dictionary as loaded by schema_index / value_dictionary;
+    column_index is the FAISS column index from schema_index.build_column_index.
+    """
+
+    def __init__(self, engine, schema_info, value_dictionary, column_index,
+                 min_confidence=MIN_CONFIDENCE, k_columns=40):
+        self.engine = engine
+        self.schema_info = schema_info
+        self.column_index = column_index
+        self.min_confidence = min_confidence
+        self.k_columns = k_columns
+        self.columns = {
+            (table, c["column"]): c for table, cols in schema_info.items() for c in cols
+        }
+        self.categorical = {
+            (table, column) for table, cols in value_dictionary.items() for column in cols
+        }
+        self.filters = self._filter_phrases(value_dictionary.get(MAIN_TABLE, {}))
+        self._numeric = {}
+        self._vocabulary = {}
+        self._lock = threading.Lock()
+
+    def _filter_phrases(self, main_values):
+        """[(phrase, column, values, label)] for the filter columns present in the dictionary, longest first."""
+        phrases = []
+        if "STABBR" in main_values:
+            present = {str(v) for v, _, _ in main_values["STABBR"]}
+            for code, state in CODE_LABELS["STABBR"].items():
+                if code in present:
+                    phrases.append((state.lower(), "STABBR", [code], state))
+        if "CONTROL" in main_values:
+            for phrase, values in _CONTROL_PHRASES.items():
+                label = " or ".join(CODE_LABELS["CONTROL"][v] for v in values)
+                phrases.append((phrase, "CONTROL", values, label))
+        if "REGION" in main_values:
+            for code, label in CODE_LABELS["REGION"].items():
+                name = label.split(" (")[0]
+                phrases.append((name.lower(), "REGION", [code], name))
+        return sorted(phrases, key=lambda p: -len(p[0]))
+
+    # -------------------------
+    # Question parsing
+    # -------------------------
+    def _extract_filters(self, question):
+        """Return ({column: [values]}, [labels], question with filter phrases removed)."""
+        found, labels = {}, []
+        rest = question.lower()
+        for phrase, column, values, label in self.filters:
+            pattern = rf"\b{re.escape(phrase)}\b"
+            if re.search(pattern, rest):
+                rest = re.sub(pattern, " ", rest)
+                found.setdefault(column, [])
+                found[column] += [v for v in values if v not in found[column]]
+                labels.append(label)
+        # Upper-case state codes ("in CA"), only as written in the original question
+        if any(p[1] == "STABBR" for p in self.filters):
+            codes = {p[2][0] for p in self.filters if p[1] == "STABBR"}
+            for code in re.findall(r"\b([A-Z]{2})\b", question):
+                if code in codes and code not in found.get("STABBR", []):
+                    found.setdefault("STABBR", []).append(code)
+                    labels.append(CODE_LABELS["STABBR"][code])
+                    rest = re.sub(rf"\b{code.lower()}\b", " ", rest)
+        return found, labels, rest
+
+    def _leftover(self, text_, extra=()):
+        """Words of the question not explained by the template."""
+        skip = _FILLER | _ENTITY_WORDS | _DESC_WORDS | _ASC_WORDS | set(extra)
+        return [w for w in _words(text_) if w not in skip and not w.isdigit()]
+
+    def _is_numeric(self, table, column):
+        key = (table, column)
+        with self._lock:
+            if key in self._numeric:
+                return self._numeric[key]
+        data_type = (self.columns.get(key, {}).get("data_type") or "").upper()
+        if data_type in NUMERIC_TYPES:
+            numeric = True
+        else:
+            sample = (
+                f"SELECT COUNT(*), SUM({numeric_predicate('c')}) FROM "
+                f"(SELECT {_q(column)} AS c FROM {_q(table)} WHERE {_q(column)} IS NOT NULL LIMIT 200)"
+            )
+            try:
+                with self.engine.connect() as conn:
+                    total, hits = conn.execute(text(sample)).fetchone()
+                numeric = bool(total) and (hits or 0) / total >= 0.5
+            except Exception:
+                numeric = False
+        with self._lock:
+            self._numeric[key] = numeric
+        return numeric
+
+    def _resolve_column(self, phrase, accept):
+        """Best (table, column, score) among columns accepted by accept(table, column), or None."""
+        if not phrase.strip() or self.column_index is None:
+            return None
+        for doc, score in search_with_relevance(self.column_index, phrase, self.k_columns):
+            md = doc.metadata
+            if md.get("type") != "column":
+                continue
+            table, column = md["table_name"], md["column_name"]
+            if column == KEY_COLUMN or not accept(table, column):
+                continue
+            return table, column, score
+        return None
+
+    def _explains(self, table, column, word):
+        """True when a measure word refers to the column: by its name or description, or by search."""
+        key = (table, column)
+        with self._lock:
+            vocabulary = self._vocabulary.get(key)
+        if vocabulary is None:
+            info = self.columns.get(key, {})
+            vocabulary = set(_words(" ".join([column.replace("_", " "), table.replace("_", " "),
+                                              info.get("description") or "", info.get("group") or ""])))
+            with self._lock:
+                self._vocabulary[key] = vocabulary
+        for w in {word, _MEASURE_WORDS.get(word, word)}:
+            if w in vocabulary or (len(w) >= 4 and any(v[:5] == w[:5] for v in vocabulary if len(v) >= 4)):
+                return True
+        rank = 0
+        for doc, _ in search_with_relevance(self.column_index, word, self.k_columns):
+            md = doc.metadata
+            if md.get("type") != "column":
+                continue
+            if (md["table_name"], md["column_name"]) == key:
+                return True
+            rank += 1
+            if rank >= MAX_WORD_RANK:
+                break
+        return False
+
+    def _metric_ok(self, table, column):
+        info = self.columns.get((table, column), {})
+        return (
+            (table, column) not in self.categorical
+            and info.get("group") != "School Identification"
+            and self._is_numeric(table, column)
+        )
+
+    # -------------------------
+    # SQL building
+    # -------------------------
+    def _from(self, table):
+        if table == MAIN_TABLE:
+            return f"FROM {MAIN_TABLE} m", "m"
+        return f"FROM {MAIN_TABLE} m JOIN {_q(table)} t ON t.{KEY_COLUMN} = m.{KEY_COLUMN}", "t"
+
+    def _where(self, filters, params, conditions=()):
+        parts = list(conditions)
+        for i, (column, values) in enumerate(sorted(filters.items())):
+            names = []
+            for j, value in enumerate(values):
+                params[f"f{i}_{j}"] = value
+                names.append(f":f{i}_{j}")
+            parts.append(f"m.{_q(column)} IN ({', '.join(names)})")
+        return ("WHERE " + " AND ".join(parts)) if parts else ""
+
+    def _describe(self, table, column):
+        desc = self.columns.get((table, column), {}).get("description")
+        return f"{column} ({desc})" if desc else column
+
+    # -------------------------
+    # Intents
+    # -------------------------
+    def match(self, question):
+        """
+        Return {"intent", "sql", "params", "confidence", "tables", "summary", "label_column"},
+        or None when no template applies.
+        """
+        q = question.strip().rstrip("?.! ")
+        words = set(_words(q))
+        if not q or words & _ANAPHORA:
+            return None
+        lowered = q.lower()
+        if _NEGATION_RE.search(lowered):
+            return None
+        if _COUNT_RE.match(lowered):
+            return self._match_count(q)
+        if words & (_DESC_WORDS | _ASC_WORDS):
+            return self._match_top_n(q, words)
+        m = _LOOKUP_RE.match(lowered)
+        if m:
+            return self._match_lookup(m.group("field"), m.group("name"))
+        return None
+
+    def _match_top_n(self, q, words):
+        filters, labels, rest = self._extract_filters(q)
+        if _COUNT_RANK_RE.search(rest):
+            return None
+        m = re.search(r"\b(?:top|bottom|first)\s+(\d+)\b", rest) or re.search(
+            r"\b(\d+)\s+(?:\w+\s+)?(?:schools?|colleges?|universit(?:y|ies)|institutions?)\b", rest)
+        limit = min(int(m.group(1)), MAX_LIMIT) if m else DEFAULT_LIMIT
+        if m:
+            rest = rest[:m.start()] + " " + rest[m.end():]
+        ascending = bool(words & _ASC_WORDS)
+        measure = self._leftover(rest)
+        # "which state ...": the answer is a group, not institutions
+        if any(w in _GROUP_SYNONYMS for w in measure):
+            return None
+        resolved = self._resolve_column(" ".join(measure), self._metric_ok)
+        if resolved is None:
+            return None
+        table, column, score = resolved
+        # Every word left is part of the measure; words the column does not explain are conditions
+        # ("and acceptance rate below 10%", "among women-only schools") no template expresses
+        if not all(self._explains(table, column, w) for w in measure):
+            return None
+        frm, alias = self._from(table)
+        ref = f"{alias}.{_q(column)}"
+        params = {"limit": limit}
+        where = self._where(filters, params, [numeric_predicate(ref)])
+        sql = (
+            f"SELECT m.{NAME_COLUMN}, m.STABBR, CAST({ref} AS REAL) AS {_q(column)} {frm} {where} "
+            f"ORDER BY CAST({ref} AS REAL) {'ASC' if ascending else 'DESC'} LIMIT :limit"
+        )
+        scope = f" ({', '.join(labels)})" if labels else ""
+        return {
+            "intent": "top_n",
+            "sql": sql,
+            "params": params,
+            "confidence": score,
+            "tables": sorted({MAIN_TABLE, table}),
+            "summary": (
+                f"{'Bottom' if ascending else 'Top'} {limit} institutions{scope} by "
+                f"{self._describe(table, column)}, {'lowest' if ascending else 'highest'} first."
+            ),
+        }
+
+    def _match_lookup(self, field, name):
+        name = name.strip().strip("'\"")
+        if len(name) < 3:
+            return None
+        pattern = "%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self.engine.connect() as conn:
+            matches = conn.execute(
+                text(f"SELECT {KEY_COLUMN}, {NAME_COLUMN} FROM {MAIN_TABLE} "
+                     f"WHERE {NAME_COLUMN} LIKE :pattern ESCAPE '\\' LIMIT :n"),
+                {"pattern": pattern, "n": MAX_NAME_MATCHES + 1},
+            ).fetchall()
+        exact = [r for r in matches if r[1].lower() == name.lower()]
+        if exact:
+            matches = exact
+        if not matches or len(matches) > MAX_NAME_MATCHES:
+            return None
+        resolved = self._resolve_column(
+            " ".join(self._leftover(field)),
+            lambda t, c: c != NAME_COLUMN and self.columns.get((t, c), {}).get("group") != "School Identification",
+        )
+        if resolved is None:
+            return None
+        table, column, score = resolved
+        frm, alias = self._from(table)
+        params = {f"id{i}": r[0] for i, r in enumerate(matches)}
+        where = self._where({}, params, [f"m.{KEY_COLUMN} IN ({', '.join(':' + k for k in params)})"])
+        sql = f"SELECT m.{NAME_COLUMN}, m.STABBR, {alias}.{_q(column)} {frm} {where} ORDER BY m.{NAME_COLUMN}"
+        return {
+            "intent": "lookup",
+            "sql": sql,
+            "params": params,
+            # Several candidate institutions make the answer less certain
+            "confidence": score if exact or len(matches) == 1 else score * 0.9,
+            "tables": sorted({MAIN_TABLE, table}),
+            "summary": f"{self._describe(table, column)} for {', '.join(r[1] for r in matches)}.",
+            "label_column": column,
+        }
+
+    def _match_count(self, q):
+        filters, labels, rest = self._extract_filters(q)
+        rest = _COUNT_RE.sub(" ", rest.strip())
+        group = None
+        m = _GROUP_RE.search(rest.strip())
+        if m:
+            phrase = m.group("group").strip()
+            rest = rest.strip()[:m.start()]
+            synonym = _GROUP_SYNONYMS.get(phrase)
+            if synonym and (MAIN_TABLE, synonym) in self.categorical:
+                group = (MAIN_TABLE, synonym, 1.0)
+            else:
+                group = self._resolve_column(phrase, lambda t, c: (t, c) in self.categorical)
+            if group is None:
+                return None
+        # Anything else in the question is a condition no template expresses
+        if self._leftover(rest, extra={"many", "number", "count"}):
+            return None
+
+        params = {}
+        if group is None:
+            where = self._where(filters, params)
+            sql = f"SELECT COUNT(*) AS institutions FROM {MAIN_TABLE} m {where}"
+            tables, confidence, label_column = [MAIN_TABLE], 1.0, None
+            summary = f"Number of institutions{' (' + ', '.join(labels) + ')' if labels else ''}."
+        else:
+            table, column, confidence = group
+            frm, alias = self._from(table)
+            ref = f"{alias}.{_q(column)}"
+            where = self._where(filters, params, [f"{ref} IS NOT NULL"])
+            sql = (f"SELECT {ref} AS {_q(column)}, COUNT(*) AS institutions {frm} {where} "
+                   f"GROUP BY {ref} ORDER BY institutions DESC")
+            tables, label_column = sorted({MAIN_TABLE, table}), column
+            scope = f" ({', '.join(labels)})" if labels else ""
+            summary = f"Number of institutions{scope} by {self._describe(table, column)}."
+        return {
+            "intent": "count",
+            "sql": sql,
+            "params": params,
+            "confidence": confidence,
+            "tables": tables,
+            "summary": summary,
+            "label_column": label_column,
+        }
+
+    def run(self, match):
+        """Execute a match; coded values of the labelled column get a label column. Returns a run_query record."""
+        record = run_query(self.engine, match["sql"], match["params"])
+        column = match.get("label_column")
+        if record["ok"] and column in CODE_LABELS and column in record["columns"]:
+            i = record["columns"].index(column)
+            record["columns"] = record["columns"][:i + 1] + ["label"] + record["columns"][i + 1:]
+            record["rows"] = [r[:i + 1] + (label_for(column, r[i]),) + r[i + 1:] for r in record["rows"]]
+        return record
+
+
+class TemplateStats:
+    """Process-wide hit rate and latency of the template path vs the agent."""
+
+    def __init__(self, window=1000):
+        self.hits = 0
+        self.misses = 0
+        self.latency_ms = {"template": deque(maxlen=window), "agent": deque(maxlen=window)}
+        self._lock = threading.Lock()
+
+    def count(self, hit):
+        """Count one question the templates were tried on."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record(self, path, elapsed_ms):
+        """Record the end-to-end latency of a question answered by path ("template" or "agent")."""
+        with self._lock:
+            self.latency_ms[path].append(elapsed_ms)
+
+    def summary(self):
+        with self._lock:
+            tried = self.hits + self.misses
+            out = {"hits": self.hits, "misses": self.misses,
+                   "hit_rate": self.hits / tried if tried else 0.0}
+            for path, values in self.latency_ms.items():
+                ordered = sorted(values)
+                out[f"{path}_runs"] = len(ordered)
+                out[f"{path}_p50_ms"] = ordered[len(ordered) // 2] if ordered else None
+        return out
+
+
+_stats = TemplateStats()
+
+
+def get_stats():
+    return _stats
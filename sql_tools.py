@@ -0,0 +1,122 @@
+"""
+SQL query tool used by the agent in place of the toolkit's sql_db_query.
+
+It keeps the toolkit tool's name, description and output format, but runs the
+statement itself so the rows, column names, timing and errors of every
+execution are available to hooks (query log, pre-flight checks, result
+capture) instead of only the string handed back to the model.
+
+ResultCapture keeps the last successful result so the app can show the rows
+as a table directly; max_rows caps how many of them are echoed to the model.
+"""
+import threading
+import time
+
+from langchain_core.tools import StructuredTool
+from sqlalchemy import text
+
+QUERY_TOOL_NAME = "sql_db_query"
+
+QUERY_TOOL_DESCRIPTION = """
+    Execute a SQL query against the database and get back the result..
+    If the query is not correct, an error message will be returned.
+    If an error is returned, rewrite the query, check the query, and try again.
+    """
+
+# Same per-value truncation SQLDatabase.run applies
+MAX_STRING_LENGTH = 300
+
+
+def _truncate_value(value, length=MAX_STRING_LENGTH):
+    if isinstance(value, str) and len(value) > length:
+        return value[:length] + "..."
+    return value
+
+
+def run_query(engine, sql, params=None):
+    """
+    Execute one statement (with optional bound parameters) and return a record dict:
+    {"sql", "columns", "rows", "row_count", "elapsed_ms", "ok", "error"}.
+    """
+    record = {"sql": sql, "columns": [], "rows": [], "row_count": 0,
+              "elapsed_ms": 0.0, "ok": True, "error": None}
+    start = time.perf_counter()
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(text(sql), params or {})
+            if result.returns_rows:
+                record["columns"] = list(result.keys())
+                record["rows"] = [tuple(r) for r in result.fetchall()]
+                record["row_count"] = len(record["rows"])
+            else:
+                record["row_count"] = max(result.rowcount, 0)
+    except Exception as e:
+        record["ok"] = False
+        record["error"] = str(e)
+    record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return record
+
+
+def format_rows(rows):
+    """Format rows the way SQLDatabase.run does: str of a list of tuples, "" when empty."""
+    if not rows:
+        return ""
+    return str([tuple(_truncate_value(v) for v in r) for r in rows])
+
+
+class ResultCapture:
+    """after-hook keeping the record of the last successful statement that returned rows."""
+
+    def __init__(self):
+        self.record = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.record = None
+
+    def __call__(self, record):
+        if record["ok"] and record["columns"]:
+            with self._lock:
+                self.record = record
+
+
+def make_query_tool(engine, before=(), after=(), max_rows=None):
+    """
+    Build the sql_db_query tool.
+
+    before:   callables(sql) run before execution; a non-empty string return value
+              is handed to the agent instead of executing the statement.
+    after:    callables(record) run after every execution (see run_query).
+    max_rows: rows echoed to the model at most (None for all); the rest are
+              only counted in a note.
+    """
+
+    def sql_db_query(query: str) -> str:
+        """A detailed and correct SQL query."""
+        for hook in before:
+            message = hook(query)
+            if message:
+                return message
+        record = run_query(engine, query)
+        for hook in after:
+            try:
+                hook(record)
+            except Exception as e:
+                print(f"Query hook failed: {e}")
+        if not record["ok"]:
+            return f"Error: {record['error']}"
+        rows = record["rows"]
+        if max_rows is not None and len(rows) > max_rows:
+            return (
+                format_rows(rows[:max_rows])
+                + f"\n({len(rows)} rows in total, first {max_rows} shown. "
+                "All rows are displayed to the user as a table.)"
+            )
+        return format_rows(rows)
+
+    return StructuredTool.from_function(
+        sql_db_query,
+        name=QUERY_TOOL_NAME,
+        description=QUERY_TOOL_DESCRIPTION,
+    )
@@ -0,0 +1,116 @@
+"""
+Throttled rendering of a streamed agent run.
+
+The worker emits job events (see app.run_agent):
+- token:       {"id", "text"}  text delta of an AI message being streamed
+- answer:      {"id", "text"}  complete text of an AI message without tool calls
+- tool_call:   {"id", "name", "args"}  id is the AI message that made the call
+- tool_result: {"name", "content"}
+- escalate:    {"model", "reason"}  the run restarts on the strong model
+- queued:      {"provider", "queued", "in_flight"}  an LLM call waits for a scheduler slot
+- scheduled:   {"provider", "waited_s"}  the waiting call got its slot
+
+StreamRenderer folds events into its state (text accumulated per message) and
+only writes to Streamlit when flush() is due, so a long answer costs a bounded
+number of websocket deltas instead of one full re-render per chunk. Steps are
+appended as they happen; progress is keyed on tool calls, not chunks.
+"""
+import time
+
+STREAM_MAX_FPS = 4
+
+
+def _short(value, max_chars=1200):
+    s = value if isinstance(value, str) else str(value)
+    return s if len(s) <= max_chars else s[:max_chars] + " ... [truncated]"
+
+
+class StreamRenderer:
+    """
+    Render job events into Streamlit elements.
+    steps: container for tool steps (None hides them), status / answer: st.empty() placeholders.
+    expected_tool_calls scales the progress bar; started is the run's perf_counter start.
+    """
+
+    def __init__(self, steps, status, answer, expected_tool_calls=10, max_fps=STREAM_MAX_FPS, started=None):
+        self.steps = steps
+        self.status = status
+        self.answer = answer
+        self.expected_tool_calls = max(expected_tool_calls, 1)
+        self.min_interval = 1.0 / max_fps
+        self.texts = {}
+        self.current = None
+        self.tool_calls = 0
+        self.chunks = 0
+        self.started = started if started is not None else time.perf_counter()
+        self._last_flush = 0.0
+        self._dirty = False
+        self._shown = None
+        # Pending "queued" event while an LLM call waits for the scheduler
+        self.waiting = None
+
+    def feed(self, events):
+        for ev in events:
+            kind = ev["kind"]
+            if kind == "token":
+                self.chunks += 1
+                self.texts[ev["id"]] = self.texts.get(ev["id"], "") + ev["text"]
+                self.current = ev["id"]
+            elif kind == "answer":
+                self.texts[ev["id"]] = ev["text"]
+                self.current = ev["id"]
+            elif kind == "tool_call":
+                self.tool_calls += 1
+                # Text streamed alongside a tool call is reasoning, not the answer
+                thought = self.texts.pop(ev["id"], "")
+                if ev["id"] == self.current:
+                    self.current = None
+                if self.steps is not None:
+                    if thought.strip():
+                        self.steps.markdown(thought)
+                    self.steps.markdown(f"Step {self.tool_calls} • Calling tool: {ev['name']}")
+                    args = ev["args"]
+                    if ev["name"] == "sql_db_query":
+                        sql = args.get("query", args) if isinstance(args, dict) else args
+                        self.steps.code(_short(sql), language="sql")
+                    else:
+                        self.steps.code(_short(args), language="json")
+            elif kind == "escalate":
+                # The strong model answers from scratch; drop the fast model's text
+                self.texts.clear()
+                self.current = None
+                if self.steps is not None:
+                    self.steps.info(f"Escalating to {ev['model']}: {ev['reason']}")
+            elif kind == "queued":
+                self.waiting = ev
+            elif kind == "scheduled":
+                self.waiting = None
+            elif kind == "tool_result":
+                if self.steps is not None:
+                    self.steps.markdown(f"Step {self.tool_calls} ✓ Tool finished: {ev['name']}")
+                    self.steps.code(_short(ev["content"]), language="text")
+            self._dirty = True
+
+    def flush(self, force=False):
+        """Redraw the status line and answer text if due (at most max_fps times a second)."""
+        now = time.perf_counter()
+        since = now - self._last_flush
+        # Redraw at least once a second: keeps the elapsed time current and gives
+        # Streamlit a chance to handle a Stop click while the run is quiet
+        if not force and since < 1.0 and (not self._dirty or since < self.min_interval):
+            return False
+        if self.waiting is not None:
+            w = self.waiting
+            # Event timestamps are wall-clock (job.emit)
+            status_text = (f"⏳ Waiting for {w['provider']} ({w['queued']} calls queued, {w['in_flight']} running), "
+                           f"{time.time() - w['ts']:.0f}s...")
+        else:
+            status_text = f"🤔 Thinking... {self.tool_calls} tool calls, {now - self.started:.0f}s"
+        self.status.progress(min(self.tool_calls / self.expected_tool_calls, 1.0), text=status_text)
+        text = self.texts.get(self.current, "") if self.current else ""
+        if text != self._shown:
+            self.answer.markdown(text)
+            self._shown = text
+        self._last_flush = now
+        self._dirty = False
+        return True
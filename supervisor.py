@@ -0,0 +1,180 @@
+"""
+Run supervisor: loop detection and per-question budgets for agent runs.
+
+RunSupervisor is a callback handler that fingerprints every tool call and its
+arguments and raises RunStopped when the agent:
+- repeats an identical tool call (e.g. sql_db_schema on the same tables),
+- retries a query nearly identical to one that already failed,
+- exceeds the prompt's rule of two failed query attempts,
+- or runs past its budget of LLM calls, tokens or wall-clock seconds
+  (checked on every streamed token as well, so a runaway answer is cut off).
+
+After a stop, partial_answer() returns the best answer gathered so far
+together with the reason.
+"""
+import json
+import re
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from query_log import normalize_sql
+from sql_tools import QUERY_TOOL_NAME
+
+DEFAULT_BUDGET = {
+    "max_llm_calls": 12,
+    "max_tokens": 60000,
+    "max_seconds": 120,
+    "max_failed_queries": 2,
+    "max_repeats": 1,
+}
+
+
+class RunStopped(Exception):
+    """Raised from a callback to end an agent run early; str(e) is the reason."""
+
+
+def _tool_args(input_str, inputs):
+    if inputs:
+        return inputs
+    try:
+        return json.loads(input_str)
+    except (TypeError, ValueError):
+        return input_str
+
+
+_OPERATOR_SPACE_RE = re.compile(r" ?([=<>!(),*+-]) ?")
+
+
+def _squeeze(match):
+    return match.group(1)
+
+
+def fingerprint(name, args):
+    """Stable key for a tool call: SQL is normalised, other arguments are sorted JSON."""
+    if name == QUERY_TOOL_NAME:
+        sql = args.get("query", "") if isinstance(args, dict) else str(args)
+        # Spacing around operators and commas does not make a query different
+        return f"{name}:{_OPERATOR_SPACE_RE.sub(_squeeze, normalize_sql(sql))}"
+    if isinstance(args, dict):
+        # Comma-separated lists (e.g. table_names) compare as sets
+        normalized = {k: sorted(p.strip().lower() for p in v.split(",")) if isinstance(v, str) else v
+                      for k, v in args.items()}
+        return f"{name}:{json.dumps(normalized, sort_keys=True, default=str)}"
+    return f"{name}:{str(args).strip().lower()}"
+
+
+class RunSupervisor(BaseCallbackHandler):
+    """
+    Enforce loop and budget rules for one agent run.
+    usage, when given, is the run's usage.UsageCollector (for the token budget).
+    """
+
+    raise_error = True
+
+    def __init__(self, usage=None, **budget):
+        self.budget = {**DEFAULT_BUDGET, **budget}
+        self.usage = usage
+        self.started = time.perf_counter()
+        self.llm_calls = 0
+        # Chunks of the LLM call being streamed, counted as output tokens until usage is reported
+        self.streamed_tokens = 0
+        self.failed_queries = 0
+        self.stop_reason = None
+        self.last_ai_text = ""
+        self.last_result = None
+        self._counts = {}
+        self._failed = set()
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def stop(self, reason):
+        with self._lock:
+            if self.stop_reason is None:
+                self.stop_reason = reason
+        raise RunStopped(reason)
+
+    def check_budget(self):
+        if self.stop_reason:
+            raise RunStopped(self.stop_reason)
+        elapsed = time.perf_counter() - self.started
+        if elapsed > self.budget["max_seconds"]:
+            self.stop(f"time budget of {self.budget['max_seconds']}s exceeded")
+        if self.usage is not None and self.usage.totals()["total"] + self.streamed_tokens > self.budget["max_tokens"]:
+            self.stop(f"token budget of {self.budget['max_tokens']} exceeded")
+
+    # LLM calls
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._on_llm_start()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._on_llm_start()
+
+    def _on_llm_start(self):
+        self.check_budget()
+        with self._lock:
+            self.llm_calls += 1
+            calls = self.llm_calls
+        if calls > self.budget["max_llm_calls"]:
+            self.stop(f"limit of {self.budget['max_llm_calls']} LLM calls reached")
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.streamed_tokens += 1
+        self.check_budget()
+
+    def on_llm_end(self, response, **kwargs):
+        self.streamed_tokens = 0
+        for generations in response.generations:
+            for gen in generations:
+                text = getattr(gen, "text", "") or ""
+                if text.strip():
+                    self.last_ai_text = text
+        self.check_budget()
+
+    # Tool calls
+    def on_tool_start(self, serialized, input_str, *, run_id, inputs=None, **kwargs):
+        self.check_budget()
+        name = (serialized or {}).get("name") or ""
+        args = _tool_args(input_str, inputs)
+        key = fingerprint(name, args)
+        with self._lock:
+            self._tools[run_id] = (name, key)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            repeats = self._counts[key] - 1
+        if name == QUERY_TOOL_NAME:
+            if key in self._failed:
+                self.stop("the agent retried a query that already failed")
+            if self.failed_queries >= self.budget["max_failed_queries"]:
+                self.stop(f"{self.failed_queries} query attempts failed")
+        # One repeat is allowed so a query can be resubmitted after a pre-flight plan hint
+        if repeats > self.budget["max_repeats"]:
+            self.stop(f"repeated tool call: {name}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        with self._lock:
+            name, key = self._tools.pop(run_id, ("", ""))
+        if name != QUERY_TOOL_NAME:
+            return
+        text = str(getattr(output, "content", output) or "")
+        if text.startswith("Error"):
+            with self._lock:
+                self.failed_queries += 1
+                self._failed.add(key)
+        else:
+            self.last_result = text
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._tools.pop(run_id, None)
+
+    def partial_answer(self, reason=None):
+        """Best answer available after a stop, with the reason appended."""
+        reason = reason or self.stop_reason or "run stopped"
+        if self.last_ai_text.strip():
+            body = self.last_ai_text.strip()
+        elif self.last_result:
+            body = "Partial result from the last successful query:\n\n" + self.last_result[:2000]
+        else:
+            body = "No answer could be produced."
+        return f"{body}\n\n⚠️ Stopped early: {reason}."
@@ -0,0 +1,206 @@
+"""
+Hybrid lexical + embedding table router.
+
+A BM25 inverted index is kept over the column catalog (table names, column
+names, descriptions and GROUP_CATEGORY). Questions that contain an exact
+column or domain keyword ("tuition", "SAT", "retention", "debt") are routed
+from the lexical scores alone, without calling the embedding model. Otherwise
+lexical and vector rankings are fused.
+"""
+import math
+import re
+import time
+
+from schema_index import (
+    create_column_documents,
+    search_with_relevance,
+    aggregate_column_hits,
+    fuse_rankings,
+)
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+")
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "how", "in", "is",
+    "it", "many", "me", "of", "on", "or", "show", "that", "the", "their", "to",
+    "what", "which", "who", "with", "list", "give", "top", "most", "per",
+    "school", "schools", "college", "colleges", "institution", "institutions",
+    "university", "universities", "students", "student",
+}
+
+
+def _stem(word):
+    # Light plural folding so "rates" matches "rate" and "loans" matches "loan"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Lowercase word tokens; underscore identifiers also yield their parts."""
+    tokens = []
+    for raw in _TOKEN_RE.findall(text or ""):
+        word = raw.lower()
+        parts = [word]
+        if "_" in word:
+            parts += [p for p in word.split("_") if p]
+        for part in parts:
+            if part in _STOPWORDS:
+                continue
+            tokens.append(_stem(part))
+    return tokens
+
+
+class BM25Index:
+    """Minimal Okapi BM25 over pre-tokenized documents."""
+
+    def __init__(self, tokenized_docs, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_len = [len(d) for d in tokenized_docs]
+        self.avg_len = (sum(self.doc_len) / len(self.doc_len)) if self.doc_len else 0.0
+        self.postings = {}
+        for i, doc in enumerate(tokenized_docs):
+            counts = {}
+            for tok in doc:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                self.postings.setdefault(tok, []).append((i, tf))
+        n = len(tokenized_docs)
+        self.idf = {
+            tok: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for tok, p in self.postings.items()
+        }
+
+    def score(self, query_tokens):
+        """Return {doc index: score} for documents matching any query token."""
+        scores = {}
+        for tok in set(query_tokens):
+            for i, tf in self.postings.get(tok, ()):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[i] / self.avg_len)
+                scores[i] = scores.get(i, 0.0) + self.idf[tok] * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+class TableRouter:
+    """
+    Route a retrieval query to the most relevant tables and columns.
+
+    route() returns {"tables", "ranked_columns", "fast_path", "timings"} where
+    timings holds per-stage milliseconds (lexical, embed, vector_search, fusion, total).
+    """
+
+    def __init__(self, usable_tables, schema_info, vectorstore=None, column_index=None,
+                 embeddings=None, decisive_score=4.0, decisive_ratio=1.2, lexical_weight=1.0,
+                 extra_docs=None):
+        self.vectorstore = vectorstore
+        self.column_index = column_index
+        self.embeddings = embeddings
+        self.decisive_score = decisive_score
+        self.decisive_ratio = decisive_ratio
+        self.lexical_weight = lexical_weight
+        self.column_docs = create_column_documents(usable_tables, schema_info) + list(extra_docs or [])
+        self.bm25 = BM25Index([self._doc_tokens(d) for d in self.column_docs])
+
+    @staticmethod
+    def _doc_tokens(doc):
+        meta = doc.metadata
+        if meta.get("type") == "values":
+            # Value documents are matched on their values and labels ("Texas", "Catholic")
+            return tokenize(doc.page_content)
+        return tokenize(" ".join([
+            meta["table_name"],
+            meta["column_name"],
+            meta.get("description") or "",
+            meta.get("group_category") or "",
+        ]))
+
+    def lexical_rank(self, query, k_tables=3):
+        """BM25 column matches aggregated per table, same shape as rank_tables_by_columns."""
+        scores = self.bm25.score(tokenize(query))
+        hits = sorted(
+            ((self.column_docs[i], s) for i, s in scores.items()),
+            key=lambda h: h[1], reverse=True,
+        )
+        return aggregate_column_hits(hits, k_tables=k_tables)
+
+    def is_decisive(self, lexical):
+        """A lexical match is decisive when it is strong and clearly ahead of the runner-up."""
+        if not lexical or lexical[0]["score"] < self.decisive_score:
+            return False
+        if len(lexical) == 1:
+            return True
+        return lexical[0]["score"] >= self.decisive_ratio * lexical[1]["score"]
+
+    def route(self, query, k=3, embedding=None, embed_fn=None):
+        """
+        embedding reuses a precomputed query vector; embed_fn is called lazily to
+        produce one (e.g. combined per-turn vectors) only when vector search runs.
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        t0 = time.perf_counter()
+        lexical = self.lexical_rank(query, k_tables=k)
+        timings["lexical"] = (time.perf_counter() - t0) * 1000
+
+        if self.is_decisive(lexical) or self.embeddings is None:
+            timings["total"] = (time.perf_counter() - started) * 1000
+            return {
+                "tables": [r["table"] for r in lexical],
+                "ranked_columns": lexical,
+                "fast_path": True,
+                "timings": timings,
+            }
+
+        # One query embedding is shared by both FAISS indexes
+        t0 = time.perf_counter()
+        if embedding is None and embed_fn is not None:
+            embedding = embed_fn()
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+        timings["embed"] = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        vector_columns = []
+        if self.column_index is not None:
+            hits = search_with_relevance(self.column_index, query, 40, embedding=embedding)
+            vector_columns = aggregate_column_hits(hits, k_tables=k)
+        table_hits = []
+        if self.vectorstore is not None:
+            table_hits = search_with_relevance(self.vectorstore, query, k, embedding=embedding)
+        timings["vector_search"] = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        tables = fuse_rankings(
+            [r["table"] for r in lexical],
+            [r["table"] for r in vector_columns],
+            [doc.metadata["table_name"] for doc, _ in table_hits],
+            limit=k,
+            weights=[self.lexical_weight, 1.0, 1.0],
+        )
+        ranked_columns = merge_ranked_columns(lexical, vector_columns)
+        timings["fusion"] = (time.perf_counter() - t0) * 1000
+
+        timings["total"] = (time.perf_counter() - started) * 1000
+        return {
+            "tables": tables,
+            "ranked_columns": ranked_columns,
+            "fast_path": False,
+            "timings": timings,
+        }
+
+
+def merge_ranked_columns(*ranked_lists, max_columns_per_table=8):
+    """Union the per-table column lists of several rankings, first list first."""
+    merged = {}
+    for ranked in ranked_lists:
+        for r in ranked:
+            entry = merged.setdefault(r["table"], {"table": r["table"], "score": r["score"], "columns": []})
+            entry["score"] = max(entry["score"], r["score"])
+            seen = {c["column_name"] for c in entry["columns"]}
+            for c in r["columns"]:
+                if c["column_name"] not in seen and len(entry["columns"]) < max_columns_per_table:
+                    entry["columns"].append(c)
+                    seen.add(c["column_name"])
+    return list(merged.values())
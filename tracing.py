@@ -0,0 +1,305 @@
+"""
+Per-step latency tracing for agent runs.
+
+A Tracer collects nested spans (retrieval stages, LLM calls, tool calls and
+SQLite statements) for one question. LLM and tool spans come from
+TracingCallback, SQL spans from SQLAlchemy cursor hooks installed with
+instrument_engine. Finished traces are appended to a local JSONL file that can
+be aggregated offline:
+
+    python tracing.py [traces.jsonl]
+
+prints count, p50 and p95 duration per stage.
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from sqlalchemy import event
+
+TRACE_PATH = os.environ.get("TRACE_PATH", "traces.jsonl")
+
+# Tracer of the question being answered in the current context (propagates to tool threads)
+_current_tracer = contextvars.ContextVar("current_tracer", default=None)
+_file_lock = threading.Lock()
+
+
+def current_tracer():
+    return _current_tracer.get()
+
+
+class Tracer:
+    """Collect spans for one trace; spans are plain dicts ready for JSON."""
+
+    def __init__(self, name="question", path=TRACE_PATH, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.path = path
+        self.spans = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._open = {}
+        # Innermost open span per thread, used to parent SQL statements under their tool
+        self._thread_stack = {}
+        self.root_id = self.start_span(name, "root", **attrs)
+
+    def _now_ms(self):
+        return (time.perf_counter() - self._origin) * 1000
+
+    def start_span(self, name, kind, parent_id=None, **attrs):
+        span_id = uuid.uuid4().hex[:16]
+        if parent_id is None:
+            parent_id = self.current_span_id()
+        span = {
+            "trace_id": self.trace_id,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "kind": kind,
+            "start_ms": round(self._now_ms(), 3),
+            "duration_ms": None,
+            "status": "ok",
+            "attrs": attrs,
+        }
+        with self._lock:
+            self.spans.append(span)
+            self._open[span_id] = span
+        return span_id
+
+    def end_span(self, span_id, status="ok", **attrs):
+        with self._lock:
+            span = self._open.pop(span_id, None)
+        if span is None:
+            return
+        span["duration_ms"] = round(self._now_ms() - span["start_ms"], 3)
+        span["status"] = status
+        span["attrs"].update(attrs)
+
+    def record(self, name, kind, start_ms, duration_ms, parent_id=None, **attrs):
+        """Add an already-measured span (e.g. from a component's own timings)."""
+        span = {
+            "trace_id": self.trace_id,
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": parent_id or self.root_id,
+            "name": name,
+            "kind": kind,
+            "start_ms": round(start_ms, 3),
+            "duration_ms": round(duration_ms, 3),
+            "status": "ok",
+            "attrs": attrs,
+        }
+        with self._lock:
+            self.spans.append(span)
+        return span["span_id"]
+
+    def get_span(self, span_id):
+        with self._lock:
+            for span in self.spans:
+                if span["span_id"] == span_id:
+                    return span
+        return None
+
+    def push(self, span_id):
+        with self._lock:
+            self._thread_stack.setdefault(threading.get_ident(), []).append(span_id)
+
+    def pop(self, span_id):
+        with self._lock:
+            stack = self._thread_stack.get(threading.get_ident(), [])
+            if span_id in stack:
+                stack.remove(span_id)
+
+    def current_span_id(self):
+        with self._lock:
+            stack = self._thread_stack.get(threading.get_ident())
+            if stack:
+                return stack[-1]
+        return getattr(self, "root_id", None)
+
+    @contextmanager
+    def span(self, name, kind, **attrs):
+        span_id = self.start_span(name, kind, **attrs)
+        self.push(span_id)
+        status = "ok"
+        try:
+            yield span_id
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.pop(span_id)
+            self.end_span(span_id, status=status)
+
+    @contextmanager
+    def activate(self):
+        """Make this tracer current for callbacks and SQL hooks in this context."""
+        token = _current_tracer.set(self)
+        try:
+            yield self
+        finally:
+            _current_tracer.reset(token)
+
+    def finish(self, status="ok"):
+        """Close the root span and append all spans to the trace file."""
+        self.end_span(self.root_id, status=status)
+        if not self.path:
+            return
+        with self._lock:
+            lines = [json.dumps(s, default=str) for s in self.spans if s["duration_ms"] is not None]
+        try:
+            with _file_lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            print(f"Could not write trace to {self.path}: {e}")
+
+
+class TracingCallback(BaseCallbackHandler):
+    """Record a span per LLM call and per tool call, nested by LangChain run ids."""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self._spans = {}
+
+    def _parent(self, parent_run_id):
+        return self._spans.get(parent_run_id) if parent_run_id else None
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def _start_llm(self, serialized, run_id, parent_run_id, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or (serialized or {}).get("name", "")
+        self._spans[run_id] = self.tracer.start_span(
+            "llm_call", "llm", parent_id=self._parent(parent_run_id), model=model
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.tracer.end_span(self._spans.pop(run_id, None))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.tracer.end_span(self._spans.pop(run_id, None), status="error", error=str(error)[:300])
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        span_id = self.tracer.start_span(
+            name, "tool", parent_id=self._parent(parent_run_id), input=str(input_str)[:500]
+        )
+        self._spans[run_id] = span_id
+        # Tools run synchronously in this thread, so SQL issued now belongs to this span
+        self.tracer.push(span_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        span_id = self._spans.pop(run_id, None)
+        self.tracer.pop(span_id)
+        self.tracer.end_span(span_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        span_id = self._spans.pop(run_id, None)
+        self.tracer.pop(span_id)
+        self.tracer.end_span(span_id, status="error", error=str(error)[:300])
+
+
+def instrument_engine(engine):
+    """Install cursor hooks that record a span per SQL statement while a tracer is active."""
+    if getattr(engine, "_tracing_installed", False):
+        return engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        tracer = current_tracer()
+        if tracer is not None and context is not None:
+            context._trace = (tracer, tracer.start_span("sql", "sql", statement=statement[:1000]))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = getattr(context, "_trace", None)
+        if trace:
+            trace[0].end_span(trace[1])
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        trace = getattr(exception_context.execution_context, "_trace", None)
+        if trace:
+            trace[0].end_span(trace[1], status="error", error=str(exception_context.original_exception)[:300])
+
+    engine._tracing_installed = True
+    return engine
+
+
+def format_waterfall(spans, width=40):
+    """Render spans as an indented text waterfall, children under their parents."""
+    done = [s for s in spans if s["duration_ms"] is not None]
+    if not done:
+        return ""
+    children = {}
+    for s in done:
+        children.setdefault(s["parent_id"], []).append(s)
+    ids = {s["span_id"] for s in done}
+    roots = [s for s in done if s["parent_id"] not in ids]
+    total = max(s["start_ms"] + s["duration_ms"] for s in done) or 1.0
+
+    lines = []
+
+    def walk(span, depth):
+        offset = int(span["start_ms"] / total * width)
+        length = max(1, int(span["duration_ms"] / total * width))
+        label = ("  " * depth + span["name"])[:28].ljust(28)
+        bar = (" " * offset + "█" * length)[:width].ljust(width)
+        mark = " !" if span["status"] != "ok" else ""
+        lines.append(f"{label} |{bar}| {span['duration_ms']:9.1f} ms{mark}")
+        for child in sorted(children.get(span["span_id"], []), key=lambda c: c["start_ms"]):
+            walk(child, depth + 1)
+
+    for root in sorted(roots, key=lambda r: r["start_ms"]):
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def stage_key(span):
+    if span["kind"] == "tool":
+        return f"tool:{span['name']}"
+    if span["kind"] in ("root", "llm", "sql"):
+        return span["kind"]
+    return f"{span['kind']}:{span['name']}"
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[idx]
+
+
+def aggregate(path=TRACE_PATH):
+    """Return {stage: {"count", "p50_ms", "p95_ms"}} over all spans in a trace file."""
+    durations = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            span = json.loads(line)
+            durations.setdefault(stage_key(span), []).append(span["duration_ms"])
+    return {
+        stage: {
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 50), 1),
+            "p95_ms": round(_percentile(values, 95), 1),
+        }
+        for stage, values in durations.items()
+    }
+
+
+if __name__ == "__main__":
+    trace_path = sys.argv[1] if len(sys.argv) > 1 else TRACE_PATH
+    stats = aggregate(trace_path)
+    print(f"{'stage':<32}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}")
+    for stage, row in sorted(stats.items(), key=lambda kv: -kv[1]["p95_ms"]):
+        print(f"{stage:<32}{row['count']:>8}{row['p50_ms']:>12}{row['p95_ms']:>12}")
@@ -0,0 +1,145 @@
+"""
+Token usage accounting for agent runs.
+
+UsageCollector is a callback handler that records one entry per LLM call with
+input, output and cached tokens. Real provider usage (usage_metadata on the
+message, or token_usage in llm_output) is preferred; when a provider reports
+nothing, the actual serialized messages, including tool-call arguments, are
+counted with tiktoken. Totals are kept per collector (one run), per session
+(a dict owned by the caller) and per process.
+"""
+import json
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from history import count_tokens
+
+USAGE_KEYS = ("input", "output", "cached", "total", "calls")
+
+_process_totals = {k: 0 for k in USAGE_KEYS}
+_process_lock = threading.Lock()
+
+
+def empty_totals():
+    return {k: 0 for k in USAGE_KEYS}
+
+
+def process_totals():
+    """Usage accumulated by every session in this process."""
+    with _process_lock:
+        return dict(_process_totals)
+
+
+def _message_text(message):
+    """Serialize a message the way it is sent: content plus any tool calls."""
+    content = getattr(message, "content", message)
+    parts = [content if isinstance(content, str) else json.dumps(content, default=str)]
+    for tc in getattr(message, "tool_calls", None) or []:
+        parts.append(json.dumps({"name": tc.get("name"), "args": tc.get("args")}, default=str))
+    return "\n".join(parts)
+
+
+def _provider_usage(response):
+    """Return (input, output, cached) from the provider's response, or None if unreported."""
+    for generations in response.generations:
+        for gen in generations:
+            meta = getattr(getattr(gen, "message", None), "usage_metadata", None)
+            if meta:
+                details = meta.get("input_token_details") or {}
+                return (
+                    meta.get("input_tokens", 0),
+                    meta.get("output_tokens", 0),
+                    details.get("cache_read", 0) or 0,
+                )
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if token_usage:
+        details = token_usage.get("prompt_tokens_details") or {}
+        return (
+            token_usage.get("prompt_tokens", 0),
+            token_usage.get("completion_tokens", 0),
+            details.get("cached_tokens", 0) or 0,
+        )
+    return None
+
+
+class UsageCollector(BaseCallbackHandler):
+    """
+    Collect per-call token usage for one agent run.
+    session_totals, when given, is a dict (see empty_totals) updated in place.
+    """
+
+    def __init__(self, session_totals=None):
+        self.calls = []
+        self.session_totals = session_totals
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        text = "\n".join(_message_text(m) for batch in messages for m in batch)
+        self._start(run_id, serialized, kwargs, count_tokens(text))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, serialized, kwargs, sum(count_tokens(p) for p in prompts))
+
+    def _start(self, run_id, serialized, kwargs, estimate):
+        params = kwargs.get("invocation_params") or {}
+        model = (
+            params.get("model") or params.get("model_name")
+            or (serialized or {}).get("name") or ""
+        )
+        with self._lock:
+            self._pending[run_id] = {"model": model, "estimate": estimate, "start": time.perf_counter()}
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            pending = self._pending.pop(run_id, {"model": "", "estimate": 0, "start": time.perf_counter()})
+        usage = _provider_usage(response)
+        if usage is not None:
+            input_tokens, output_tokens, cached = usage
+            source = "provider"
+        else:
+            input_tokens = pending["estimate"]
+            output_tokens = sum(
+                count_tokens(_message_text(getattr(gen, "message", None) or gen.text))
+                for generations in response.generations for gen in generations
+            )
+            cached = 0
+            source = "tiktoken"
+        record = {
+            "model": pending["model"],
+            "input": input_tokens,
+            "output": output_tokens,
+            "cached": cached,
+            "total": input_tokens + output_tokens,
+            "source": source,
+            "ms": round((time.perf_counter() - pending["start"]) * 1000, 1),
+        }
+        with self._lock:
+            self.calls.append(record)
+        self._accumulate(record)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._pending.pop(run_id, None)
+
+    def _accumulate(self, record):
+        targets = [self.session_totals] if self.session_totals is not None else []
+        with _process_lock:
+            targets.append(_process_totals)
+            for totals in targets:
+                for k in ("input", "output", "cached", "total"):
+                    totals[k] = totals.get(k, 0) + record[k]
+                totals["calls"] = totals.get("calls", 0) + 1
+
+    def totals(self):
+        """Usage of this run."""
+        with self._lock:
+            calls = list(self.calls)
+        totals = empty_totals()
+        for c in calls:
+            for k in ("input", "output", "cached", "total"):
+                totals[k] += c[k]
+        totals["calls"] = len(calls)
+        return totals
@@ -0,0 +1,367 @@
+"""
+Categorical value dictionary for low-cardinality columns.
+
+Distinct values and their frequencies are precomputed once (by db_setup into
+the column_values table, or at app startup when that table is missing),
+together with the code -> label meanings of IPEDS-coded fields. The agent
+resolves values through the lookup_column_values tool and the retrieval
+indexes instead of probing with SELECT DISTINCT queries.
+"""
+import sqlite3
+
+from langchain_core.documents import Document
+from langchain_core.tools import StructuredTool
+from sqlalchemy import text
+
+VALUES_TABLE = "column_values"
+
+# Columns with at most this many distinct values are profiled
+MAX_DISTINCT = 80
+
+# Identifier-like columns are never profiled even if a small fixture makes them look categorical
+SKIP_COLUMNS = {"UNITID", "OPEID", "OPEID6", "INSTNM", "ADDR", "ZIP", "INSTURL", "NPCURL",
+                "LATITUDE", "LONGITUDE", "T4APPROVALDATE"}
+
+# Code -> label meanings of IPEDS / Scorecard coded fields
+CODE_LABELS = {
+    "CONTROL": {
+        1: "Public",
+        2: "Private nonprofit",
+        3: "Private for-profit",
+    },
+    "REGION": {
+        0: "U.S. Service Schools",
+        1: "New England (CT, ME, MA, NH, RI, VT)",
+        2: "Mid East (DE, DC, MD, NJ, NY, PA)",
+        3: "Great Lakes (IL, IN, MI, OH, WI)",
+        4: "Plains (IA, KS, MN, MO, NE, ND, SD)",
+        5: "Southeast (AL, AR, FL, GA, KY, LA, MS, NC, SC, TN, VA, WV)",
+        6: "Southwest (AZ, NM, OK, TX)",
+        7: "Rocky Mountains (CO, ID, MT, UT, WY)",
+        8: "Far West (AK, CA, HI, NV, OR, WA)",
+        9: "Outlying Areas (AS, FM, GU, MH, MP, PR, PW, VI)",
+    },
+    "LOCALE": {
+        11: "City: Large",
+        12: "City: Midsize",
+        13: "City: Small",
+        21: "Suburb: Large",
+        22: "Suburb: Midsize",
+        23: "Suburb: Small",
+        31: "Town: Fringe",
+        32: "Town: Distant",
+        33: "Town: Remote",
+        41: "Rural: Fringe",
+        42: "Rural: Distant",
+        43: "Rural: Remote",
+    },
+    "PREDDEG": {
+        0: "Not classified",
+        1: "Predominantly certificate-degree granting",
+        2: "Predominantly associate's-degree granting",
+        3: "Predominantly bachelor's-degree granting",
+        4: "Entirely graduate-degree granting",
+    },
+    "SCH_DEG": {
+        1: "Predominantly certificate-degree granting",
+        2: "Predominantly associate's-degree granting",
+        3: "Predominantly bachelor's-degree granting",
+    },
+    "HIGHDEG": {
+        0: "Non-degree-granting",
+        1: "Certificate degree",
+        2: "Associate degree",
+        3: "Bachelor's degree",
+        4: "Graduate degree",
+    },
+    "MAIN": {0: "Branch campus", 1: "Main campus"},
+    "CURROPER": {0: "Closed", 1: "Currently operating"},
+    "OPENADMP": {1: "Open admissions", 2: "Not open admissions", 3: "Does not enroll first-time students"},
+    "DISTANCEONLY": {0: "Not distance-education only", 1: "Distance-education only"},
+    "ADMCON7": {
+        1: "Test scores required",
+        2: "Test scores recommended",
+        3: "Test scores neither required nor recommended",
+        4: "Do not know",
+        5: "Test scores considered but not required",
+    },
+    "RELAFFIL": {
+        -1: "Not reported",
+        -2: "Not applicable",
+        22: "American Evangelical Lutheran Church",
+        24: "African Methodist Episcopal Zion Church",
+        27: "Assemblies of God Church",
+        28: "Brethren Church",
+        30: "Roman Catholic",
+        33: "Wisconsin Evangelical Lutheran Synod",
+        34: "Christ and Missionary Alliance Church",
+        35: "Christian Reformed Church",
+        36: "Evangelical Congregational Church",
+        37: "Evangelical Covenant Church of America",
+        38: "Evangelical Free Church of America",
+        39: "Evangelical Lutheran Church",
+        40: "International United Pentecostal Church",
+        41: "Free Will Baptist Church",
+        42: "Interdenominational",
+        43: "Mennonite Brethren Church",
+        44: "Moravian Church",
+        45: "North American Baptist",
+        47: "Pentecostal Holiness Church",
+        48: "Christian Churches and Churches of Christ",
+        49: "Reformed Church in America",
+        50: "Episcopal Church, Reformed",
+        51: "African Methodist Episcopal",
+        52: "American Baptist",
+        53: "American Lutheran",
+        54: "Baptist",
+        55: "Christian Methodist Episcopal",
+        57: "Church of God",
+        58: "Church of Brethren",
+        59: "Church of the Nazarene",
+        60: "Cumberland Presbyterian",
+        61: "Christian Church (Disciples of Christ)",
+        64: "Free Methodist",
+        65: "Friends",
+        66: "Presbyterian Church (USA)",
+        67: "Lutheran Church in America",
+        68: "Lutheran Church - Missouri Synod",
+        69: "Mennonite Church",
+        71: "United Methodist",
+        73: "Protestant Episcopal",
+        74: "Churches of Christ",
+        75: "Southern Baptist",
+        76: "United Church of Christ",
+        77: "Protestant, not specified",
+        78: "Multiple Protestant Denomination",
+        79: "Other Protestant",
+        80: "Jewish",
+        81: "Reformed Presbyterian Church",
+        84: "United Brethren Church",
+        87: "Missionary Church Inc",
+        88: "Undenominational",
+        89: "Wesleyan",
+        91: "Greek Orthodox",
+        92: "Russian Orthodox",
+        93: "Unitarian Universalist",
+        94: "Latter Day Saints (Mormon Church)",
+        95: "Seventh Day Adventists",
+        97: "The Presbyterian Church in America",
+        99: "Other (none of the above)",
+        100: "Original Free Will Baptist",
+        101: "Ecumenical Christian",
+        102: "Evangelical Christian",
+        103: "Presbyterian",
+        105: "General Baptist",
+        106: "Muslim",
+        107: "Plymouth Brethren",
+    },
+    "STABBR": {
+        "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+        "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+        "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+        "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+        "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+        "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+        "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+        "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+        "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+        "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+        "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+        "AS": "American Samoa", "FM": "Federated States of Micronesia", "GU": "Guam",
+        "MH": "Marshall Islands", "MP": "Northern Mariana Islands", "PR": "Puerto Rico",
+        "PW": "Palau", "VI": "Virgin Islands",
+    },
+}
+
+# Binary flag columns share one meaning
+for _flag in ("HBCU", "PBI", "ANNHI", "TRIBAL", "AANAPII", "HSI", "NANTI", "MENONLY", "WOMENONLY", "HCM2"):
+    CODE_LABELS[_flag] = {0: "No", 1: "Yes"}
+
+
+def label_for(column, value):
+    """Return the label of a coded value, or None when the column/value is not coded."""
+    labels = CODE_LABELS.get(column)
+    if not labels:
+        return None
+    if value in labels:
+        return labels[value]
+    try:
+        return labels.get(int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def profile_values(conn, tables, max_distinct=MAX_DISTINCT):
+    """
+    Compute {table: {column: [(value, frequency), ...]}} for low-cardinality columns.
+    conn is a DB-API (sqlite3) connection; each table is scanned once for the
+    distinct counts and once per selected column for the frequencies.
+    """
+    result = {}
+    cur = conn.cursor()
+    for table in tables:
+        columns = [
+            row[1] for row in cur.execute(f"PRAGMA table_info({_quote(table)})")
+            if row[1] not in SKIP_COLUMNS
+        ]
+        if not columns:
+            continue
+        counts = cur.execute(
+            "SELECT " + ", ".join(f"COUNT(DISTINCT {_quote(c)})" for c in columns)
+            + f" FROM {_quote(table)}"
+        ).fetchone()
+        for column, n_distinct in zip(columns, counts):
+            if not n_distinct or n_distinct > max_distinct:
+                continue
+            rows = cur.execute(
+                f"SELECT {_quote(column)}, COUNT(*) FROM {_quote(table)} "
+                f"WHERE {_quote(column)} IS NOT NULL "
+                f"GROUP BY {_quote(column)} ORDER BY COUNT(*) DESC"
+            ).fetchall()
+            result.setdefault(table, {})[column] = [(v, n) for v, n in rows]
+    return result
+
+
+def write_values_table(db_name, tables, max_distinct=MAX_DISTINCT):
+    """Precompute the dictionary into the column_values helper table (used by db_setup)."""
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {VALUES_TABLE};")
+    cursor.execute(
+        f"""
+        CREATE TABLE {VALUES_TABLE} (
+            TABLE_NAME VARCHAR NOT NULL, COLUMN_NAME VARCHAR NOT NULL, VALUE TEXT,
+            FREQUENCY BIGINT NOT NULL, LABEL TEXT
+        );
+        """
+    )
+    profile = profile_values(conn, tables, max_distinct)
+    inserts = [
+        (table, column, None if value is None else str(value), freq, label_for(column, value))
+        for table, columns in profile.items()
+        for column, values in columns.items()
+        for value, freq in values
+    ]
+    cursor.executemany(f"INSERT INTO {VALUES_TABLE} VALUES (?, ?, ?, ?, ?)", inserts)
+    conn.commit()
+    conn.close()
+    print(f"Value dictionary written for {sum(len(c) for c in profile.values())} columns.")
+
+
+def load_value_dictionary(engine, tables):
+    """
+    Load {table: {column: [(value, frequency, label), ...]}}.
+    Reads the precomputed column_values table, or profiles the database when it is missing.
+    """
+    values = {}
+    try:
+        with engine.connect() as conn:
+            res = conn.execute(
+                text(
+                    f"SELECT table_name, column_name, value, frequency, label FROM {VALUES_TABLE} "
+                    "ORDER BY table_name, column_name, frequency DESC"
+                )
+            )
+            for table, column, value, freq, label in res:
+                if table in tables:
+                    values.setdefault(table, {}).setdefault(column, []).append((value, freq, label))
+        if values:
+            return values
+    except Exception:
+        # Table not built yet; fall back to profiling at startup
+        pass
+
+    raw = engine.raw_connection()
+    try:
+        profile = profile_values(raw.driver_connection, tables)
+    finally:
+        raw.close()
+    for table, columns in profile.items():
+        for column, rows in columns.items():
+            values.setdefault(table, {})[column] = [
+                (value, freq, label_for(column, value)) for value, freq in rows
+            ]
+    return values
+
+
+def _format_values(column, rows, search="", limit=100):
+    search = (search or "").lower()
+    lines = []
+    for value, freq, label in rows:
+        shown = f"{value} = {label}" if label else f"{value}"
+        if search and search not in shown.lower():
+            continue
+        lines.append(f"{shown} ({freq} rows)")
+    if not lines:
+        return f"No values of {column} match '{search}'."
+    more = f"\n... {len(lines) - limit} more" if len(lines) > limit else ""
+    return "\n".join(lines[:limit]) + more
+
+
+def make_lookup_tool(value_dictionary):
+    """Build the lookup_column_values tool over a loaded value dictionary."""
+    by_column = {}
+    for table, columns in value_dictionary.items():
+        for column, rows in columns.items():
+            by_column.setdefault(column.upper(), []).append((table, rows))
+
+    def lookup_column_values(column: str, search: str = "") -> str:
+        name = column.strip()
+        table = None
+        if "." in name:
+            table, name = name.split(".", 1)
+        matches = by_column.get(name.upper(), [])
+        if table:
+            matches = [m for m in matches if m[0] == table] or matches
+        if not matches:
+            coded = ", ".join(sorted(by_column))
+            return f"Error: no value dictionary for column '{column}'. Columns with known values: {coded}"
+        return "\n\n".join(
+            f"{t}.{name.upper()}:\n{_format_values(name.upper(), rows, search)}"
+            for t, rows in matches
+        )
+
+    return StructuredTool.from_function(
+        lookup_column_values,
+        name="lookup_column_values",
+        description=(
+            "Look up the distinct values (with code meanings and row counts) of a categorical "
+            "column such as STABBR, CONTROL, REGION, LOCALE, PREDDEG, RELAFFIL or ACCREDAGENCY. "
+            "Input: column name (optionally table.column) and an optional search substring, "
+            "e.g. column='RELAFFIL', search='catholic'. Use this instead of SELECT DISTINCT queries."
+        ),
+    )
+
+
+def create_value_documents(value_dictionary, schema_info, max_values=60):
+    """One retrieval document per profiled column listing its values and labels."""
+    descriptions = {
+        (table, c["column"]): c for table, cols in schema_info.items() for c in cols
+    }
+    docs = []
+    for table, columns in value_dictionary.items():
+        for column, rows in columns.items():
+            meta = descriptions.get((table, column), {})
+            shown = [f"{v} = {label}" if label else f"{v}" for v, _, label in rows[:max_values]]
+            page_content = "\n".join([
+                f"Column: {column}",
+                f"Description: {meta.get('description') or ''}",
+                f"Table: {table}",
+                "Values: " + "; ".join(shown),
+            ])
+            docs.append(Document(
+                page_content=page_content,
+                metadata={
+                    "table_name": table,
+                    "column_name": column,
+                    "data_type": meta.get("data_type") or "",
+                    "description": meta.get("description") or "",
+                    "group_category": meta.get("group") or "",
+                    "type": "values",
+                },
+            ))
+    return docs
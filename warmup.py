@@ -0,0 +1,257 @@
+"""
+Process-wide warm-up of the expensive shared resources.
+
+start() launches one background thread per process, the first time the app
+script runs (the login page), so the work overlaps sign-in instead of
+following it. Stages, in order:
+- database:      fetch and verify schools.db (db_fetch.ensure_db)
+- sqlite pages:  read the file once so its pages are in the OS cache
+- schema:        table metadata (schema_cache), schema_information and the value dictionary
+- embeddings:    load the EMBEDDING_BACKEND model and embed a probe string
+- indexes:       table / column FAISS indexes and the TableRouter
+- model clients: chat clients of providers whose API key is already in the
+                 environment (keys from st.secrets are only loaded after login)
+
+Sessions call attach() to get the shared, read-only resources; each session
+still opens its own engine so cancelling a run only interrupts its own SQL.
+"""
+import os
+import threading
+import time
+
+from langchain_community.vectorstores import FAISS
+from langchain_deepseek import ChatDeepSeek
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+from sqlalchemy import create_engine
+
+from db_fetch import ensure_db
+from embedding_backends import make_embeddings
+from embedding_cache import CachedQueryEmbeddings
+from llm_scheduler import SchedulerGate
+from schema_cache import cached_sql_database
+from schema_index import HELPER_TABLES, load_schema_info, create_schema_documents, build_column_index
+from table_router import TableRouter
+from value_dictionary import load_value_dictionary, create_value_documents
+
+DB_PATH = "schools.db"
+PAGE_CHUNK = 1 << 20
+
+# Strong model per provider, and the API key its client needs
+STRONG_MODELS = {
+    "DeepSeek": "deepseek-chat",
+    "OpenAI GPT-4": "gpt-4",
+    "Google Gemini": "gemini-2.0-flash-exp",
+}
+PROVIDER_KEYS = {
+    "DeepSeek": "DEEPSEEK_API_KEY",
+    "OpenAI GPT-4": "OPENAI_API_KEY",
+    "Google Gemini": "GOOGLE_API_KEY",
+}
+
+STAGES = ["database", "sqlite pages", "schema", "embeddings", "indexes", "model clients"]
+
+# (provider, model name) -> (API key it was built with, client) created during warm-up
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _new_chat_model(provider, name, **kwargs):
+    # Every call of the client waits for a slot from the process-wide LLM scheduler
+    kwargs.setdefault("callbacks", [SchedulerGate(provider)])
+    if provider == "DeepSeek":
+        return ChatDeepSeek(model=name, **kwargs)
+    if provider == "OpenAI GPT-4":
+        return ChatOpenAI(model=name, **kwargs)
+    return ChatGoogleGenerativeAI(model=name, **kwargs)
+
+
+def chat_model(provider, name=None, **kwargs):
+    """
+    Chat client for provider / model name, reusing the one opened during warm-up if any.
+    A warm-up client is only reused while its API key is still the one in the environment,
+    so unloading a key (sign-out) also retires its client. kwargs (e.g. temperature) always
+    give a new client.
+    """
+    name = name or STRONG_MODELS[provider]
+    if kwargs:
+        return _new_chat_model(provider, name, **kwargs)
+    key = os.environ.get(PROVIDER_KEYS.get(provider, ""))
+    with _clients_lock:
+        cached = _clients.get((provider, name))
+        if cached is not None and cached[0] != key:
+            del _clients[(provider, name)]
+            cached = None
+    return cached[1] if cached is not None else _new_chat_model(provider, name)
+
+
+def touch_pages(path, chunk=PAGE_CHUNK):
+    """Read a file sequentially so the first queries do not wait on disk; returns bytes read."""
+    total = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk)
+            if not data:
+                return total
+            total += len(data)
+
+
+class Warmup:
+    """
+    Handle for the warm-up thread.
+    stages: {name: {"status": pending | running | done | skipped | error, "ms", "error"}}
+    resources: shared objects once their stage is done (see attach()).
+    """
+
+    def __init__(self, db_path=DB_PATH, fast_models=None):
+        self.db_path = db_path
+        self.fast_models = fast_models or {}
+        self.stages = {name: {"status": "pending", "ms": None, "error": None} for name in STAGES}
+        self.resources = {}
+        self.warnings = []
+        self.error = None
+        self.started = time.time()
+        self._done = threading.Event()
+        self._thread = None
+
+    # Status
+    @property
+    def ready(self):
+        return self._done.is_set() and self.error is None
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def current_stage(self):
+        for name in STAGES:
+            if self.stages[name]["status"] in ("pending", "running"):
+                return name
+        return None
+
+    def progress(self):
+        finished = sum(1 for s in self.stages.values() if s["status"] in ("done", "skipped"))
+        return finished / len(STAGES)
+
+    def attach(self):
+        """Shared resources for a session; raises the warm-up error if it failed."""
+        self.wait()
+        if self.error is not None:
+            raise self.error
+        return dict(self.resources)
+
+    # Worker
+    def _stage(self, name, fn):
+        stage = self.stages[name]
+        stage["status"] = "running"
+        t0 = time.perf_counter()
+        try:
+            stage["status"] = fn() or "done"
+        except Exception as e:
+            stage["status"] = "error"
+            stage["error"] = str(e)
+            raise
+        finally:
+            stage["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+    def _run(self):
+        r = self.resources
+        try:
+            self._stage("database", self._database)
+            self._stage("sqlite pages", lambda: r.update(page_bytes=touch_pages(self.db_path)))
+            self._stage("schema", self._schema)
+            self._stage("embeddings", self._embeddings)
+            self._stage("indexes", self._indexes)
+            self._stage("model clients", self._model_clients)
+        except Exception as e:
+            self.error = e
+            print(f"Warm-up failed: {e}")
+        finally:
+            self._done.set()
+
+    def _database(self):
+        result = ensure_db(path=self.db_path)
+        self.resources["download"] = result
+        if result["action"] == "failed":
+            raise RuntimeError(f"Could not download the database: {result['error']}")
+
+    def _schema(self):
+        r = self.resources
+        # Used only to build the shared indexes; sessions open their own engines
+        engine = create_engine(f"sqlite:///{self.db_path}", connect_args={"check_same_thread": False})
+        db = cached_sql_database(engine, self.db_path)
+        r["build_db"] = db
+        r["usable_tables"] = [t for t in db.get_usable_table_names() if t.lower() not in HELPER_TABLES]
+        r["schema_info"] = load_schema_info(engine)
+        r["value_dictionary"] = load_value_dictionary(engine, r["usable_tables"])
+
+    def _embeddings(self):
+        backend, name = make_embeddings()
+        embeddings = CachedQueryEmbeddings(backend)
+        # Loads the weights and runs the first (slow) forward pass
+        embeddings.embeddings.embed_query("warm-up")
+        self.resources["embeddings"] = embeddings
+        self.resources["embedding_backend"] = name
+
+    def _indexes(self):
+        r = self.resources
+        value_docs = create_value_documents(r["value_dictionary"], r["schema_info"])
+        schema_docs = create_schema_documents(
+            r["build_db"], r["usable_tables"], r["schema_info"], warn=self.warnings.append
+        )
+        r["schema_doc_count"] = len(schema_docs)
+        r["vectorstore"] = FAISS.from_documents(schema_docs, r["embeddings"])
+        r["column_index"] = build_column_index(
+            r["usable_tables"], r["schema_info"], r["embeddings"], extra_docs=value_docs
+        )
+        r["router"] = TableRouter(
+            r["usable_tables"],
+            r["schema_info"],
+            vectorstore=r["vectorstore"],
+            column_index=r["column_index"],
+            embeddings=r["embeddings"],
+            extra_docs=value_docs,
+        )
+        # Table info rendered for the documents is reused by every session and restart
+        r["build_db"].save()
+
+    def _model_clients(self):
+        opened = 0
+        for provider, key_name in PROVIDER_KEYS.items():
+            key = os.environ.get(key_name)
+            if not key:
+                continue
+            for name in (STRONG_MODELS[provider], self.fast_models.get(provider)):
+                if not name:
+                    continue
+                try:
+                    client = _new_chat_model(provider, name)
+                except Exception as e:
+                    self.warnings.append(f"Could not open {provider} client {name}: {e}")
+                    continue
+                with _clients_lock:
+                    _clients[(provider, name)] = (key, client)
+                opened += 1
+        return "done" if opened else "skipped"
+
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+def start(db_path=DB_PATH, fast_models=None):
+    """Start the process-wide warm-up once and return its handle."""
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None or (_warmup.done() and _warmup.error is not None):
+            # A failed warm-up is retried by the next session that needs it
+            _warmup = Warmup(db_path, fast_models)
+            _warmup._thread = threading.Thread(target=_warmup._run, name="warmup", daemon=True)
+            _warmup._thread.start()
+        return _warmup
+
+
+def get():
+    return _warmup